@@ -12,7 +12,12 @@ del get_versions
 CACHEDIR = Path(os.getenv("ETELEMETRY_CACHE") or Path.home() / ".etcache")
 CACHEDIR.mkdir(parents=True, exist_ok=True)
 
-GITHUB_RELEASE_URL = "https://api.github.com/repos/{owner}/{repo}/releases/latest"
-GITHUB_TAG_URL = "https://api.github.com/repos/{owner}/{repo}/tags"
-GITHUB_ET_FILE = "https://raw.githubusercontent.com/{owner}/{repo}/master/.et"
-IPSTACK_URL = "http://api.ipstack.com/{ip}"
+# upstream services, which can be replaced by local stubs
+GITHUB_API = os.getenv("ETELEMETRY_GITHUB_API", "https://api.github.com")
+GITHUB_RAW = os.getenv("ETELEMETRY_GITHUB_RAW", "https://raw.githubusercontent.com")
+IPSTACK_API = os.getenv("ETELEMETRY_IPSTACK_API", "http://api.ipstack.com")
+
+GITHUB_RELEASE_URL = GITHUB_API + "/repos/{owner}/{repo}/releases/latest"
+GITHUB_TAG_URL = GITHUB_API + "/repos/{owner}/{repo}/tags"
+GITHUB_ET_FILE = GITHUB_RAW + "/{owner}/{repo}/master/.et"
+IPSTACK_URL = IPSTACK_API + "/{ip}"
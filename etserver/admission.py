@@ -0,0 +1,87 @@
+"""Admission control of incoming requests"""
+from contextlib import contextmanager
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed to protect the server"""
+
+    def __init__(self, retry_after):
+        super().__init__("server is overloaded")
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Shed low priority requests while the server is over budget
+
+    The server is over budget when too many requests are handled at once, or
+    when the event loop lags behind, meaning callbacks wait to be run.
+
+    Parameters
+    ----------
+    max_inflight : int
+        number of requests handled at once before shedding
+    max_lag : float
+        seconds of event loop lag before shedding
+    retry_after : float
+        seconds clients are asked to wait before retrying
+    monitor : LoopMonitor
+        monitor of the event loop whose lag is read, if any
+    """
+
+    def __init__(self, max_inflight=256, max_lag=0.2, retry_after=2, monitor=None):
+        self.max_inflight = max_inflight
+        self.max_lag = max_lag
+        self.retry_after = retry_after
+        self.monitor = monitor
+        self.inflight = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @property
+    def lag(self):
+        """Seconds of event loop lag last measured by the monitor"""
+        return self.monitor.lag if self.monitor is not None else 0.0
+
+    @property
+    def overloaded(self):
+        """Whether low priority requests are currently shed"""
+        return self.inflight >= self.max_inflight or self.lag > self.max_lag
+
+    @contextmanager
+    def admit(self, shed=False):
+        """
+        Count a request as in flight for the duration of the block
+
+        :param shed: whether the request is rejected while overloaded
+        :raises Overloaded: if the request is shed
+        """
+        if shed:
+            self.check()
+        self.inflight += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    def check(self):
+        """Reject a low priority request while overloaded"""
+        if self.overloaded:
+            self.reject()
+
+    def reject(self):
+        """Shed a request, raising `Overloaded`"""
+        self.rejected += 1
+        raise Overloaded(self.retry_after)
+
+    def stats(self):
+        """Return the current load and admission counts"""
+        return {
+            "inflight": self.inflight,
+            "lag": round(self.lag, 6),
+            "overloaded": self.overloaded,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
@@ -0,0 +1,236 @@
+"""Columnar archive of historical requests
+
+Closed weeks of the `requests` collection are exported to compressed NumPy
+partitions, one file per week, which can be analyzed without mongo running.
+"""
+import datetime
+import os
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from . import CACHEDIR, logger
+from .utils import get_current_time, timefmt, week_start
+
+ARCHIVEDIR = Path(os.getenv("ETELEMETRY_ARCHIVE") or CACHEDIR / "archive")
+
+
+def partition_path(start, archivedir=ARCHIVEDIR):
+    """Return the archive file of the week starting at `start`"""
+    return Path(archivedir) / "requests-{:%Y-%m-%d}.npz".format(start)
+
+
+def list_partitions(archivedir=ARCHIVEDIR):
+    """Return all archived partitions, oldest first"""
+    return sorted(Path(archivedir).glob("requests-*.npz"))
+
+
+def partition_start(path):
+    """Return the start of the week covered by an archived partition"""
+    return datetime.datetime.strptime(Path(path).stem, "requests-%Y-%m-%d")
+
+
+async def export_requests(mongo, before=None, archivedir=ARCHIVEDIR):
+    """
+    Export closed weeks of request documents to the archive
+
+    Weeks that are already archived are skipped, so the export can be
+    interrupted and resumed.
+
+    Parameters
+    ----------
+    mongo : MongoClientHelper
+        database helper
+    before : datetime, optional
+        only weeks ending before this UTC time are exported, defaults to now
+
+    Returns
+    -------
+    written : list of Path
+        newly archived partitions
+    """
+    Path(archivedir).mkdir(parents=True, exist_ok=True)
+    first = await mongo.requests.find_one(
+        {}, projection={"access_time": True}, sort=[("access_time", 1)]
+    )
+    if first is None:
+        return []
+    if before is None:
+        before = datetime.datetime.strptime(await get_current_time(), timefmt)
+    start = week_start(datetime.datetime.strptime(first["access_time"], timefmt))
+    end = week_start(before)
+    written = []
+    while start < end:
+        stop = start + datetime.timedelta(weeks=1)
+        path = partition_path(start, archivedir)
+        if not path.exists():
+            cursor = mongo.requests.find(
+                {
+                    "access_time": {
+                        "$gte": start.strftime(timefmt),
+                        "$lt": stop.strftime(timefmt),
+                    }
+                },
+                projection={"_id": False, "access_time": True, "request": True},
+                batch_size=10000,
+            )
+            docs = [doc async for doc in cursor]
+            write_partition(path, docs)
+            logger.info(f"Archived {len(docs)} requests to {path}")
+            written.append(path)
+        start = stop
+    return written
+
+
+def write_partition(path, docs):
+    """
+    Write request documents to a compressed columnar partition
+
+    Project and version columns hold indices into the `projects` and
+    `versions` lookup arrays stored alongside them. The file is written
+    atomically, so a partition either exists whole or not at all.
+    """
+    projects, versions = {}, {}
+    size = len(docs)
+    access_time = np.empty(size, dtype="U19")
+    project = np.empty(size, dtype=np.int32)
+    version = np.empty(size, dtype=np.int32)
+    status_code = np.zeros(size, dtype=np.int16)
+    cached = np.zeros(size, dtype=bool)
+    is_ci = np.zeros(size, dtype=bool)
+    for i, doc in enumerate(docs):
+        req = doc.get("request", {})
+        # drop the quotes and zone designator of the UTC time string
+        access_time[i] = doc["access_time"][:-1].replace("'", "")
+        name = "{}/{}".format(req.get("owner"), req.get("repository"))
+        project[i] = projects.setdefault(name, len(projects))
+        version[i] = versions.setdefault(str(req.get("version")), len(versions))
+        status_code[i] = req.get("status_code") or 0
+        cached[i] = bool(req.get("cached"))
+        is_ci[i] = bool(req.get("is_ci"))
+
+    save_partition(
+        path,
+        access_time=access_time.astype("datetime64[s]").astype(np.int64),
+        project=project,
+        version=version,
+        status_code=status_code,
+        cached=cached,
+        is_ci=is_ci,
+        projects=np.array(list(projects), dtype=str),
+        versions=np.array(list(versions), dtype=str),
+    )
+
+
+def save_partition(path, **columns):
+    """
+    Atomically write the columns and lookup arrays of a partition
+
+    `access_time` holds epoch seconds, see `write_partition` for the others.
+    """
+    path = Path(path)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "wb") as fp:
+        np.savez_compressed(fp, **columns)
+    os.replace(tmp, path)
+
+
+def read_partition(path):
+    """Load all columns and lookup arrays of a partition"""
+    with np.load(path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+
+def year_weeks(access_time):
+    """
+    Compute year and week numbers of epoch seconds
+
+    Weeks start on Sundays and days preceding the first Sunday of the year are
+    in week 0, matching the `$week` operator of mongo.
+    """
+    days = access_time.astype("datetime64[s]").astype("datetime64[D]")
+    years = days.astype("datetime64[Y]")
+    yday = (days - years.astype("datetime64[D]")).astype(np.int64)
+    # 1970-01-01 was a Thursday
+    wday = (days.astype(np.int64) + 4) % 7
+    return years.astype(np.int64) + 1970, (yday + 7 - wday) // 7
+
+
+def partition_counts(path, project=None, by_version=False):
+    """
+    Count requests of a partition per project and week
+
+    Returns
+    -------
+    counts : Counter
+        keyed by (project, "year-week") or (project, "year-week", version)
+    """
+    data = read_partition(path)
+    projects = data["projects"]
+    mask = np.ones(len(data["project"]), dtype=bool)
+    if project is not None:
+        ids = np.flatnonzero(projects == project)
+        if not len(ids):
+            return Counter()
+        mask = data["project"] == ids[0]
+    years, weeks = year_weeks(data["access_time"][mask])
+    # pack all grouping fields into a single integer key
+    keys = data["project"][mask].astype(np.int64) * 1000000 + years * 100 + weeks
+    if by_version:
+        keys = keys * len(data["versions"]) + data["version"][mask]
+    uniq, counts = np.unique(keys, return_counts=True)
+
+    out = Counter()
+    for key, count in zip(uniq.tolist(), counts.tolist()):
+        if by_version:
+            key, vid = divmod(key, len(data["versions"]))
+        pid, yearweek = divmod(key, 1000000)
+        name = (str(projects[pid]), "{}-{:02d}".format(*divmod(yearweek, 100)))
+        if by_version:
+            name += (str(data["versions"][vid]),)
+        out[name] += count
+    return out
+
+
+def weekly_counts(project=None, by_version=False, processes=None, paths=None):
+    """
+    Roll up archived requests per project and week
+
+    Partitions are processed in parallel by a pool of processes.
+
+    Parameters
+    ----------
+    project : str, optional
+        restrict counts to a single "owner/repo" project
+    by_version : bool
+        additionally count requests per reported version
+    processes : int, optional
+        size of the process pool, defaults to the number of CPUs
+    paths : list of Path, optional
+        partitions to read, defaults to the whole archive
+
+    Returns
+    -------
+    counts : dict
+        mapping of project to weekly counts, or to weekly counts per version
+    """
+    paths = list_partitions() if paths is None else paths
+    total = Counter()
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = [
+            pool.submit(partition_counts, path, project, by_version) for path in paths
+        ]
+        for future in futures:
+            total.update(future.result())
+
+    out = {}
+    for key, count in sorted(total.items()):
+        if by_version:
+            name, yearweek, version = key
+            out.setdefault(name, {}).setdefault(yearweek, {})[version] = count
+        else:
+            name, yearweek = key
+            out.setdefault(name, {})[yearweek] = count
+    return out
@@ -0,0 +1,443 @@
+"""End-to-end load benchmark
+
+The server runs in its own process against local stubs of GitHub and
+ipstack, with configurable latency and error rate, and with an in-memory
+stand-in for mongo. A closed loop of clients sends a mix of requests:
+
+- hot: lookups of a few popular, freshly cached projects
+- cold: lookups of projects never seen before
+- stale: lookups of projects whose cache has to be refreshed
+- stats: weekly statistics of popular projects
+- batch: batch lookups of popular projects
+
+Latency percentiles and throughput are reported per kind of request, and
+saved as JSON to compare runs across commits.
+"""
+import asyncio
+import datetime
+import json
+import multiprocessing
+import os
+import random
+import socket
+import subprocess
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+import aiohttp
+from aiohttp import web
+
+from .database import gen_mongo_doc, gen_request_info, stats_start
+from .utils import timefmt
+
+# weights of each kind of request
+MIX = dict(hot=0.7, cold=0.05, stale=0.1, stats=0.1, batch=0.05)
+ROUTES = dict(
+    hot="GET /projects/<project>",
+    cold="GET /projects/<project>",
+    stale="GET /projects/<project>",
+    stats="GET /stats/<project>",
+    batch="POST /projects",
+)
+
+
+class MemoryMongo:
+    """
+    In-memory stand-in for `MongoClientHelper`
+
+    :param docs: request documents to start with
+    """
+
+    def __init__(self, docs=()):
+        self.requests = list(docs)
+        self.geoloc = {}
+        self.pending = set()
+
+    async def is_valid(self):
+        pass
+
+    async def close(self, timeout=None):
+        pass
+
+    async def insert_project(self, rip, owner, repo, project_info):
+        doc = await gen_mongo_doc(rip)
+        doc["request"] = gen_request_info(owner, repo, project_info)
+        self.requests.append(doc)
+
+    async def insert_projects(self, rip, projects):
+        base = await gen_mongo_doc(rip)
+        self.requests.extend(
+            dict(base, request=gen_request_info(owner, repo, project_info))
+            for owner, repo, project_info in projects
+        )
+
+    async def query_geocookie(self, ip):
+        return self.geoloc.get(ip)
+
+    async def insert_geo(self, rip, geoloc):
+        doc = await gen_mongo_doc(rip)
+        doc.update(geoloc)
+        self.geoloc[rip] = doc
+
+    async def get_status(self, owner, repo, stats=None):
+        counts = await self._counts({(owner, repo): stats})
+        return dict(sorted(dict(stats or {}, **counts.get((owner, repo), {})).items()))
+
+    async def get_statuses(self, projects):
+        for (owner, repo), docs in sorted((await self._counts(projects)).items()):
+            yield owner, repo, docs
+
+    async def _counts(self, projects):
+        starts = {key: stats_start(stats) for key, stats in projects.items()}
+        counts = {}
+        for doc in self.requests:
+            key = (doc["request"]["owner"], doc["request"]["repository"])
+            if key in starts and doc["access_time"] >= starts[key]:
+                date = datetime.datetime.strptime(doc["access_time"], timefmt)
+                yearweek = date.strftime("%Y-%U")
+                weeks = counts.setdefault(key, {})
+                weeks[yearweek] = weeks.get(yearweek, 0) + 1
+        return counts
+
+
+def stub_app(latency=0.05, error_rate=0.0, seed=0):
+    """
+    Create stubs of the GitHub API, raw GitHub files and ipstack
+
+    Repositories named "tagged*" have tags but no release.
+
+    :param latency: seconds taken by each response
+    :param error_rate: fraction of responses failing with a 500
+    """
+    rng = random.Random(seed)
+
+    def stub(func):
+        async def handler(request):
+            await asyncio.sleep(latency)
+            if rng.random() < error_rate:
+                return web.json_response({"message": "stub error"}, status=500)
+            return func(request)
+
+        return handler
+
+    @stub
+    def release(request):
+        if request.match_info["repo"].startswith("tagged"):
+            return web.json_response({"message": "Not Found"}, status=404)
+        return web.json_response({"tag_name": "v1.0.0", "name": "1.0.0"})
+
+    @stub
+    def tags(request):
+        return web.json_response([{"name": "v0.9.0"}])
+
+    @stub
+    def et_file(request):
+        return web.Response(text=json.dumps({"bad_versions": ["0.1.0"]}))
+
+    @stub
+    def geolocation(request):
+        return web.json_response(
+            {
+                "ip": request.match_info["ip"],
+                "continent_name": "North America",
+                "country_name": "United States",
+                "region_name": "Massachusetts",
+                "city": "Cambridge",
+                "latitude": 42.36,
+                "longitude": -71.09,
+            }
+        )
+
+    app = web.Application()
+    app.router.add_get("/repos/{owner}/{repo}/releases/latest", release)
+    app.router.add_get("/repos/{owner}/{repo}/tags", tags)
+    app.router.add_get("/{owner}/{repo}/master/.et", et_file)
+    app.router.add_get("/{ip}", geolocation)
+    return app
+
+
+def seed_cache(cachedir, hot=20, stale=20000):
+    """Cache fresh information of hot projects, and stale one of others"""
+    now = datetime.datetime.utcnow()
+    for name, count, updated in (
+        ("hot", hot, now),
+        ("stale", stale, now - datetime.timedelta(days=30)),
+    ):
+        info = {
+            "version": "0.9.0",
+            "status": 200,
+            "last_update": updated.strftime(timefmt),
+        }
+        for i in range(count):
+            path = Path(cachedir) / f"{name}--p{i}.json"
+            path.write_text(json.dumps(info))
+
+
+def seed_requests(hot=20, weeks=52, per_week=20, seed=0):
+    """Generate past request documents of hot projects"""
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    docs = []
+    for i in range(hot):
+        for _ in range(weeks * per_week):
+            when = now - datetime.timedelta(seconds=rng.randrange(weeks * 7 * 86400))
+            docs.append(
+                {
+                    "access_time": when.strftime(timefmt),
+                    "remote_addr": f"10.0.0.{rng.randrange(256)}",
+                    "request": gen_request_info(
+                        "hot", f"p{i}", {"version": "0.9.0", "status": 200}
+                    ),
+                }
+            )
+    return docs
+
+
+def run_server(port, cachedir, hot):
+    """Run the server against the in-memory stand-in for mongo"""
+    os.chdir(cachedir)
+    from . import serve
+
+    docs = seed_requests(hot)
+    serve.MongoClientHelper = lambda: MemoryMongo(docs)
+    # all clients of the benchmark share an IP
+    serve.app.config.RATE_LIMIT = None
+    serve.app.config.TRACE_SAMPLING = 0
+    serve.app.run(host="127.0.0.1", port=port)
+
+
+class Traffic:
+    """Generate requests of each kind"""
+
+    def __init__(self, hot=20, stale=20000, batch_size=10, seed=0):
+        self.rng = random.Random(seed)
+        self.hot = hot
+        self.stale = stale
+        self.batch_size = batch_size
+        self.run = f"{seed}-{os.getpid()}-{int(time.time())}"
+        self.counts = Counter()
+
+    def hot_project(self):
+        # a few projects get most requests
+        return f"hot/p{min(int(self.rng.paretovariate(1.2)) - 1, self.hot - 1)}"
+
+    def request(self, kind):
+        """Return the method, path and body of a request"""
+        self.counts[kind] += 1
+        count = self.counts[kind]
+        if kind == "hot":
+            return "GET", f"/projects/{self.hot_project()}", None
+        if kind == "cold":
+            return "GET", f"/projects/cold/p{count}-{self.run}", None
+        if kind == "stale":
+            return "GET", f"/projects/stale/p{count % self.stale}", None
+        if kind == "stats":
+            return "GET", f"/stats/{self.hot_project()}", None
+        projects = list({self.hot_project() for _ in range(self.batch_size)})
+        return "POST", "/projects", projects
+
+
+async def drive(url, mix, duration, concurrency, traffic):
+    """
+    Send requests from a closed loop of clients
+
+    :return: latencies (secs) and status codes per kind of request, elapsed time
+    """
+    kinds = list(mix)
+    weights = [mix[kind] for kind in kinds]
+    latencies = {kind: [] for kind in kinds}
+    statuses = {kind: Counter() for kind in kinds}
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        end = start + duration
+
+        async def client():
+            while time.perf_counter() < end:
+                kind = traffic.rng.choices(kinds, weights)[0]
+                method, path, body = traffic.request(kind)
+                sent = time.perf_counter()
+                try:
+                    async with session.request(method, url + path, json=body) as resp:
+                        await resp.read()
+                        status = resp.status
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    status = "error"
+                latencies[kind].append(time.perf_counter() - sent)
+                statuses[kind][str(status)] += 1
+
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+        elapsed = time.perf_counter() - start
+    return latencies, statuses, elapsed
+
+
+def summarize(latencies, statuses, elapsed):
+    """
+    Compute throughput and latency percentiles
+
+    :return: summary per kind of request and overall
+    """
+
+    def summary(values, codes):
+        values = sorted(values)
+        out = {
+            "requests": len(values),
+            "errors": sum(n for code, n in codes.items() if not code.startswith("2")),
+            "statuses": dict(sorted(codes.items())),
+            "rps": round(len(values) / elapsed, 2),
+        }
+        for name, q in (("p50", 0.5), ("p99", 0.99), ("p999", 0.999)):
+            value = values[int(q * (len(values) - 1))] if values else None
+            out[f"{name}_ms"] = None if value is None else round(value * 1000, 3)
+        return out
+
+    out = {}
+    for kind in latencies:
+        out[kind] = summary(latencies[kind], statuses[kind])
+    total = Counter()
+    for codes in statuses.values():
+        total.update(codes)
+    out["total"] = summary(sum(latencies.values(), []), total)
+    return out
+
+
+def git_commit():
+    """Return the commit of the working tree, if any"""
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=str(Path(__file__).parent),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return out.stdout.decode().strip()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_server(url, timeout=30):
+    async with aiohttp.ClientSession() as session:
+        for _ in range(int(timeout / 0.1)):
+            try:
+                async with session.get(url + "/") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("Server did not start")
+
+
+async def benchmark(
+    duration=10,
+    warmup=2,
+    concurrency=32,
+    mix=None,
+    latency=0.05,
+    error_rate=0.0,
+    hot=20,
+    stale=20000,
+    seed=0,
+):
+    """
+    Run a load benchmark
+
+    Parameters
+    ----------
+    duration : float
+        seconds of measured traffic
+    warmup : float
+        seconds of traffic sent before measuring
+    concurrency : int
+        number of clients
+    mix : dict
+        weights of each kind of request, defaults to `MIX`
+    latency : float
+        seconds taken by each response of the upstream stubs
+    error_rate : float
+        fraction of upstream responses failing
+    hot : int
+        number of popular projects
+    stale : int
+        number of projects with a stale cache
+    seed : int
+        seed of the random traffic
+
+    Returns
+    -------
+    results : dict
+        configuration, commit and summary per kind of request
+    """
+    mix = mix or MIX
+    config = {
+        "duration": duration,
+        "warmup": warmup,
+        "concurrency": concurrency,
+        "mix": mix,
+        "latency": latency,
+        "error_rate": error_rate,
+        "hot": hot,
+        "stale": stale,
+        "seed": seed,
+    }
+    with tempfile.TemporaryDirectory() as cachedir:
+        seed_cache(cachedir, hot, stale)
+        runners = []
+        env = {}
+        for name in ("GITHUB_API", "GITHUB_RAW", "IPSTACK_API"):
+            runner = web.AppRunner(stub_app(latency, error_rate, seed))
+            await runner.setup()
+            port = free_port()
+            await web.TCPSite(runner, "127.0.0.1", port).start()
+            runners.append(runner)
+            env[f"ETELEMETRY_{name}"] = f"http://127.0.0.1:{port}"
+
+        saved = dict(os.environ)
+        os.environ.update(env, ETELEMETRY_CACHE=cachedir, IPSTACK_API_KEY="bench")
+        port = free_port()
+        server = multiprocessing.get_context("spawn").Process(
+            target=run_server, args=(port, cachedir, hot)
+        )
+        server.start()
+        os.environ.clear()
+        os.environ.update(saved)
+        url = f"http://127.0.0.1:{port}"
+        try:
+            await wait_server(url)
+            traffic = Traffic(hot, stale, seed=seed)
+            if warmup:
+                await drive(url, mix, warmup, concurrency, traffic)
+            results = summarize(*await drive(url, mix, duration, concurrency, traffic))
+            for kind in mix:
+                results[kind]["route"] = ROUTES[kind]
+        finally:
+            server.terminate()
+            server.join()
+            for runner in runners:
+                await runner.cleanup()
+    return {
+        "commit": git_commit(),
+        "date": datetime.datetime.utcnow().strftime(timefmt),
+        "config": config,
+        "results": results,
+    }
+
+
+def parse_mix(value):
+    """Parse weights of request kinds given as `hot=0.7,cold=0.1,...`"""
+    mix = {}
+    for item in value.split(","):
+        kind, _, weight = item.partition("=")
+        if kind not in ROUTES:
+            raise ValueError(f"Unknown kind of request {kind}")
+        mix[kind] = float(weight)
+    return mix
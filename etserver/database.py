@@ -1,11 +1,14 @@
 """Database worker"""
+import asyncio
 import os
 import datetime
+import time
 
 import motor.motor_asyncio as amotor
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 
 from . import logger
+from .metrics import MONGO_LATENCY
 from .utils import get_current_time, timefmt
 
 
@@ -19,6 +22,11 @@ class MongoClientHelper:
         self.db = self.client[os.getenv("ETELEMETRY_DB", "et")]
         self.requests = self.db["requests"]
         self.geoloc = self.db["geo"]
+        # weekly request counts of raw documents removed by retention
+        self.rollups = self.db["rollups"]
+        self.maintenance = self.db["maintenance"]
+        # writes which are not awaited by requests
+        self.pending = set()
 
     async def is_valid(self):
         """Run mongo command to ensure valid connection"""
@@ -29,87 +37,225 @@ class MongoClientHelper:
             logger.critical("Server is not available")
             raise
 
+    async def close(self, timeout=None):
+        """
+        Wait for pending writes, then close the connection
+
+        :param timeout: seconds after which pending writes are abandoned
+        """
+        if self.pending:
+            _, pending = await asyncio.wait(set(self.pending), timeout=timeout)
+            if pending:
+                logger.warning(f"Closing with {len(pending)} pending writes")
+        self.client.close()
+
+    def _track(self, operation, future):
+        start = time.monotonic()
+        self.pending.add(future)
+        future.add_done_callback(lambda f: self._written(operation, start, f))
+
+    def _written(self, operation, start, future):
+        MONGO_LATENCY.observe(time.monotonic() - start, operation)
+        self.pending.discard(future)
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Failed write: {future.exception()!r}")
+
     async def insert_project(self, rip, owner, repo, project_info):
         """Insert project information into collection"""
 
         doc = await gen_mongo_doc(rip)
+        doc.update({"request": gen_request_info(owner, repo, project_info)})
+        self._track("insert_request", self.requests.insert_one(doc))
 
-        rinfo = {
-            "owner": owner,
-            "repository": repo,
-            "version": project_info.get("version"),
-            "cached": project_info.get("cached"),
-            "status_code": project_info.get("status"),
-            "is_ci": project_info.get("is_ci", False),
-        }
-        doc.update({"request": rinfo})
-        self.requests.insert_one(doc)
+    async def insert_projects(self, rip, projects):
+        """
+        Insert information for several projects with a single bulk write
+
+        :param projects: iterable of (owner, repo, project_info) tuples
+        """
+        base = await gen_mongo_doc(rip)
+        docs = [
+            dict(base, request=gen_request_info(owner, repo, project_info))
+            for owner, repo, project_info in projects
+        ]
+        if docs:
+            self._track(
+                "insert_requests", self.requests.insert_many(docs, ordered=False)
+            )
 
     async def query_geocookie(self, ip):
         """Search for request IP in collection"""
+        start = time.monotonic()
         entry = await self.geoloc.find_one({"remote_addr": ip})
+        MONGO_LATENCY.observe(time.monotonic() - start, "find_geo")
         return entry
 
     async def insert_geo(self, rip, geoloc):
         """Cache request geo information to collection"""
         doc = await gen_mongo_doc(rip)
         doc.update(geoloc)
-        self.geoloc.insert_one(doc)
-
-    async def get_status(self, owner, repo, project_info):
-        year = 2019
-        week = 0
-        response = {}
-        if project_info is not None and "stats" in project_info:
-            lastkey = sorted(project_info["stats"])[-1]
-            year, week = lastkey.split("-")
-            year, week = int(year), int(week)
-            response = project_info["stats"]
-        startdate = datetime.datetime(year, 1, 1) + datetime.timedelta(
-            weeks=max(week - 1, 0)
-        )
-        pipeline = [
-            {
-                "$match": {
-                    "access_time": {"$gte": startdate.strftime(timefmt)},
-                    "request.repository": repo,
-                    "request.owner": owner,
-                }
-            },
-            {
-                "$group": {
-                    "_id": {
-                        "year": {
-                            "$year": {
-                                "$dateFromString": {
-                                    "dateString": "$access_time",
-                                    "format": "%Y-%m-%d'T'%H:%M:%SZ",
-                                }
-                            }
-                        },
-                        "week": {
-                            "$week": {
-                                "$dateFromString": {
-                                    "dateString": "$access_time",
-                                    "format": "%Y-%m-%d'T'%H:%M:%SZ",
-                                }
-                            }
-                        },
-                    },
-                    "count": {"$sum": 1},
-                }
-            },
-            {"$sort": {"_id.year": 1, "_id.week": 1}},
-        ]
+        self._track("insert_geo", self.geoloc.insert_one(doc))
+
+    async def get_status(self, owner, repo, stats=None):
+        """
+        Aggregate weekly request counts of a project
+
+        :param stats: previously computed counts, only the weeks from the
+            last one onwards are aggregated again
+        """
+        response = dict(stats or {})
+        match = {
+            "access_time": {"$gte": stats_start(response)},
+            "request.repository": repo,
+            "request.owner": owner,
+        }
         docs = {}
-        async for val in self.requests.aggregate(pipeline):
+        start = time.monotonic()
+        async for val in self.requests.aggregate(gen_stats_pipeline(match)):
             docs[f'{val["_id"]["year"]}-{val["_id"]["week"]:02d}'] = val["count"]
+        MONGO_LATENCY.observe(time.monotonic() - start, "aggregate_stats")
         if docs:
             response.update(**docs)
-        return response
+        # rolled up weeks are complete, unlike partially deleted raw ones
+        rollups = await self.get_rollups({(owner, repo): stats})
+        response.update(**rollups.get((owner, repo), {}))
+        return dict(sorted(response.items()))
+
+    async def get_rollups(self, projects):
+        """
+        Look up rolled up weekly counts of several projects
+
+        :param projects: mapping of (owner, repo) to previously computed stats
+        :return: mapping of (owner, repo) to weekly counts
+        """
+        query = {
+            "$or": [
+                {
+                    "owner": owner,
+                    "repository": repo,
+                    "window": {"$gte": stats_start(stats, margin=1)},
+                }
+                for (owner, repo), stats in projects.items()
+            ]
+        }
+        rollups = {}
+        start = time.monotonic()
+        async for val in self.rollups.find(query):
+            key = (val["owner"], val["repository"])
+            yearweek = f'{val["year"]}-{val["week"]:02d}'
+            rollups.setdefault(key, {})[yearweek] = val["count"]
+        MONGO_LATENCY.observe(time.monotonic() - start, "find_rollups")
+        return rollups
+
+    async def get_statuses(self, projects):
+        """
+        Aggregate weekly request counts of several projects in a single pass
+
+        :param projects: mapping of (owner, repo) to previously computed stats
+        :return: async generator of (owner, repo, stats) tuples for projects
+            with new requests
+        """
+        if not projects:
+            return
+        rollups = await self.get_rollups(projects)
+        match = {
+            "$or": [
+                {
+                    "request.owner": owner,
+                    "request.repository": repo,
+                    "access_time": {"$gte": stats_start(stats)},
+                }
+                for (owner, repo), stats in projects.items()
+            ]
+        }
+        pipeline = gen_stats_pipeline(
+            match, owner="$request.owner", repository="$request.repository"
+        )
+        pipeline[-1]["$sort"] = {
+            "_id.owner": 1,
+            "_id.repository": 1,
+            "_id.year": 1,
+            "_id.week": 1,
+        }
+        current, docs = None, {}
+        async for val in self.requests.aggregate(pipeline):
+            key = (val["_id"]["owner"], val["_id"]["repository"])
+            if key != current:
+                if current is not None:
+                    docs.update(rollups.pop(current, {}))
+                    yield current + (docs,)
+                current, docs = key, {}
+            docs[f'{val["_id"]["year"]}-{val["_id"]["week"]:02d}'] = val["count"]
+        if current is not None:
+            docs.update(rollups.pop(current, {}))
+            yield current + (docs,)
+        # projects whose new requests were all rolled up
+        for key, docs in rollups.items():
+            yield key + (docs,)
+
+
+def stats_start(stats, margin=0):
+    """
+    Return the start of the last week covered by stats as a time string
+
+    Weeks are numbered as with the `$week` operator of mongo: they start on
+    Sundays, and week 0 holds the days of a year before its first Sunday.
+
+    :param margin: number of additional weeks to go back
+    """
+    year = 2019
+    week = 0
+    if stats:
+        lastkey = sorted(stats)[-1]
+        year, week = lastkey.split("-")
+        year, week = int(year), int(week)
+    startdate = datetime.datetime(year, 1, 1)
+    if week:
+        # first Sunday of the year, which starts week 1
+        startdate += datetime.timedelta(days=(6 - startdate.weekday()) % 7)
+        startdate += datetime.timedelta(weeks=week - 1)
+    startdate -= datetime.timedelta(weeks=margin)
+    return startdate.strftime(timefmt)
+
+
+def gen_stats_pipeline(match, **group):
+    """
+    Helper method for preparing a weekly request count aggregation
+
+    :param match: filter on request documents
+    :param group: additional fields to group documents by
+    """
+    date = {
+        "$dateFromString": {
+            "dateString": "$access_time",
+            "format": "%Y-%m-%d'T'%H:%M:%SZ",
+        }
+    }
+    return [
+        {"$match": match},
+        {
+            "$group": {
+                "_id": dict(group, year={"$year": date}, week={"$week": date}),
+                "count": {"$sum": 1},
+            }
+        },
+        {"$sort": {"_id.year": 1, "_id.week": 1}},
+    ]
 
 
 async def gen_mongo_doc(ip):
     """Helper method for preparing mongo documents"""
     doc = {"access_time": await get_current_time(), "remote_addr": ip}
     return doc
+
+
+def gen_request_info(owner, repo, project_info):
+    """Helper method for preparing the request field of a project document"""
+    return {
+        "owner": owner,
+        "repository": repo,
+        "version": project_info.get("version"),
+        "cached": project_info.get("cached"),
+        "status_code": project_info.get("status"),
+        "is_ci": project_info.get("is_ci", False),
+    }
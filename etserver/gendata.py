@@ -0,0 +1,341 @@
+"""Synthetic telemetry for scale testing
+
+Request and geolocation documents are generated in the schema written by
+`MongoClientHelper`, with
+
+- project popularity following a Zipf law
+- requests following a daily cycle, except those from CI which are uniform
+- a share of requests from continuous integration
+- a share of requests from IPs seen before
+
+Requests are generated a week at a time, each week from its own seed derived
+from the global one, so the output only depends on the seed and not on the
+number of processes. Weeks are written to mongo with bulk inserts, to the
+columnar archive, or to JSON lines which `mongoimport` can load.
+"""
+import datetime
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+
+from .archive import partition_path, save_partition
+from .utils import timefmt, week_start
+
+TARGETS = ("mongo", "archive", "jsonl")
+
+PROFILE = dict(
+    # number of projects, and exponent of their popularity
+    projects=1000,
+    zipf=1.2,
+    # fraction of requests from continuous integration
+    ci_share=0.3,
+    # fraction of requests from an IP which was seen before
+    ip_reuse=0.9,
+    # hour (UTC) and relative amplitude of the daily peak of requests
+    peak_hour=15,
+    diurnal=0.6,
+    # fraction of requests answered from the project cache
+    cached_share=0.9,
+)
+
+# continent, country, region, city, latitude, longitude
+LOCATIONS = (
+    ("North America", "United States", "Massachusetts", "Cambridge", 42.37, -71.11),
+    ("North America", "United States", "California", "San Francisco", 37.77, -122.42),
+    ("North America", "Canada", "Quebec", "Montreal", 45.50, -73.57),
+    ("Europe", "Germany", "Berlin", "Berlin", 52.52, 13.40),
+    ("Europe", "United Kingdom", "England", "London", 51.51, -0.13),
+    ("Europe", "France", "Ile-de-France", "Paris", 48.86, 2.35),
+    ("Asia", "Japan", "Tokyo", "Tokyo", 35.68, 139.69),
+    ("Asia", "China", "Beijing", "Beijing", 39.90, 116.41),
+    ("Oceania", "Australia", "Victoria", "Melbourne", -37.81, 144.96),
+    ("South America", "Brazil", "Sao Paulo", "Sao Paulo", -23.55, -46.63),
+)
+# geolocations generated per task
+GEO_BATCH = 100000
+# reported versions lag behind the latest minor version of each project
+MAX_MINOR = 30
+
+
+def project_names(count):
+    """Return "owner/repo" names of projects, the most popular first"""
+    return [f"owner{k // 10}/repo{k}" for k in range(count)]
+
+
+def version_names():
+    return [f"1.{minor}.0" for minor in range(MAX_MINOR + 1)]
+
+
+def ip_addresses(index):
+    """Map indices of the IP pool to distinct IPv4 addresses"""
+    # odd multipliers permute integers modulo 2 ** 32
+    ips = (index.astype(np.uint64) * 2654435761 + 0x0A000000) % 2 ** 32
+    octets = ips.astype(">u4").view(np.uint8).reshape(-1, 4)
+    return [".".join(map(str, ip)) for ip in octets.tolist()]
+
+
+def time_strings(seconds):
+    """Format epoch seconds as UTC time strings"""
+    times = np.datetime_as_string(seconds.astype("datetime64[s]"))
+    return [f"{t[:10]}'T'{t[11:]}Z" for t in times.tolist()]
+
+
+def plan_weeks(requests, start, end):
+    """
+    Split requests over the weeks between two datetimes
+
+    :return: list of (index, start, stop, count), with epoch second bounds
+    """
+    epoch = datetime.datetime(1970, 1, 1)
+    first, last = (int((date - epoch).total_seconds()) for date in (start, end))
+    bounds = []
+    day = week_start(start)
+    while day < end:
+        lo = int((day - epoch).total_seconds())
+        bounds.append((max(lo, first), min(lo + 7 * 86400, last)))
+        day += datetime.timedelta(weeks=1)
+    # requests proportional to the length of each week
+    lengths = [hi - lo for lo, hi in bounds]
+    edges = np.round(np.cumsum([0] + lengths) * requests / (last - first))
+    counts = np.diff(edges.astype(np.int64)).tolist()
+    return [
+        (index, lo, hi, count)
+        for index, ((lo, hi), count) in enumerate(zip(bounds, counts))
+    ]
+
+
+def generate_week(index, lo, hi, count, pool, seed=0, **profile):
+    """
+    Generate columns of the requests of a week
+
+    Parameters
+    ----------
+    index : int
+        index of the week, deriving its seed
+    lo, hi : int
+        epoch seconds bounding the requests
+    count : int
+        number of requests
+    pool : int
+        number of distinct IPs
+    seed : int
+        global seed
+    profile : dict
+        overrides of `PROFILE`
+
+    Returns
+    -------
+    columns : dict
+        arrays of epoch seconds (`access_time`), project, version and IP pool
+        indices, status codes, `cached` and `is_ci` flags
+    """
+    profile = dict(PROFILE, **profile)
+    rng = np.random.default_rng([seed, 0, index])
+
+    ranks = np.arange(1, profile["projects"] + 1)
+    popularity = np.cumsum(ranks ** -float(profile["zipf"]))
+    project = np.searchsorted(popularity, rng.random(count) * popularity[-1])
+
+    is_ci = rng.random(count) < profile["ci_share"]
+    minute = np.arange(24 * 60)
+    daily = 1 + profile["diurnal"] * np.cos(
+        2 * np.pi * (minute / 60 - profile["peak_hour"]) / 24
+    )
+    daily = np.cumsum(daily / daily.sum())
+    tod = np.searchsorted(daily, rng.random(count)) * 60 + rng.integers(0, 60, count)
+    tod = np.where(is_ci, rng.integers(0, 86400, count), tod)
+    day = (lo + rng.integers(0, hi - lo, count)) // 86400 * 86400
+    access_time = np.clip(day + tod, lo, hi - 1)
+
+    latest = 1 + project % MAX_MINOR
+    version = np.maximum(latest - (rng.geometric(0.5, count) - 1), 0)
+    order = np.argsort(access_time, kind="stable")
+    return {
+        "access_time": access_time[order],
+        "project": project[order].astype(np.int32),
+        "version": version[order].astype(np.int32),
+        "ip": rng.integers(0, pool, count)[order],
+        "status_code": np.full(count, 200, dtype=np.int16),
+        "cached": (rng.random(count) < profile["cached_share"])[order],
+        "is_ci": is_ci[order],
+    }
+
+
+def request_docs(columns, projects, versions):
+    """Build request documents from generated columns"""
+    names = [name.split("/") for name in projects]
+    return [
+        {
+            "access_time": access_time,
+            "remote_addr": ip,
+            "request": {
+                "owner": names[project][0],
+                "repository": names[project][1],
+                "version": versions[version],
+                "cached": cached,
+                "status_code": status_code,
+                "is_ci": is_ci,
+            },
+        }
+        for access_time, ip, project, version, cached, status_code, is_ci in zip(
+            time_strings(columns["access_time"]),
+            ip_addresses(columns["ip"]),
+            columns["project"].tolist(),
+            columns["version"].tolist(),
+            columns["cached"].tolist(),
+            columns["status_code"].tolist(),
+            columns["is_ci"].tolist(),
+        )
+    ]
+
+
+def geo_docs(lo, hi, first_seen, seed=0):
+    """
+    Build geolocation documents of the IP pool indices from `lo` to `hi`
+
+    :param first_seen: time string of the documents
+    """
+    rng = np.random.default_rng([seed, 1, lo // GEO_BATCH])
+    location = rng.integers(0, len(LOCATIONS), hi - lo)
+    jitter = rng.normal(0, 0.2, (hi - lo, 2)).round(4)
+    docs = []
+    ips = ip_addresses(np.arange(lo, hi))
+    for ip, loc, (dlat, dlon) in zip(ips, location.tolist(), jitter.tolist()):
+        continent, country, region, city, lat, lon = LOCATIONS[loc]
+        docs.append(
+            {
+                "access_time": first_seen,
+                "remote_addr": ip,
+                "continent_name": continent,
+                "country_name": country,
+                "region_name": region,
+                "city": city,
+                "hostname": "host-{}.example.net".format(ip.replace(".", "-")),
+                "latitude": round(lat + dlat, 4),
+                "longitude": round(lon + dlon, 4),
+            }
+        )
+    return docs
+
+
+def _mongo_db(db):
+    import pymongo
+
+    client = pymongo.MongoClient(os.getenv("DB_HOSTNAME", "localhost"), 27017)
+    return client, client[db]
+
+
+def _insert(collection, docs, batch_size=10000):
+    for i in range(0, len(docs), batch_size):
+        collection.insert_many(docs[i : i + batch_size], ordered=False)
+
+
+def _write_week(week, pool, seed, profile, target, output):
+    index, lo, hi, count = week
+    columns = generate_week(index, lo, hi, count, pool, seed, **profile)
+    projects = project_names(profile["projects"])
+    versions = version_names()
+    if target == "archive":
+        used, project = np.unique(columns["project"], return_inverse=True)
+        start = datetime.datetime.utcfromtimestamp(lo)
+        save_partition(
+            partition_path(week_start(start), output),
+            access_time=columns["access_time"].astype(np.int64),
+            project=project.astype(np.int32),
+            version=columns["version"],
+            status_code=columns["status_code"],
+            cached=columns["cached"],
+            is_ci=columns["is_ci"],
+            projects=np.array(projects, dtype=str)[used],
+            versions=np.array(versions, dtype=str),
+        )
+        return count
+    docs = request_docs(columns, projects, versions)
+    if target == "mongo":
+        client, db = _mongo_db(output)
+        try:
+            _insert(db["requests"], docs)
+        finally:
+            client.close()
+    else:
+        with open(Path(output) / f"requests-{index:04d}.jsonl", "w") as fp:
+            fp.writelines(json.dumps(doc) + "\n" for doc in docs)
+    return count
+
+
+def _write_geo(lo, hi, first_seen, seed, target, output):
+    docs = geo_docs(lo, hi, first_seen, seed)
+    if target == "mongo":
+        client, db = _mongo_db(output)
+        try:
+            _insert(db["geo"], docs)
+        finally:
+            client.close()
+    else:
+        with open(Path(output) / f"geo-{lo // GEO_BATCH:04d}.jsonl", "w") as fp:
+            fp.writelines(json.dumps(doc) + "\n" for doc in docs)
+    return len(docs)
+
+
+def generate(
+    requests, start, end, target="jsonl", output=None, seed=0, processes=None, **profile
+):
+    """
+    Generate and write synthetic telemetry
+
+    Parameters
+    ----------
+    requests : int
+        number of request documents
+    start, end : datetime
+        UTC times bounding the requests
+    target : str
+        one of `TARGETS`
+    output : str
+        database name for `mongo`, or directory for `archive` and `jsonl`
+    seed : int
+        seed of the whole dataset
+    processes : int, optional
+        size of the process pool, defaults to the number of CPUs
+    profile : dict
+        overrides of `PROFILE`
+
+    Returns
+    -------
+    counts : dict
+        numbers of written requests and geolocations; the archive has no
+        geolocations
+    """
+    if target not in TARGETS:
+        raise ValueError(f"Unknown target {target}")
+    profile = dict(PROFILE, **profile)
+    if target != "mongo":
+        Path(output).mkdir(parents=True, exist_ok=True)
+    pool = max(1, int(round(requests * (1 - profile["ip_reuse"]))))
+    weeks = plan_weeks(requests, start, end)
+    counts = {"requests": 0, "geo": 0}
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        futures = [
+            executor.submit(_write_week, week, pool, seed, profile, target, output)
+            for week in weeks
+        ]
+        if target != "archive":
+            first_seen = start.strftime(timefmt)
+            futures += [
+                executor.submit(
+                    _write_geo,
+                    lo,
+                    min(lo + GEO_BATCH, pool),
+                    first_seen,
+                    seed,
+                    target,
+                    output,
+                )
+                for lo in range(0, pool, GEO_BATCH)
+            ]
+        for i, future in enumerate(futures):
+            counts["requests" if i < len(weeks) else "geo"] += future.result()
+    return counts
@@ -1,32 +1,74 @@
+import asyncio
 import os
+import time
+
+import aiohttp
 
 from . import GITHUB_RELEASE_URL, GITHUB_TAG_URL, GITHUB_ET_FILE, IPSTACK_URL, logger
+from .metrics import PROJECT_CACHE, SHARED_CACHE_REJECTED, UPSTREAM_LATENCY
+from .tracing import Trace, span
+from .upstream import UpstreamUnavailable, get_upstream, is_available
 from .utils import (
     query_project_cache,
     write_project_cache,
+    cache_state,
+    query_stats_cache,
+    write_stats_cache,
     get_current_time,
     utc_timediff,
+    coalesce,
+    spawn,
+    Deadline,
 )
 
+# statistics formerly stored alongside project information
+LEGACY_STATS = ("stats", "stats_update")
+
 
 async def fetch_response(app, url, params=None, content_type="application/json"):
-    async with app.sem, app.session.get(url, params=params) as response:
-        try:
-            resp = await response.json(content_type=content_type)
-        except ValueError:
-            resp = await response.text()
-        status = response.status
+    """
+    Query an upstream service through its own connection pool, within the
+    adaptive concurrency limit of that upstream
+
+    Returns
+    -------
+    status : int or None
+        Status code of response, None if the upstream could not be reached
+    resp : dict or str
+        Decoded response
+    """
+    upstream = get_upstream(app.upstreams, url)
+    start = time.monotonic()
+    try:
+        status, resp = await upstream.fetch(url, params, content_type)
+    except (aiohttp.ClientError, asyncio.TimeoutError, UpstreamUnavailable) as e:
+        logger.warning(f"Failed request to {upstream.name}: {e!r}")
+        status, resp = None, {}
+    UPSTREAM_LATENCY.observe(time.monotonic() - start, upstream.name, str(status))
     return status, resp
 
 
-async def fetch_project(app, owner, repo):
+async def fetch_project(
+    app, owner, repo, deadline=None, cached_only=False, trace=None
+):
     """
     Reuse cached information or query GitHub API for project information.
 
+    Concurrent lookups of the same project share a single in-flight query,
+    and each caller receives its own copy of the result.
+
     1) If no cache is found, query GitHub API and write to cache
     2) If cache is found but query time is insufficient, query and regenerate
     3) Otherwise, use cached version
 
+    When the deadline expires before a stale cache is regenerated, the stale
+    version is returned while regeneration goes on in the background. The
+    shared query is bound to the deadline configured for the server rather
+    than to that of any caller, which only bounds its own wait, and its
+    stages are added to the trace of every caller it answers.
+    With `cached_only`, a cache is used as is even if stale, and GitHub is
+    only queried by lookups already in flight.
+
     Parameters
     ----------
     app : Sanic
@@ -35,29 +77,182 @@ async def fetch_project(app, owner, repo):
         GitHub user or organization
     repo : str
         GitHub repository
+    deadline : Deadline, optional
+        time budget of the request
+    cached_only : bool
+        avoid new queries to GitHub
+    trace : Trace, optional
+        spans of the request
 
     Returns
     -------
-    project_info : dict
-        Composed of `version`, `cached`, `status`, and `notes` fields
+    project_info : dict or None
+        Composed of `version`, `cached`, `status`, and `notes` fields, None if
+        `cached_only` and the project is not cached
     """
+    if cached_only and (owner, repo) not in app.inflight:
+        with span(trace, "cache"):
+            project_info, state = await query_shared_cache(app, owner, repo)
+        if project_info is None:
+            return None
+        project_info["cached"] = True
+        if state != "cached":
+            project_info["stale"] = True
+        PROJECT_CACHE.inc(cache_result(project_info))
+        return project_info
+
+    timeout = deadline.remaining() if deadline is not None else None
+    try:
+        with span(trace, "project", project=f"{owner}/{repo}"):
+            project_info, shared_trace = await coalesce(
+                app.inflight,
+                (owner, repo),
+                lambda: _traced_fetch_project(app, owner, repo),
+                timeout=timeout,
+            )
+        if trace is not None:
+            trace.merge(shared_trace)
+    except asyncio.TimeoutError:
+        with span(trace, "cache"):
+            project_info, _ = await query_shared_cache(app, owner, repo)
+        if project_info is None:
+            # nothing to fall back to
+            return await fetch_project(app, owner, repo, trace=trace)
+        logger.info(f"Deadline expired, serving stale {owner}/{repo}")
+        project_info["cached"] = True
+        project_info["stale"] = True
+    PROJECT_CACHE.inc(cache_result(project_info))
+    return dict(project_info)
+
+
+def cache_result(project_info):
+    """Classify a project lookup as a cache hit, stale hit or miss"""
+    if not project_info.get("cached"):
+        return "miss"
+    return "stale" if project_info.get("stale") else "hit"
+
+
+async def _traced_fetch_project(app, owner, repo):
+    # stages of the shared query are timed apart from the callers waiting on it
+    trace = Trace(f"{owner}/{repo}")
+    return await _fetch_project(app, owner, repo, trace), trace
+
+
+async def _fetch_project(app, owner, repo, trace=None):
     # TODO: developer notes from .etelemetry file in repo
     # https://api.github.com/repos/<project>/contents/.etelemetry.yml
     # base64 encoding
-    project_info, state = await query_project_cache(owner, repo)
-    if project_info is None or state == "stale":
-        # unable to reuse cache
-        project_info = await fetch_project_version(app, owner, repo, project_info)
-        project_info["cached"] = False
-    else:
+    key = f"{owner}/{repo}"
+    deadline = Deadline(app.config.REQUEST_DEADLINE)
+    with span(trace, "cache"):
+        project_info, state = await query_shared_cache(app, owner, repo)
+    if project_info is not None and state == "cached":
+        project_info["cached"] = True
+        return project_info
+
+    github = get_upstream(app.upstreams, GITHUB_RELEASE_URL)
+    if github.breaker.is_open:
+        if project_info is None:
+            raise UpstreamUnavailable(github.name, github.breaker.retry_after)
+        # GitHub is failing, keep serving what we have
         project_info["cached"] = True
+        project_info["stale"] = True
+        return project_info
+
+    # unable to reuse cache, only one worker refreshes a project at a time
+    lease = app.config.REFRESH_LEASE_TIME
+    if app.shared is not None and not app.shared.acquire_lease(key, lease):
+        if project_info is None:
+            with span(trace, "lease"):
+                project_info = await wait_shared_cache(app, key, lease)
+        if project_info is not None:
+            # serve the entry being refreshed by another worker
+            project_info["cached"] = True
+            return project_info
+    try:
+        # only cold misses are bound to the deadline and run as interactive
+        # work, stale entries are served as is by callers out of time while
+        # the refresh completes as background work
+        stale = project_info is not None
+        async with app.scheduler.slot("background" if stale else "projects"):
+            project_info = await fetch_project_version(
+                app, owner, repo, project_info, None if stale else deadline, trace
+            )
+        if app.shared is not None and project_info.get("status") == 200:
+            share_project(app.shared, key, project_info)
+    finally:
+        if app.shared is not None:
+            app.shared.release_lease(key)
+    project_info["cached"] = False
     return project_info
 
 
-async def fetch_project_version(app, owner, repo, project_info=None):
+async def query_shared_cache(app, owner, repo):
+    """Look up project information shared by all workers, then on disk"""
+    if app.shared is not None:
+        project_info = app.shared.get(f"{owner}/{repo}")
+        if project_info is not None:
+            return project_info, await cache_state(project_info)
+    project_info, state = await query_project_cache(owner, repo)
+    if project_info is not None:
+        await migrate_stats(app, owner, repo, project_info)
+        if app.shared is not None:
+            share_project(app.shared, f"{owner}/{repo}", project_info)
+    return project_info, state
+
+
+def share_project(shared, key, project_info):
+    """
+    Publish project information to all workers
+
+    :return: whether the entry fit in the shared cache
+    """
+    entry = {k: v for k, v in project_info.items() if k not in LEGACY_STATS}
+    if shared.put(key, entry):
+        return True
+    SHARED_CACHE_REJECTED.inc()
+    logger.info(f"{key} does not fit in a slot of the shared cache")
+    return False
+
+
+async def migrate_stats(app, owner, repo, project_info):
+    """Move statistics out of cached project information into their own cache"""
+    if not any(key in project_info for key in LEGACY_STATS):
+        return
+    stats_info = {key: project_info.pop(key, None) for key in LEGACY_STATS}
+    if stats_info["stats"] is not None and await load_stats(app, owner, repo) is None:
+        app.stats[(owner, repo)] = stats_info
+        await write_stats_cache(owner, repo, stats_info)
+    await write_project_cache(owner, repo, project_info, update=False)
+
+
+async def wait_shared_cache(app, key, timeout, interval=0.05):
+    """
+    Wait for another worker to publish project information
+
+    Waiting stops as soon as the lease of the other worker is released or
+    expires, as failed refreshes publish nothing.
+    """
+    for _ in range(int(timeout / interval)):
+        await asyncio.sleep(interval)
+        # entries are published before the lease is released
+        leased = app.shared.lease_active(key)
+        project_info = app.shared.get(key)
+        if project_info is not None or not leased:
+            return project_info
+    return None
+
+
+async def fetch_project_version(
+    app, owner, repo, project_info=None, deadline=None, trace=None
+):
     """
     Query GitHub API and write to cache
 
+    If the deadline expires once the version is known, the `.et` file is not
+    queried and the cache is written as stale, to be completed by the next
+    query.
+
     Parameters
     ----------
     app : Sanic
@@ -66,6 +261,10 @@ async def fetch_project_version(app, owner, repo, project_info=None):
         GitHub user or organization
     repo : str
         GitHub repository
+    deadline : Deadline, optional
+        time budget of the request
+    trace : Trace, optional
+        spans of the request
 
     Returns
     -------
@@ -73,29 +272,38 @@ async def fetch_project_version(app, owner, repo, project_info=None):
         Status code of response
     project_info : dict
         Composed of required 'version' field with additional optional fields
+
+    Raises
+    ------
+    UpstreamUnavailable
+        if GitHub could not be queried and no version is known
     """
     project_info = project_info or {}
 
-    status_code, resp = await fetch_response(
-        app, GITHUB_RELEASE_URL.format(owner=owner, repo=repo)
-    )
-    logger.info(f"RELEASEURL: {owner}/{repo}/{status_code}")
+    with span(trace, "github"):
+        status_code, resp = await fetch_response(
+            app, GITHUB_RELEASE_URL.format(owner=owner, repo=repo)
+        )
+    logger.debug(f"RELEASEURL: {owner}/{repo}/{status_code}")
     # check for tag if no release is found
-    if status_code == 403:
-        return project_info
+    if status_code is None or status_code == 403:
+        return unknown_version(app, project_info)
 
     if status_code == 404:
-        logger.info(f"No release found for {owner}/{repo}, checking tags...")
-        status, resp = await fetch_response(
-            app, GITHUB_TAG_URL.format(owner=owner, repo=repo)
-        )
+        logger.debug(f"No release found for {owner}/{repo}, checking tags...")
+        with span(trace, "github-tags"):
+            status, resp = await fetch_response(
+                app, GITHUB_TAG_URL.format(owner=owner, repo=repo)
+            )
         try:
             resp = resp[0]  # latest tag
         except (KeyError, IndexError):
             # invalid JSON
             resp = {}
-        logger.info(f"TAGURL: {owner}/{repo}/{status}{resp}")
-        if status == 404 or status == 403:
+        logger.debug(f"TAGURL: {owner}/{repo}/{status}")
+        if status is None or status == 403:
+            return unknown_version(app, project_info)
+        if status == 404:
             return project_info
 
     version = (resp.get("tag_name") or resp.get("name", "Unknown")).lstrip("v")
@@ -103,9 +311,15 @@ async def fetch_project_version(app, owner, repo, project_info=None):
     project_info["status"] = status_code
 
     if status_code == 200:
-        status, resp = await fetch_response(
-            app, GITHUB_ET_FILE.format(owner=owner, repo=repo), content_type=None
-        )
+        if deadline is not None and deadline.expired:
+            logger.info(f"Deadline expired, skipping et file for {owner}/{repo}")
+            project_info.pop("last_update", None)
+            await write_project_cache(owner, repo, project_info, update=False)
+            return project_info
+        with span(trace, "et-file"):
+            status, resp = await fetch_response(
+                app, GITHUB_ET_FILE.format(owner=owner, repo=repo), content_type=None
+            )
         if status == 200:
             project_info["bad_versions"] = resp.get("bad_versions", None)
         else:
@@ -114,16 +328,55 @@ async def fetch_project_version(app, owner, repo, project_info=None):
     return project_info
 
 
-async def fetch_request_info(app, rip):
-    """Reuse cache or query request information"""
+def unknown_version(app, project_info):
+    """
+    Keep known project information when GitHub could not be queried
 
-    # check cache for rip
-    cached = await app.mongo.query_geocookie(rip)
-    if cached is not None:
-        # already have information, nothing to do here
+    Failing to reach GitHub, or being rate limited by it, says nothing about
+    the project, so cold misses are answered as unavailable rather than as
+    projects without a version.
+
+    :raises UpstreamUnavailable: if no version is known
+    """
+    if "version" in project_info:
+        return project_info
+    github = get_upstream(app.upstreams, GITHUB_RELEASE_URL)
+    raise UpstreamUnavailable(github.name, github.breaker.retry_after or 1)
+
+
+async def fetch_request_info(app, rip, deadline=None, trace=None):
+    """
+    Reuse cache or query request information
+
+    If the deadline expires, the lookup is finished in the background.
+    """
+
+    if not is_available(app.upstreams, IPSTACK_URL):
         return
+    if deadline is not None and deadline.expired:
+        spawn(app, lookup_request_info(app, rip), lane="background")
+        return
+    timeout = deadline.remaining() if deadline is not None else None
+    lookup = spawn(app, lookup_request_info(app, rip))
+    if lookup is None:
+        return
+    try:
+        with span(trace, "geolocation"):
+            # shield the lookup from the timeout, it goes on in the background
+            await asyncio.wait_for(asyncio.shield(lookup), timeout)
+    except asyncio.TimeoutError:
+        logger.info(f"Deadline expired, looking up {rip} in the background")
+
+
+async def lookup_request_info(app, rip):
+    """Query and cache geolocation of a request IP, unless already cached"""
+    cached = await app.mongo.query_geocookie(rip)
+    if cached is None:
+        await fetch_geolocation(app, rip)
+
 
-    # if not found, send a request
+async def fetch_geolocation(app, rip):
+    """Query and cache geolocation of a request IP"""
     access_key = os.getenv("IPSTACK_API_KEY")
     if access_key is None:
         logger.warn("Access key is undefined")
@@ -132,7 +385,7 @@ async def fetch_request_info(app, rip):
     params = {"access_key": access_key, "hostname": 1}
     status, resp = await fetch_response(app, IPSTACK_URL.format(ip=rip), params)
     if status != 200:
-        logger.info(f"Geoloc failed with code {resp.status}")
+        logger.info(f"Geoloc failed with code {status}")
         return
     elif not resp.get("success", True):
         logger.info(f"Geoloc failed: {resp.get('error')}")
@@ -159,17 +412,138 @@ async def fetch_request_info(app, rip):
 
 
 async def get_stats(app, owner, repo):
+    """
+    Reuse cached statistics or aggregate new project requests.
+
+    Statistics are kept apart from the project cache, so refreshing them never
+    rewrites project version information. Concurrent refreshes of the same
+    project are coalesced.
+
+    Returns
+    -------
+    stats : dict or None
+        Weekly request counts, or None if the project does not have a version
+    """
     project_info = await fetch_project(app, owner, repo)
-    logger.info(project_info)
     if "version" not in project_info:
         return None
-    lastmod = project_info.get("stats_update")
+    stats_info = app.stats.get((owner, repo))
+    if not await is_stale_stats(app, stats_info, await get_current_time()):
+        return stats_info["stats"]
+    stats_info = await coalesce(
+        app.inflight,
+        ("stats", owner, repo),
+        lambda: refresh_stats(app, owner, repo, project_info),
+    )
+    return stats_info["stats"]
+
+
+async def load_stats(app, owner, repo, project_info=None):
+    """Look up project statistics in memory, then on disk"""
+    stats_info = app.stats.get((owner, repo))
+    if stats_info is None:
+        stats_info = await query_stats_cache(owner, repo)
+    if stats_info is None and project_info and "stats" in project_info:
+        # statistics formerly stored alongside the project cache
+        stats_info = {
+            "stats": project_info["stats"],
+            "stats_update": project_info.get("stats_update"),
+        }
+    if stats_info is not None:
+        app.stats[(owner, repo)] = stats_info
+    return stats_info
+
+
+async def is_stale_stats(app, stats_info, now):
+    """Check whether statistics are missing or older than their TTL"""
+    if stats_info is None or stats_info.get("stats_update") is None:
+        return True
+    lastmod = stats_info["stats_update"]
+    return await utc_timediff(lastmod, now) > app.config.STATS_STALE_TIME
+
+
+async def refresh_stats(app, owner, repo, project_info=None):
+    """Refresh stale project statistics from the last recorded week onwards"""
+    stats_info = await load_stats(app, owner, repo, project_info)
     now = await get_current_time()
-    stale_stats = lastmod is None or await utc_timediff(lastmod, now) > 21600
-    if not project_info["cached"] or "stats" not in project_info or stale_stats:
-        stats = await app.mongo.get_status(owner, repo, project_info)
-        project_info["stats"] = stats
-        del project_info["cached"]
-        project_info["stats_update"] = now
-        await write_project_cache(owner, repo, project_info, update=False)
-    return project_info["stats"]
+    if await is_stale_stats(app, stats_info, now):
+        async with app.scheduler.slot("stats"):
+            stats = await app.mongo.get_status(
+                owner, repo, stats_info and stats_info["stats"]
+            )
+        stats_info = await store_stats(app, owner, repo, stats, now)
+    return stats_info
+
+
+async def store_stats(app, owner, repo, stats, now):
+    """Cache project statistics in memory and persist them"""
+    stats_info = {"stats": stats, "stats_update": now}
+    app.stats[(owner, repo)] = stats_info
+    await write_stats_cache(owner, repo, stats_info)
+    return stats_info
+
+
+async def iter_stats(app, projects):
+    """
+    Generate statistics of several projects, refreshing stale ones together.
+
+    Parameters
+    ----------
+    app : Sanic
+        server app
+    projects : list of tuple
+        (owner, repo) pairs
+
+    Yields
+    ------
+    owner, repo : str
+        GitHub project
+    stats : dict or None
+        Weekly request counts, or None if the project is not cached
+    """
+    now = await get_current_time()
+    stale = {}
+    missing = []
+    for owner, repo in projects:
+        stats_info = await load_stats(app, owner, repo)
+        if stats_info is None:
+            missing.append((owner, repo))
+        elif await is_stale_stats(app, stats_info, now):
+            stale[(owner, repo)] = stats_info["stats"]
+        else:
+            yield owner, repo, stats_info["stats"]
+
+    # projects without statistics are only looked up in the cache, or join
+    # lookups in flight, as bulk requests must not query GitHub
+    infos = await asyncio.gather(
+        *[fetch_project(app, owner, repo, cached_only=True) for owner, repo in missing],
+        return_exceptions=True,
+    )
+    for (owner, repo), project_info in zip(missing, infos):
+        if isinstance(project_info, UpstreamUnavailable):
+            project_info = None
+        elif isinstance(project_info, BaseException):
+            raise project_info
+        if project_info is None or "version" not in project_info:
+            yield owner, repo, None
+            continue
+        stats_info = await load_stats(app, owner, repo, project_info)
+        if await is_stale_stats(app, stats_info, now):
+            stale[(owner, repo)] = stats_info and stats_info["stats"]
+        else:
+            yield owner, repo, stats_info["stats"]
+
+    # bulk aggregations make way for interactive requests, and are collected
+    # first so slow clients do not hold on to their slot
+    updated = []
+    async with app.scheduler.slot("batch"):
+        async for owner, repo, docs in app.mongo.get_statuses(stale):
+            updated.append((owner, repo, dict(stale.pop((owner, repo)) or {}, **docs)))
+    for owner, repo, stats in updated:
+        await store_stats(app, owner, repo, stats, now)
+        yield owner, repo, stats
+    # projects without new requests since their last update
+    for (owner, repo), stats in stale.items():
+        stats = stats or {}
+        await store_stats(app, owner, repo, stats, now)
+        yield owner, repo, stats
@@ -0,0 +1,58 @@
+"""Tracking of background work, drained when the server stops"""
+import asyncio
+
+from . import logger
+from .utils import Deadline
+
+
+class Lifecycle:
+    """
+    Background work of the server
+
+    Tasks spawned outside of requests are tracked until they complete. On
+    shutdown no new work is accepted, and tracked work is given a grace
+    period to complete before being cancelled.
+    """
+
+    def __init__(self):
+        self.closing = False
+        self.tasks = set()
+
+    def track(self, future):
+        """Keep a reference to a future or task until it is done"""
+        self.tasks.add(future)
+        future.add_done_callback(self.tasks.discard)
+        return future
+
+    def spawn(self, coro):
+        """
+        Run a coroutine in the background
+
+        :return: its task, None if the server is shutting down
+        """
+        if self.closing:
+            coro.close()
+            logger.warning("Shutting down, background work dropped")
+            return None
+        return self.track(asyncio.ensure_future(coro))
+
+    async def drain(self, timeout=None):
+        """
+        Stop accepting work and wait for tracked work to complete
+
+        :param timeout: seconds after which remaining work is cancelled
+        :return: number of cancelled tasks
+        """
+        self.closing = True
+        deadline = Deadline(timeout)
+        # completing work may track more of it
+        while self.tasks and not deadline.expired:
+            await asyncio.wait(set(self.tasks), timeout=deadline.remaining())
+        pending = list(self.tasks)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Cancelled {len(pending)} background tasks")
+            # let cancelled tasks clean up
+            await asyncio.gather(*pending, return_exceptions=True)
+        return len(pending)
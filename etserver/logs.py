@@ -0,0 +1,204 @@
+"""Logging off the event loop
+
+Records are sampled, rate limited and put on a bounded queue by the event
+loop, and formatted and written by a single writer thread, so slow disks
+never stall requests. Records are dropped rather than waited for when the
+queue is full.
+"""
+import copy
+import json
+import logging
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# attributes of all records, anything else was passed as extra
+RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as JSON lines, including their extra fields"""
+
+    def format(self, record):
+        doc = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "process": record.process,
+            "message": record.getMessage(),
+        }
+        for key, val in vars(record).items():
+            if key not in RECORD_ATTRS and not key.startswith("_"):
+                doc[key] = val
+        if record.exc_info:
+            doc["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(doc, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a random fraction of records
+
+    :param rate: fraction of records kept
+    :param overload_rate: fraction kept while `overloaded()` is true
+    :param overloaded: function telling whether the server is overloaded
+    """
+
+    def __init__(self, rate=1.0, overload_rate=None, overloaded=None):
+        super().__init__()
+        self.rate = rate
+        self.overload_rate = overload_rate
+        self.overloaded = overloaded
+
+    def filter(self, record):
+        rate = self.rate
+        if self.overload_rate is not None and self.overloaded():
+            rate = self.overload_rate
+        return rate >= 1 or random.random() < rate
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Keep at most `rate` records per second, after an initial `burst`
+
+    The number of suppressed records is added to the next kept one.
+    """
+
+    def __init__(self, rate, burst):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def filter(self, record):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1
+        if self.suppressed:
+            record.suppressed = self.suppressed
+            self.suppressed = 0
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """Queue records of a logger without blocking, dropping them when full"""
+
+    def __init__(self, queue, route):
+        super().__init__(queue)
+        self.route = route
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formatting, tracebacks included, is left to the writer thread, only
+        # arguments are merged as they may change once the call returns
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        # handlers of the logger the record was queued by
+        record._route = self.route
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Writer(QueueListener):
+    def __init__(self, queue, routes):
+        super().__init__(queue, respect_handler_level=True)
+        self.routes = routes
+
+    def handle(self, record):
+        for handler in self.routes.get(record._route, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    def stop(self, timeout=10):
+        # wait for room in a full queue, but not for a stuck writer
+        try:
+            self.queue.put(self._sentinel, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+        self._thread = None
+
+
+class QueueLogging:
+    """
+    Move the handlers of loggers behind a queue drained by a writer thread
+
+    Parameters
+    ----------
+    names : list of str
+        loggers whose handlers are moved
+    queue_size : int
+        records waiting to be written before new ones are dropped
+    sampling : dict
+        mapping of logger names to fractions of records kept
+    overload_sampling : dict
+        mapping of logger names to fractions of records kept while overloaded
+    rate_limits : dict
+        mapping of logger names to `RateLimitFilter` keyword arguments
+    overloaded : callable
+        function telling whether the server is overloaded
+    """
+
+    def __init__(
+        self,
+        names,
+        queue_size=10000,
+        sampling=None,
+        overload_sampling=None,
+        rate_limits=None,
+        overloaded=None,
+    ):
+        self.names = names
+        self.queue = queue.Queue(queue_size)
+        self.sampling = sampling or {}
+        self.overload_sampling = overload_sampling or {}
+        self.rate_limits = rate_limits or {}
+        self.overloaded = overloaded
+        self.handlers = {}
+        self._queued = []
+        self._writer = None
+
+    @property
+    def dropped(self):
+        """Number of records dropped since the queue was full"""
+        return sum(handler.dropped for handler in self._queued)
+
+    def start(self):
+        for name in self.names:
+            log = logging.getLogger(name)
+            self.handlers[name] = log.handlers
+            handler = DroppingQueueHandler(self.queue, name)
+            if name in self.sampling or name in self.overload_sampling:
+                handler.addFilter(
+                    SamplingFilter(
+                        self.sampling.get(name, 1.0),
+                        self.overload_sampling.get(name),
+                        self.overloaded,
+                    )
+                )
+            if name in self.rate_limits:
+                handler.addFilter(RateLimitFilter(**self.rate_limits[name]))
+            log.handlers = [handler]
+            self._queued.append(handler)
+        self._writer = _Writer(self.queue, self.handlers)
+        self._writer.start()
+
+    def stop(self):
+        """Write queued records and give loggers their handlers back"""
+        for name, handlers in self.handlers.items():
+            logging.getLogger(name).handlers = handlers
+        self._writer.stop()
+        self.handlers = {}
@@ -0,0 +1,173 @@
+"""Metrics in the Prometheus text format
+
+Metrics are plain counters updated from the event loop, so recording one
+takes no lock and costs a dictionary lookup. Each worker process keeps its
+own metrics, labelled with its process id when exposed.
+"""
+import os
+from bisect import bisect_left
+
+# seconds
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+
+class Metric:
+    """
+    Base of all metrics
+
+    Parameters
+    ----------
+    name : str
+        metric name
+    doc : str
+        help text
+    labels : tuple of str
+        label names, whose values are given positionally when recording
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name, doc, labels=()):
+        self.name = name
+        self.doc = doc
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def samples(self):
+        """Generate (suffix, label values, extra labels, value) samples"""
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} {self.kind}"]
+        pid = os.getpid()
+        for suffix, values, extra, value in self.samples():
+            pairs = list(zip(self.labels, values)) + extra + [("process", pid)]
+            labels = ",".join(f'{key}="{_escape(val)}"' for key, val in pairs)
+            lines.append(f"{self.name}{suffix}{{{labels}}} {value}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def __init__(self, name, doc, labels=()):
+        super().__init__(name, doc, labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for values, value in self.values.items():
+            yield "", values, [], value
+
+
+class Gauge(Metric):
+    """Current values, read from a function when exposed"""
+
+    kind = "gauge"
+
+    def __init__(self, name, doc, labels=(), func=None):
+        super().__init__(name, doc, labels)
+        self.func = func
+
+    def samples(self):
+        values = self.func() if self.func is not None else {}
+        for key, value in values.items():
+            yield "", key if isinstance(key, tuple) else (key,), [], value
+
+
+class Histogram(Metric):
+    """Distribution of observed values over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, doc, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, doc, labels)
+        self.buckets = tuple(buckets)
+        # per label values: counts of each bucket and above all, and the sum
+        self.values = {}
+
+    def observe(self, value, *labels):
+        counts = self.values.get(labels)
+        if counts is None:
+            counts = self.values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def samples(self):
+        for values, counts in self.values.items():
+            total = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                total += count
+                yield "_bucket", values, [("le", bound)], total
+            yield "_sum", values, [], round(counts[-1], 6)
+            yield "_count", values, [], total
+
+
+def render():
+    """Return all metrics in the Prometheus text exposition format"""
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+REGISTRY = []
+
+REQUEST_LATENCY = Histogram(
+    "et_request_duration_seconds",
+    "Time to handle requests",
+    ("route", "method", "status"),
+)
+PROJECT_CACHE = Counter(
+    "et_project_cache_total",
+    "Project lookups answered from the cache (hit), a stale cache (stale) or GitHub "
+    "(miss)",
+    ("result",),
+)
+UPSTREAM_LATENCY = Histogram(
+    "et_upstream_duration_seconds",
+    "Time of calls to upstream services by status code",
+    ("upstream", "status"),
+)
+UPSTREAM_WAIT = Histogram(
+    "et_upstream_wait_seconds",
+    "Time waited for the concurrency limit of upstream services",
+    ("upstream",),
+)
+SCHEDULER_WAIT = Histogram(
+    "et_scheduler_wait_seconds", "Time waited for a slot of the work lanes", ("lane",)
+)
+SHARED_CACHE_REJECTED = Counter(
+    "et_shared_cache_rejected_total",
+    "Project entries too large for a slot of the shared cache",
+)
+MONGO_LATENCY = Histogram(
+    "et_mongo_duration_seconds", "Time of mongo operations", ("operation",)
+)
+LOOP_DELAY = Histogram(
+    "et_event_loop_delay_seconds",
+    "Delay until callbacks scheduled by the loop monitor were run",
+)
+LOOP_BLOCKED = Counter(
+    "et_event_loop_blocked_total",
+    "Times the event loop was blocked for longer than the monitor threshold",
+)
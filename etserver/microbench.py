@@ -0,0 +1,253 @@
+"""Microbenchmarks of functions on the request path
+
+Each benchmark is timed over enough calls to last a minimum time, several
+times over, keeping the fastest time per call as the least noisy estimate.
+Results can be saved as a baseline, and later runs compared to it to flag
+functions which got slower by more than a threshold.
+
+Baselines depend on the machine they were measured on, and are only
+meaningful to compare with runs on the same machine.
+"""
+import asyncio
+import datetime
+import json
+import os
+import platform
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from . import utils
+from .database import gen_mongo_doc, gen_request_info
+from .utils import timefmt
+
+BASELINE = Path("benchmarks") / "micro.json"
+
+# name -> coroutine function setting up a benchmark and returning the
+# function to time, which is either plain or a coroutine function
+BENCHMARKS = {}
+
+PROJECT_INFO = {
+    "version": "1.3.2",
+    "bad_versions": ["1.0.0", "1.1.0"],
+    "success": True,
+    "status": 200,
+    "cached": True,
+    "last_update": "2020-03-02'T'10:12:00Z",
+}
+
+
+def benchmark(name):
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+
+    return register
+
+
+@benchmark("get_current_time")
+async def _current_time(ctx):
+    return utils.get_current_time
+
+
+@benchmark("utc_timediff")
+async def _timediff(ctx):
+    t1, t2 = "2020-03-02'T'10:12:00Z", "2020-03-01'T'08:00:00Z"
+    return lambda: utils.utc_timediff(t1, t2)
+
+
+@benchmark("query_project_cache")
+async def _query_cache(ctx):
+    await utils.write_project_cache("microbench", "cached", dict(PROJECT_INFO))
+    return lambda: utils.query_project_cache("microbench", "cached")
+
+
+@benchmark("query_project_cache_missing")
+async def _query_missing(ctx):
+    return lambda: utils.query_project_cache("microbench", "missing")
+
+
+@benchmark("write_project_cache")
+async def _write_cache(ctx):
+    info = dict(PROJECT_INFO)
+    return lambda: utils.write_project_cache("microbench", "written", info)
+
+
+@benchmark("gen_mongo_doc")
+async def _mongo_doc(ctx):
+    async def func():
+        doc = await gen_mongo_doc("1.2.3.4")
+        doc["request"] = gen_request_info("owner", "repo", PROJECT_INFO)
+        return doc
+
+    return func
+
+
+@benchmark("project_response")
+async def _project_response(ctx):
+    from sanic import response
+    from .serve import public_info
+
+    return lambda: response.json(public_info(PROJECT_INFO))
+
+
+@benchmark("stats_response")
+async def _stats_response(ctx):
+    from sanic import response
+
+    stats = {f"2020-{week:02d}": week * 10 for week in range(52)}
+    return lambda: response.json(stats)
+
+
+@benchmark("get_status")
+async def _get_status(ctx):
+    mongo = ctx.get("mongo")
+    if mongo is None:
+        return None
+    return lambda: mongo.get_status("microbench", "seeded")
+
+
+@benchmark("get_status_incremental")
+async def _get_status_incremental(ctx):
+    mongo = ctx.get("mongo")
+    if mongo is None:
+        return None
+    stats = await mongo.get_status("microbench", "seeded")
+    return lambda: mongo.get_status("microbench", "seeded", stats)
+
+
+async def seed_mongo(ndocs=100000, weeks=52, seed=0):
+    """
+    Seed a separate database with a year of requests of a single project
+
+    :return: mongo helper using the seeded database
+    """
+    from .database import MongoClientHelper
+
+    mongo = MongoClientHelper()
+    await mongo.is_valid()
+    mongo.db = mongo.client["et-microbench"]
+    mongo.requests = mongo.db["requests"]
+    mongo.geoloc = mongo.db["geo"]
+    mongo.rollups = mongo.db["rollups"]
+    await mongo.requests.drop()
+    await mongo.rollups.drop()
+
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    docs = [
+        {
+            "access_time": (
+                now - datetime.timedelta(seconds=rng.randrange(weeks * 7 * 86400))
+            ).strftime(timefmt),
+            "remote_addr": f"10.0.{rng.randrange(256)}.{rng.randrange(256)}",
+            "request": gen_request_info("microbench", "seeded", PROJECT_INFO),
+        }
+        for _ in range(ndocs)
+    ]
+    await mongo.requests.insert_many(docs, ordered=False)
+    await mongo.requests.create_index(
+        [("request.owner", 1), ("request.repository", 1), ("access_time", 1)]
+    )
+    return mongo
+
+
+async def measure(func, min_time=0.2, repeat=5):
+    """
+    Time calls of a function
+
+    :return: fastest time per call (secs)
+    """
+    is_coro = asyncio.iscoroutinefunction(func)
+
+    async def timed(number):
+        start = time.perf_counter()
+        for _ in range(number):
+            res = func()
+            if is_coro or asyncio.iscoroutine(res):
+                await res
+        return time.perf_counter() - start
+
+    # calibrate the number of calls to last at least min_time
+    number = 1
+    while True:
+        elapsed = await timed(number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / max(elapsed, 1e-9)))
+    times = [elapsed] + [await timed(number) for _ in range(repeat - 1)]
+    return min(times) / number
+
+
+async def run_benchmarks(names=None, mongo=False, min_time=0.2, repeat=5):
+    """
+    Run microbenchmarks
+
+    Parameters
+    ----------
+    names : list of str
+        benchmarks to run, all by default
+    mongo : bool
+        also benchmark `get_status` against seeded data in a running mongo
+    min_time : float
+        minimum seconds of calls per measurement
+    repeat : int
+        number of measurements
+
+    Returns
+    -------
+    results : dict
+        mapping of benchmark names to seconds per call
+    """
+    ctx = {}
+    saved = utils.CACHEDIR
+    with tempfile.TemporaryDirectory() as cachedir:
+        # keep benchmark files out of the actual cache
+        utils.CACHEDIR = Path(cachedir)
+        try:
+            if mongo:
+                ctx["mongo"] = await seed_mongo()
+            results = {}
+            for name, setup in BENCHMARKS.items():
+                if names and name not in names:
+                    continue
+                func = await setup(ctx)
+                if func is not None:
+                    results[name] = await measure(func, min_time, repeat)
+        finally:
+            utils.CACHEDIR = saved
+            if "mongo" in ctx:
+                await ctx["mongo"].client.drop_database("et-microbench")
+                ctx["mongo"].client.close()
+    return results
+
+
+def compare(results, baseline, threshold=0.2):
+    """
+    Compare results to a baseline
+
+    :param threshold: relative slowdown beyond which a result regressed
+    :return: list of (name, baseline, result, ratio) of regressed benchmarks
+    """
+    regressions = []
+    for name, value in results.items():
+        base = baseline.get(name)
+        if base and value > base * (1 + threshold):
+            regressions.append((name, base, value, value / base))
+    return regressions
+
+
+def save_baseline(results, path=BASELINE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    doc = {
+        "date": datetime.datetime.utcnow().strftime(timefmt),
+        "machine": {"cpus": os.cpu_count(), "platform": platform.platform()},
+        "results": results,
+    }
+    path.write_text(json.dumps(doc, indent=2, sort_keys=True) + "\n")
+
+
+def load_baseline(path=BASELINE):
+    return json.loads(Path(path).read_text())["results"]
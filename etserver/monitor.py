@@ -0,0 +1,90 @@
+"""Monitoring of event loop lag
+
+A watchdog thread schedules a callback on the event loop at a fixed
+interval, and the delay until it runs is the scheduling lag of the loop,
+which admission control also sheds requests on. When a callback is still pending after a threshold, the loop is blocked:
+the stack of the loop thread is captured and logged, pointing at the code
+which holds it.
+"""
+import sys
+import threading
+import time
+import traceback
+
+from . import logger
+from .metrics import LOOP_BLOCKED, LOOP_DELAY
+
+
+class LoopMonitor:
+    """
+    Measure event loop lag and log the stacks of blocking code
+
+    Parameters
+    ----------
+    loop : AbstractEventLoop
+        monitored loop, which must run in the thread calling `start`
+    interval : float
+        seconds between probes
+    threshold : float
+        seconds of lag after which the loop is considered blocked, or None to
+        only measure lag
+    """
+
+    def __init__(self, loop, interval=0.1, threshold=0.1):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self.blocked = 0
+        self.lag = 0.0
+        self._thread_id = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._thread = threading.Thread(
+            target=self._run, name="etserver-loop-monitor", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            sent = time.monotonic()
+            done = threading.Event()
+            self.loop.call_soon_threadsafe(self._probed, sent, done)
+            blocked = self.threshold is not None and not done.wait(self.threshold)
+            # `stop` holds the loop while it joins this thread
+            if blocked and not self._stop.is_set():
+                self._report()
+            else:
+                blocked = False
+            # probe again only once the previous probe ran
+            while not done.wait(self.interval):
+                if self._stop.is_set():
+                    return
+            if blocked:
+                lag = time.monotonic() - sent
+                logger.warning(f"Event loop was blocked for {lag:.3f}s")
+
+    def _probed(self, sent, done):
+        lag = time.monotonic() - sent
+        LOOP_DELAY.observe(lag)
+        # follow increases at once, but let a single spike fade out
+        self.lag = max(lag, self.lag / 2)
+        done.set()
+
+    def _report(self):
+        frame = sys._current_frames().get(self._thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        self.blocked += 1
+        # metrics are only updated from the loop
+        self.loop.call_soon_threadsafe(LOOP_BLOCKED.inc)
+        logger.warning(
+            f"Event loop blocked for more than {self.threshold}s",
+            extra={"stack": stack},
+        )
@@ -0,0 +1,150 @@
+"""Profiling of a running worker
+
+A thread samples the stack of the event loop thread at a fixed interval, so
+the worker keeps serving requests while profiled, at the cost of reading one
+stack per interval. Samples are returned as collapsed stacks, as read by
+flame graph tools, or as a speedscope file. Allocations can be traced over a
+window with `tracemalloc`, which slows down the worker noticeably more.
+"""
+import asyncio
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+from . import __version__
+
+
+class SamplingProfiler:
+    """
+    Sample the stack of a thread from another thread
+
+    :param thread_id: identifier of the sampled thread
+    :param interval: seconds between samples
+    """
+
+    def __init__(self, thread_id, interval=0.01):
+        self.thread_id = thread_id
+        self.interval = interval
+        # stacks, outermost frame first, as tuples of (function, file, line)
+        self.samples = Counter()
+        self.duration = 0
+        self._start = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="etserver-profiler", daemon=True
+        )
+        self._start = time.monotonic()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.monotonic() - self._start
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[sample_stack(frame)] += 1
+
+    def collapsed(self):
+        """Format samples as `outer;inner count` lines"""
+        lines = []
+        for stack, count in self.samples.most_common():
+            names = (f"{func} ({path}:{line})" for func, path, line in stack)
+            lines.append(f"{';'.join(names)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def speedscope(self, name):
+        """Format samples as a speedscope sampled profile"""
+        frames, index = [], {}
+        samples, weights = [], []
+        # samples are late while the sampled thread holds the GIL, weigh them
+        # by the time actually profiled rather than the interval
+        weight = self.duration / max(sum(self.samples.values()), 1)
+        for stack, count in self.samples.most_common():
+            for frame in stack:
+                if frame not in index:
+                    index[frame] = len(frames)
+                    func, path, line = frame
+                    frames.append({"name": func, "file": path, "line": line})
+            samples.append([index[frame] for frame in stack])
+            weights.append(count * weight)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": name,
+            "exporter": f"etelemetry-server {__version__}",
+            "shared": {"frames": frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": self.duration,
+                    "samples": samples,
+                    "weights": weights,
+                }
+            ],
+        }
+
+
+def sample_stack(frame):
+    """Return the stack of a frame, outermost first"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+        frame = frame.f_back
+    return tuple(reversed(stack))
+
+
+async def profile(seconds, interval=0.01):
+    """
+    Sample the stack of the current thread while it runs its event loop
+
+    :return: stopped `SamplingProfiler`
+    """
+    profiler = SamplingProfiler(threading.get_ident(), interval)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profiler.stop()
+    return profiler
+
+
+async def trace_allocations(seconds, limit=25, nframes=10):
+    """
+    Trace allocations over a window
+
+    Only memory allocated during the window and not freed by its end is
+    reported.
+
+    :return: list of the largest allocation sites, with their size (bytes),
+        number of blocks, and traceback
+    """
+    if tracemalloc.is_tracing():
+        raise RuntimeError("Allocations are already traced")
+    tracemalloc.start(nframes)
+    try:
+        await asyncio.sleep(seconds)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    snapshot = snapshot.filter_traces(
+        [tracemalloc.Filter(False, tracemalloc.__file__)]
+    )
+    return [
+        {
+            "size": stat.size,
+            "count": stat.count,
+            "traceback": [f"{f.filename}:{f.lineno}" for f in stat.traceback],
+        }
+        for stat in snapshot.statistics("traceback")[:limit]
+    ]
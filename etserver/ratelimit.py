@@ -0,0 +1,114 @@
+"""Token-bucket rate limiting of clients
+
+Buckets live in a fixed-size table of 24-byte slots, so the number of
+tracked keys is bounded and memory does not grow with the number of
+clients. The table is either private to a process, or memory-mapped from a
+file shared by all workers started by `et up --workers N`.
+"""
+import fcntl
+import mmap
+import os
+import struct
+import time
+
+from .shared import _FileLock, _hash
+
+MAGIC = b"ETRATE01"
+# magic, number of slots
+HEADER = struct.Struct("<8sI")
+# key hash, tokens left, last update
+SLOT = struct.Struct("<Qdd")
+# number of slots probed for a key before evicting the least recent one
+MAX_PROBES = 8
+
+
+class RateLimited(Exception):
+    """Raised when a client exceeds its rate"""
+
+    def __init__(self, retry_after):
+        super().__init__("too many requests")
+        self.retry_after = retry_after
+
+
+class TokenBuckets:
+    """
+    Token buckets keyed by strings
+
+    A bucket holds up to `burst` tokens and is refilled with `rate` tokens
+    per second. Buckets idle for long are full again, so the least recently
+    used one is evicted when a new key does not find a free slot.
+
+    Parameters
+    ----------
+    path : Path, optional
+        backing file shared by all processes, buckets are private otherwise
+    nslots : int
+        maximum number of tracked keys
+    """
+
+    def __init__(self, path=None, nslots=65536):
+        self.nslots = nslots
+        self.size = HEADER.size + nslots * SLOT.size
+        self._fd = None
+        if path is None:
+            self._map = mmap.mmap(-1, self.size)
+            return
+        self._fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = HEADER.pack(MAGIC, nslots)
+            if os.pread(self._fd, HEADER.size, 0) != header:
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, header, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self.size)
+
+    def close(self):
+        self._map.close()
+        if self._fd is not None:
+            os.close(self._fd)
+
+    def take(self, key, rate, burst, cost=1):
+        """
+        Take tokens from the bucket of a key
+
+        :param rate: tokens added per second
+        :param burst: capacity of the bucket
+        :param cost: tokens taken, at most `burst`
+        :return: seconds until enough tokens are available, 0 if they were taken
+        """
+        cost = min(cost, burst)
+        if self._fd is None:
+            return self._take(_hash(key), rate, burst, cost)
+        with _FileLock(self._fd):
+            return self._take(_hash(key), rate, burst, cost)
+
+    def _take(self, khash, rate, burst, cost):
+        now = time.time()
+        offset = self._claim(khash)
+        stored, tokens, updated = SLOT.unpack_from(self._map, offset)
+        if stored != khash:
+            tokens, updated = burst, now
+        tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        SLOT.pack_into(self._map, offset, khash, tokens, now)
+        return wait
+
+    def _claim(self, khash):
+        """Find the slot of a key, or the offset of a free or the oldest one"""
+        home = khash % self.nslots
+        oldest = None
+        for i in range(min(MAX_PROBES, self.nslots)):
+            offset = HEADER.size + (home + i) % self.nslots * SLOT.size
+            stored, _, updated = SLOT.unpack_from(self._map, offset)
+            if stored == khash or stored == 0:
+                return offset
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        return oldest[0]
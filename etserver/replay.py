@@ -0,0 +1,215 @@
+"""Replay of access logs against a running server
+
+Requests of access logs, either JSON lines or the plain text format used
+before, are sent again with their original spacing in time, optionally
+compressed. Arrivals are scheduled open loop: requests are sent when they
+are due whatever the responses to earlier ones, so a slow server faces the
+same traffic rather than a slower one. Latencies are measured from when
+requests were due, which includes any time spent waiting for the client's
+concurrency limit.
+"""
+import asyncio
+import datetime
+import json
+import re
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from .benchmark import summarize
+
+# plain text access records, e.g.
+# [2020-03-02 10:12:00 +0000] - (sanic.access)[INFO][1.2.3.4:5678]: GET
+# http://localhost/projects/nipy/nipype  200 103
+TEXT_RECORD = re.compile(
+    r"^\[(?P<time>[^\]]+)\] - \(sanic\.access\)\[\w+\]\[(?P<host>[^\]]*)\]: "
+    r"(?P<request>\S+ \S+) .*?(?P<status>\d+) (?P<byte>-?\d+)$"
+)
+# body of requests are not logged, these cannot be replayed
+SKIPPED_METHODS = ("POST", "PUT", "PATCH")
+# lag behind the schedule above which requests are counted as late (secs)
+LATE = 0.01
+
+
+def parse_record(line):
+    """
+    Parse an access record
+
+    :return: (epoch secs, method, path, client IP), or None if the line is
+        not an access record
+    """
+    line = line.strip()
+    if line.startswith("{"):
+        try:
+            doc = json.loads(line)
+            when = datetime.datetime.strptime(doc["time"], "%Y-%m-%dT%H:%M:%S%z")
+            host, request = doc["host"], doc["request"]
+        except (ValueError, KeyError, TypeError):
+            return None
+    else:
+        match = TEXT_RECORD.match(line)
+        if match is None:
+            return None
+        when = datetime.datetime.strptime(match["time"], "%Y-%m-%d %H:%M:%S %z")
+        host, request = match["host"], match["request"]
+    method, _, url = request.partition(" ")
+    if not url:
+        return None
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    # hosts are logged as "ip:port", or "UNKNOWN"
+    return when.timestamp(), method, path, host.rpartition(":")[0] or None
+
+
+def read_logs(paths):
+    """
+    Read access records of several logs, such as rotated ones, in time order
+
+    Records are logged with a resolution of a second, so those logged in the
+    same second are spread evenly over it.
+
+    :return: list of (epoch secs, method, path, client IP), and the number
+        of skipped lines
+    """
+    records, skipped = [], 0
+    for path in paths:
+        with open(path) as fp:
+            for line in fp:
+                record = parse_record(line)
+                if record is None or record[1] in SKIPPED_METHODS:
+                    skipped += 1
+                else:
+                    records.append(record)
+    records.sort(key=lambda record: record[0])
+    spread = []
+    for second, group in _groupby_second(records):
+        spread.extend(
+            (second + i / len(group),) + record[1:] for i, record in enumerate(group)
+        )
+    return spread, skipped
+
+
+def _groupby_second(records):
+    group = []
+    for record in records:
+        if group and record[0] != group[0][0]:
+            yield group[0][0], group
+            group = []
+        group.append(record)
+    if group:
+        yield group[0][0], group
+
+
+def route_of(method, path):
+    """Group paths by the route they were served by"""
+    parts = path.split("?")[0].strip("/").split("/")
+    if parts[0] in ("projects", "stats") and len(parts) > 1:
+        return f"{method} /{parts[0]}/<project>"
+    return f"{method} /{parts[0]}"
+
+
+async def replay(
+    url, records, speedup=1.0, concurrency=100, timeout=10, forward_ip=True
+):
+    """
+    Send logged requests to a server on their original schedule
+
+    Parameters
+    ----------
+    url : str
+        base URL of the server
+    records : list
+        (epoch secs, method, path, client IP) tuples in time order
+    speedup : float
+        factor by which time between requests is compressed
+    concurrency : int
+        maximum number of requests in flight, further requests wait for one
+        to complete and are late
+    timeout : float
+        seconds after which a request fails
+    forward_ip : bool
+        send the original client IP as `X-Forwarded-For`
+
+    Returns
+    -------
+    results : dict
+        latency, throughput and status summary per route and overall, with
+        the lag of requests behind their schedule
+    """
+    latencies, statuses, lags = {}, {}, []
+    slots = asyncio.Semaphore(concurrency)
+    tasks = set()
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async def send(session, due, method, path, ip):
+        route = route_of(method, path)
+        headers = {"X-Forwarded-For": ip} if forward_ip and ip else None
+        try:
+            async with session.request(method, url + path, headers=headers) as resp:
+                await resp.read()
+                status = str(resp.status)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            status = "error"
+        finally:
+            slots.release()
+        latencies.setdefault(route, []).append(time.perf_counter() - due)
+        statuses.setdefault(route, Counter())[status] += 1
+
+    async with aiohttp.ClientSession(
+        connector=connector, timeout=client_timeout
+    ) as session:
+        start = time.perf_counter()
+        first = records[0][0] if records else 0
+        for when, method, path, ip in records:
+            due = start + (when - first) / speedup
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await slots.acquire()
+            lags.append(time.perf_counter() - due)
+            task = asyncio.ensure_future(send(session, due, method, path, ip))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+        elapsed = time.perf_counter() - start
+
+    results = summarize(latencies, statuses, elapsed)
+    lags.sort()
+    results["lag"] = {"late": sum(1 for lag in lags if lag > LATE)}
+    if lags:
+        results["lag"]["p99_ms"] = round(lags[int(0.99 * (len(lags) - 1))] * 1000, 3)
+        results["lag"]["max_ms"] = round(lags[-1] * 1000, 3)
+    return results
+
+
+def run(url, paths, speedup=1.0, concurrency=100, limit=None, **kwargs):
+    """
+    Replay access logs and describe the replay
+
+    :param limit: maximum number of requests to replay
+    """
+    records, skipped = read_logs(paths)
+    records = records[:limit]
+    span = records[-1][0] - records[0][0] if records else 0
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(
+            replay(url, records, speedup, concurrency, **kwargs)
+        )
+    finally:
+        loop.close()
+    return {
+        "logs": [str(path) for path in paths],
+        "requests": len(records),
+        "skipped": skipped,
+        "span_secs": span,
+        "speedup": speedup,
+        "concurrency": concurrency,
+        "offered_rps": round(len(records) * speedup / span, 2) if span else None,
+        "results": results,
+    }
@@ -0,0 +1,178 @@
+"""Retention of raw request documents
+
+Closed weeks older than the retention period are rolled up into weekly
+counts per project, verified, and only then deleted in throttled batches.
+Progress is checkpointed in the `maintenance` collection, so an interrupted
+run resumes where it stopped.
+"""
+import asyncio
+import datetime
+
+from pymongo import ASCENDING, ReplaceOne
+
+from . import logger
+from .database import gen_stats_pipeline
+from .utils import get_current_time, timefmt, week_start
+
+CHECKPOINT = "retention"
+
+
+class RetentionError(RuntimeError):
+    """Raised when a week is not fully represented before deletion"""
+
+
+async def apply_retention(
+    mongo, days, batch_size=1000, pause=0.1, verify_archive=False, now=None
+):
+    """
+    Delete raw request documents older than the retention period
+
+    Parameters
+    ----------
+    mongo : MongoClientHelper
+        database helper
+    days : int
+        number of days of raw requests to keep, rounded up to whole weeks
+    batch_size : int
+        number of documents removed per delete
+    pause : float
+        seconds to wait between deletes
+    verify_archive : bool
+        additionally require each week to be in the columnar archive
+    now : datetime, optional
+        current UTC time
+
+    Returns
+    -------
+    deleted : int
+        number of deleted documents
+    """
+    if now is None:
+        now = datetime.datetime.strptime(await get_current_time(), timefmt)
+    cutoff = week_start(now - datetime.timedelta(days=days))
+    await mongo.requests.create_index([("access_time", ASCENDING)])
+    await mongo.rollups.create_index(
+        [("owner", ASCENDING), ("repository", ASCENDING), ("window", ASCENDING)]
+    )
+
+    state = await mongo.maintenance.find_one({"_id": CHECKPOINT}) or {}
+    if state.get("phase") == "deleting":
+        start = datetime.datetime.strptime(state["window"], timefmt)
+        logger.info(f"Resuming retention of week {state['window']}")
+    else:
+        first = await mongo.requests.find_one(
+            {"access_time": {"$lt": cutoff.strftime(timefmt)}},
+            projection={"access_time": True},
+            sort=[("access_time", ASCENDING)],
+        )
+        if first is None:
+            logger.info("No requests older than the retention period")
+            return 0
+        start = week_start(datetime.datetime.strptime(first["access_time"], timefmt))
+
+    nweeks = max((cutoff - start).days // 7, 1)
+    deleted = done = 0
+    while start < cutoff:
+        stop = start + datetime.timedelta(weeks=1)
+        window = start.strftime(timefmt)
+        if state.get("phase") != "deleting" or state.get("window") != window:
+            total = await rollup_week(mongo, start, stop, verify_archive)
+            state = {"_id": CHECKPOINT, "window": window, "phase": "deleting"}
+            await mongo.maintenance.replace_one(
+                {"_id": CHECKPOINT}, state, upsert=True
+            )
+            logger.info(f"Rolled up {total} requests of week {window}")
+        deleted += await delete_week(mongo, start, stop, batch_size, pause)
+        state = {"_id": CHECKPOINT, "window": window, "phase": "done"}
+        await mongo.maintenance.replace_one({"_id": CHECKPOINT}, state, upsert=True)
+        done += 1
+        logger.info(
+            f"Retention: week {window} done ({done}/{nweeks}), "
+            f"{deleted} requests deleted"
+        )
+        start = stop
+    return deleted
+
+
+def week_match(start, stop):
+    """Filter on requests of a week"""
+    start, stop = start.strftime(timefmt), stop.strftime(timefmt)
+    return {"access_time": {"$gte": start, "$lt": stop}}
+
+
+async def rollup_week(mongo, start, stop, verify_archive=False):
+    """
+    Roll up the requests of a week and verify the result
+
+    Rollups are overwritten rather than incremented, so a week can be rolled
+    up again as long as none of its requests were deleted.
+
+    Returns
+    -------
+    total : int
+        number of rolled up requests
+    """
+    window = start.strftime(timefmt)
+    pipeline = gen_stats_pipeline(
+        week_match(start, stop),
+        owner="$request.owner",
+        repository="$request.repository",
+    )
+    ops = []
+    async for val in mongo.requests.aggregate(pipeline):
+        key = val["_id"]
+        ops.append(
+            ReplaceOne(
+                {
+                    "owner": key["owner"],
+                    "repository": key["repository"],
+                    "year": key["year"],
+                    "week": key["week"],
+                },
+                dict(key, count=val["count"], window=window),
+                upsert=True,
+            )
+        )
+    if ops:
+        await mongo.rollups.bulk_write(ops, ordered=False)
+
+    total = await mongo.requests.count_documents(week_match(start, stop))
+    rolled = 0
+    async for val in mongo.rollups.aggregate(
+        [
+            {"$match": {"window": window}},
+            {"$group": {"_id": None, "count": {"$sum": "$count"}}},
+        ]
+    ):
+        rolled = val["count"]
+    if rolled != total:
+        raise RetentionError(
+            f"Week {window} has {total} requests but {rolled} rolled up"
+        )
+    if verify_archive:
+        from .archive import partition_path, read_partition
+
+        path = partition_path(start)
+        if not path.exists():
+            raise RetentionError(f"Week {window} is not archived")
+        archived = len(read_partition(path)["access_time"])
+        if archived != total:
+            raise RetentionError(
+                f"Week {window} has {total} requests but {archived} archived"
+            )
+    return total
+
+
+async def delete_week(mongo, start, stop, batch_size=1000, pause=0.1):
+    """Delete the requests of a week in throttled batches"""
+    deleted = 0
+    while True:
+        cursor = mongo.requests.find(
+            week_match(start, stop), projection={"_id": True}, limit=batch_size
+        )
+        ids = [doc["_id"] async for doc in cursor]
+        if not ids:
+            return deleted
+        result = await mongo.requests.delete_many({"_id": {"$in": ids}})
+        deleted += result.deleted_count
+        await asyncio.sleep(pause)
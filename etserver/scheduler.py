@@ -0,0 +1,116 @@
+"""Priority scheduling of work competing for the event loop and backends"""
+import asyncio
+from collections import deque
+
+from .metrics import SCHEDULER_WAIT
+
+# lanes from highest to lowest priority, with their concurrency shares
+LANES = dict(projects=64, stats=16, background=8, batch=4)
+
+
+class Lane:
+    """Queue and concurrency share of a class of work"""
+
+    def __init__(self, name, share):
+        self.name = name
+        self.share = share
+        self.running = 0
+        self.waiters = deque()
+        self.waits = 0
+        self.wait_time = 0.0
+
+    @property
+    def queued(self):
+        return len(self.waiters)
+
+    def stats(self):
+        return {
+            "share": self.share,
+            "running": self.running,
+            "queued": self.queued,
+            "waits": self.waits,
+            "wait_time": round(self.wait_time, 6),
+        }
+
+
+class WorkScheduler:
+    """
+    Run work in priority lanes with their own queues and concurrency shares
+
+    At most `concurrency` units of work run at once, and each lane runs at most
+    its share of them, so lower priority lanes cannot take over the slots left
+    to interactive requests. Freed slots go to the highest priority lane
+    waiting for one.
+
+    Parameters
+    ----------
+    concurrency : int
+        units of work running at once over all lanes
+    lanes : dict
+        mapping of lane names, highest priority first, to their shares
+    """
+
+    def __init__(self, concurrency=64, lanes=None):
+        self.concurrency = concurrency
+        self.running = 0
+        self.lanes = {
+            name: Lane(name, share) for name, share in (lanes or LANES).items()
+        }
+
+    def slot(self, lane):
+        """Return an asynchronous context manager holding a slot of a lane"""
+        return _Slot(self, self.lanes[lane])
+
+    def stats(self):
+        """Return running and queued work per lane"""
+        return {name: lane.stats() for name, lane in self.lanes.items()}
+
+    def _available(self, lane):
+        return self.running < self.concurrency and lane.running < lane.share
+
+    async def _acquire(self, lane):
+        if not lane.waiters and self._available(lane):
+            self._start(lane)
+            SCHEDULER_WAIT.observe(0.0, lane.name)
+            return
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        waiter = loop.create_future()
+        lane.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # started while being cancelled, pass the slot on
+                self._release(lane)
+            raise
+        finally:
+            lane.waits += 1
+            lane.wait_time += loop.time() - start
+            SCHEDULER_WAIT.observe(loop.time() - start, lane.name)
+
+    def _start(self, lane):
+        self.running += 1
+        lane.running += 1
+
+    def _release(self, lane):
+        self.running -= 1
+        lane.running -= 1
+        for waiting in self.lanes.values():
+            while waiting.waiters and self._available(waiting):
+                waiter = waiting.waiters.popleft()
+                if not waiter.done():
+                    self._start(waiting)
+                    waiter.set_result(None)
+
+
+class _Slot:
+    def __init__(self, scheduler, lane):
+        self.scheduler = scheduler
+        self.lane = lane
+
+    async def __aenter__(self):
+        await self.scheduler._acquire(self.lane)
+
+    async def __aexit__(self, *args):
+        self.scheduler._release(self.lane)
@@ -1,14 +1,30 @@
 import asyncio
+import hmac
+import json
+import math
 import os
 import sys
+import time
 
-import aiohttp
 from sanic import Sanic, response
+from sanic.response import StreamingHTTPResponse
 from sanic.exceptions import abort
 
 from . import logger, CACHEDIR, __version__
+from .admission import AdmissionController, Overloaded
+from .ratelimit import RateLimited, TokenBuckets
+from .scheduler import WorkScheduler
 from .database import MongoClientHelper
-from .getters import fetch_project, fetch_request_info, get_stats
+from .lifecycle import Lifecycle
+from .monitor import LoopMonitor
+from . import metrics, profiling
+from .tracing import span, start_trace
+from .logs import QueueLogging
+from .shared import SharedCache
+from .upstream import UpstreamUnavailable, create_upstreams, close_upstreams
+from .utils import Deadline
+from .warmup import warm_cache
+from .getters import fetch_project, fetch_request_info, get_stats, iter_stats
 
 if os.path.exists("/vagrant"):
     logdir = "/vagrant"
@@ -32,6 +48,11 @@ LOG_SETTINGS = dict(
             "propagate": True,
             "qualname": "sanic.access",
         },
+        "etserver.traces": {
+            "level": "INFO",
+            "handlers": ["tracesfile"],
+            "propagate": False,
+        },
     },
     handlers={
         "consolefile": {
@@ -58,39 +79,273 @@ LOG_SETTINGS = dict(
             "filename": f"{logdir}/access.log",
             "formatter": "access",
         },
+        "tracesfile": {
+            "class": "logging.handlers.TimedRotatingFileHandler",
+            "when": "D",
+            "interval": 7,
+            "backupCount": 10,
+            "filename": f"{logdir}/traces.jsonl",
+            "formatter": "raw",
+        },
     },
     formatters={
         "generic": {
-            "format": "%(asctime)s [%(process)d] [%(levelname)s] %(message)s",
-            "datefmt": "[%Y-%m-%d %H:%M:%S %z]",
-            "class": "logging.Formatter",
+            "datefmt": "%Y-%m-%dT%H:%M:%S%z",
+            "class": "etserver.logs.JSONFormatter",
         },
+        # access records carry the host, request, status and byte fields
         "access": {
-            "format": "%(asctime)s - (%(name)s)[%(levelname)s][%(host)s]: "
-            + "%(request)s %(message)s %(status)d %(byte)d",
-            "datefmt": "[%Y-%m-%d %H:%M:%S %z]",
-            "class": "logging.Formatter",
+            "datefmt": "%Y-%m-%dT%H:%M:%S%z",
+            "class": "etserver.logs.JSONFormatter",
         },
+        # traces are already JSON documents
+        "raw": {"format": "%(message)s", "class": "logging.Formatter"},
     },
 )
+CONFIG_DEFAULTS = dict(
+    # log records are written by a separate thread, see `logs.QueueLogging`;
+    # records of a logger can be sampled (fraction kept), also while the
+    # server is overloaded, and rate limited (records per sec after a burst).
+    # The access log can be disabled altogether with ACCESS_LOG = False
+    LOGGING=dict(
+        queue_size=10000,
+        sampling={"sanic.access": 1.0},
+        overload_sampling={"sanic.access": 0.05},
+        rate_limits={"sanic.root": dict(rate=50, burst=500)},
+    ),
+    # fraction of requests whose trace is written to traces.jsonl
+    TRACE_SAMPLING=0.01,
+    # seconds within which project lookups are answered, possibly with stale
+    # information; clients may ask for another budget with the X-Deadline-Ms
+    # header, None disables deadlines
+    REQUEST_DEADLINE=0.3,
+    # requests handled at once and event loop lag (secs) above which only
+    # cached project lookups are served, see `admission.AdmissionController`
+    ADMISSION=dict(max_inflight=256, max_lag=0.2, retry_after=2),
+    # seconds between probes of the event loop lag, also read by admission
+    # control, and lag (secs) after which the stack of the blocked loop is
+    # logged, see `monitor.LoopMonitor`; a None threshold disables the logs
+    LOOP_MONITOR=dict(interval=0.1, threshold=0.1),
+    # work running at once, and shares of each lane from highest to lowest
+    # priority, see `scheduler.WorkScheduler`
+    SCHEDULER=dict(
+        concurrency=64, lanes=dict(projects=64, stats=16, background=8, batch=4)
+    ),
+    # token buckets limiting project lookups (per sec) of each client IP, and
+    # of each project by a client; rate limited clients are answered from the
+    # cache with a 429, None disables rate limiting
+    RATE_LIMIT=dict(
+        slots=65536,
+        client=dict(rate=20, burst=100),
+        project=dict(rate=1, burst=30),
+    ),
+    # proxies in front of the server, each appending the address of its peer
+    # to X-Forwarded-For; rate limits are keyed on the entry that many from the
+    # end of the header, which clients can otherwise forge, 0 keys them on the
+    # peer address
+    TRUSTED_PROXIES=0,
+    # bearer token of admin endpoints, which are disabled without one, and
+    # longest window (secs) of profiling, see `profiling`
+    ADMIN_TOKEN=os.getenv("ETELEMETRY_ADMIN_TOKEN"),
+    PROFILE_MAX_SECONDS=60,
+    # projects loaded from disk into the shared cache at startup, the most
+    # "recent" or "popular" ones, before the worker is reported ready on
+    # /ready; None disables warmup
+    WARMUP=dict(projects=1000, order="recent"),
+    # seconds given to background work and pending writes on shutdown
+    SHUTDOWN_GRACE_PERIOD=10,
+    # maximum number of projects resolved by a single batch request
+    BATCH_MAX_PROJECTS=100,
+    # maximum number of projects in a single statistics request
+    STATS_BATCH_MAX_PROJECTS=500,
+    # limit until cached project statistics are stale (secs)
+    STATS_STALE_TIME=21600,
+    # share project information and rate limits between workers through
+    # memory-mapped files
+    SHARED_CACHE=True,
+    SHARED_CACHE_SLOTS=4096,
+    SHARED_CACHE_SLOT_SIZE=1024,
+    # time a worker may spend refreshing a project before others take over
+    REFRESH_LEASE_TIME=30,
+    # connection pools, concurrency limits and circuit breakers of upstream
+    # services, see `upstream.Upstream`
+    UPSTREAMS=dict(
+        github=dict(
+            limit=100,
+            limit_per_host=100,
+            dns_ttl=300,
+            keepalive_timeout=30,
+            connect_timeout=3,
+            read_timeout=10,
+            total_timeout=15,
+            concurrency=dict(initial=20, minimum=1, maximum=100, latency_target=1.0),
+            breaker=dict(failure_threshold=5, reset_timeout=30, half_open_calls=1),
+        ),
+        raw=dict(
+            limit=50,
+            limit_per_host=50,
+            dns_ttl=300,
+            keepalive_timeout=30,
+            connect_timeout=3,
+            read_timeout=10,
+            total_timeout=15,
+            concurrency=dict(initial=10, minimum=1, maximum=50, latency_target=1.0),
+            breaker=dict(failure_threshold=5, reset_timeout=30, half_open_calls=1),
+        ),
+        geo=dict(
+            limit=20,
+            limit_per_host=20,
+            dns_ttl=300,
+            keepalive_timeout=30,
+            connect_timeout=2,
+            read_timeout=5,
+            total_timeout=10,
+            concurrency=dict(initial=5, minimum=1, maximum=20, latency_target=0.5),
+            breaker=dict(failure_threshold=5, reset_timeout=30, half_open_calls=1),
+        ),
+    ),
+)
+# keys excluded from project responses
+PRIVATE_KEYS = (
+    "status",
+    "last_update",
+    "cached",
+    "stale",
+    "stats",
+    "stats_update",
+)
+
 app = Sanic("etelemetry", log_config=LOG_SETTINGS)
+for key, val in CONFIG_DEFAULTS.items():
+    app.config.setdefault(key, val)
 if os.getenv("ETELEMETRY_APP_CONFIG"):
     app.config.from_envvar("ETELEMETRY_APP_CONFIG")
 
 
 @app.listener("before_server_start")
 async def init(app, loop):
-    app.sem = asyncio.Semaphore(100)
-    app.session = aiohttp.ClientSession(loop=loop)
+    app.logging = QueueLogging(
+        list(LOG_SETTINGS["loggers"]),
+        overloaded=lambda: app.admission.overloaded,
+        **app.config.LOGGING,
+    )
+    app.logging.start()
+    app.inflight = {}
+    app.profiling = False
+    app.lifecycle = Lifecycle()
+    app.stats = {}
+    app.shared = None
+    if app.config.SHARED_CACHE:
+        app.shared = SharedCache(
+            CACHEDIR / "shared.cache",
+            nslots=app.config.SHARED_CACHE_SLOTS,
+            slot_size=app.config.SHARED_CACHE_SLOT_SIZE,
+        )
+    app.buckets = None
+    if app.config.RATE_LIMIT:
+        app.buckets = TokenBuckets(
+            CACHEDIR / "ratelimit.buckets" if app.config.SHARED_CACHE else None,
+            nslots=app.config.RATE_LIMIT["slots"],
+        )
+    app.upstreams = create_upstreams(app.config.UPSTREAMS)
+    app.monitor = LoopMonitor(loop, **app.config.LOOP_MONITOR)
+    app.monitor.start()
+    app.admission = AdmissionController(monitor=app.monitor, **app.config.ADMISSION)
+    app.scheduler = WorkScheduler(**app.config.SCHEDULER)
     app.mongo = MongoClientHelper()
     logger.info("Using %s as project cache directory" % str(CACHEDIR))
     # ensure mongo is responsive
     await app.mongo.is_valid()
+    app.ready = False
+    app.warming = None
+    if app.config.WARMUP and app.shared is not None:
+        app.warming = app.lifecycle.spawn(warmup(app))
+    else:
+        app.ready = True
+
+
+async def warmup(app):
+    try:
+        await warm_cache(app.shared, **app.config.WARMUP)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("Failed to warm up the shared cache")
+    finally:
+        app.ready = True
 
 
 @app.listener("after_server_stop")
 async def finish(app, loop):
-    await app.session.close()
+    app.monitor.stop()
+    # requests are done, let their background work and writes complete
+    deadline = Deadline(app.config.SHUTDOWN_GRACE_PERIOD)
+    for task in list(app.inflight.values()):
+        app.lifecycle.track(task)
+    await app.lifecycle.drain(deadline.remaining())
+    await app.mongo.close(deadline.remaining())
+    await close_upstreams(app.upstreams)
+    if app.shared is not None:
+        app.shared.close()
+    if app.buckets is not None:
+        app.buckets.close()
+    app.logging.stop()
+
+
+@app.middleware("request")
+async def start_request(request):
+    request["start"] = time.monotonic()
+    request["trace"] = start_trace(
+        f"{request.method} {request.path}", app.config.TRACE_SAMPLING
+    )
+
+
+@app.middleware("response")
+async def finish_request(request, response):
+    response.headers["Server-Timing"] = request["trace"].server_timing()
+    if isinstance(response, StreamingHTTPResponse):
+        # the body is yet to be written, see `record_stream`
+        return
+    observe_request(request, response.status)
+
+
+def observe_request(request, status):
+    """Record the latency and trace of an answered request"""
+    metrics.REQUEST_LATENCY.observe(
+        time.monotonic() - request["start"],
+        request.uri_template or "unmatched",
+        request.method,
+        str(status),
+    )
+    trace = request["trace"]
+    trace.end()
+    trace.export()
+
+
+def record_stream(request, streaming_fn):
+    """Observe a streamed request once its whole body is written"""
+
+    async def stream(resp):
+        try:
+            await streaming_fn(resp)
+        finally:
+            observe_request(request, resp.status)
+
+    return stream
+
+
+@app.exception(UpstreamUnavailable, Overloaded)
+async def service_unavailable(request, exception):
+    return response.json(
+        {"message": str(exception)},
+        status=503,
+        headers={"Retry-After": str(math.ceil(exception.retry_after))},
+    )
+
+
+@app.exception(RateLimited)
+async def rate_limited(request, exception):
+    return limited_response({"message": str(exception)}, exception.retry_after)
 
 
 @app.route("/projects/<project:path>")
@@ -108,21 +363,94 @@ async def get_project_info(request, project: str):
         abort(400, message="Invalid project")
     owner, repo = project.split("/")
     request_ip = request.remote_addr or request.ip
-    # get information about project
-    project_info = await fetch_project(app, owner, repo)
-    if "version" not in project_info:
-        abort(404, f"{owner}/{repo} does not have a version")
-    if "is_ci" in request.args:
-        project_info["is_ci"] = True
-    await app.mongo.insert_project(request_ip, owner, repo, project_info)
-    # get request information
-    await fetch_request_info(app, request_ip)
-    # keys exclude for response
-    crud = ("status", "last_update", "cached", "stats", "stats_update")
-    for k in crud:
-        if k in project_info:
-            del project_info[k]
-    return response.json(project_info)
+    deadline = request_deadline(request)
+    trace = request["trace"]
+    retry_after = rate_limit(request, [project])
+    # cached projects are always served, cold misses are shed under overload
+    cached_only = bool(retry_after) or app.admission.overloaded
+    with app.admission.admit():
+        # get information about project
+        project_info = await fetch_project(
+            app, owner, repo, deadline, cached_only, trace
+        )
+        if project_info is None:
+            shed(retry_after)
+        if "version" not in project_info:
+            abort(404, f"{owner}/{repo} does not have a version")
+        if retry_after:
+            # answer from the cache without recording the request
+            return limited_response(public_info(project_info), retry_after)
+        if "is_ci" in request.args:
+            project_info["is_ci"] = True
+        with span(trace, "mongo"):
+            await app.mongo.insert_project(request_ip, owner, repo, project_info)
+        # get request information
+        await fetch_request_info(app, request_ip, deadline, trace)
+    return response.json(public_info(project_info))
+
+
+@app.route("/projects", methods=["POST"])
+async def get_projects_info(request):
+    """
+    POSTs a batch of GitHub projects and GETs their information.
+
+    :param request: The request object, with a JSON list of "owner/repo" names
+    :type request: Request
+    :return: JSON mapping each project to its information, null if the
+        project does not have a version, or an error with its `status` if the
+        project cannot be served right now
+    """
+    projects, names = parse_projects(request, app.config.BATCH_MAX_PROJECTS)
+    request_ip = request.remote_addr or request.ip
+    deadline = request_deadline(request)
+    trace = request["trace"]
+    retry_after = rate_limit(request, projects)
+    cached_only = bool(retry_after) or app.admission.overloaded
+    with app.admission.admit():
+        # resolve all projects concurrently
+        infos = await asyncio.gather(
+            *[
+                fetch_project(app, owner, repo, deadline, cached_only, trace)
+                for owner, repo in names
+            ],
+            return_exceptions=True,
+        )
+        found = []
+        errors = []
+        out = {}
+        for project, (owner, repo), project_info in zip(projects, names, infos):
+            if project_info is None:
+                # not cached, while rate limited or overloaded
+                project_info = (
+                    RateLimited(retry_after)
+                    if retry_after
+                    else Overloaded(app.admission.retry_after)
+                )
+            if isinstance(project_info, (UpstreamUnavailable, RateLimited, Overloaded)):
+                errors.append(project_info)
+                out[project] = batch_error(project_info)
+                continue
+            if isinstance(project_info, BaseException):
+                raise project_info
+            if "version" not in project_info:
+                out[project] = None
+                continue
+            if "is_ci" in request.args:
+                project_info["is_ci"] = True
+            found.append((owner, repo, project_info))
+            out[project] = public_info(project_info)
+        if len(errors) == len(names):
+            # nothing can be served
+            if isinstance(errors[0], Overloaded):
+                app.admission.reject()
+            raise errors[0]
+        if retry_after:
+            return limited_response(out, retry_after)
+        with span(trace, "mongo"):
+            await app.mongo.insert_projects(request_ip, found)
+        # get request information
+        await fetch_request_info(app, request_ip, deadline, trace)
+    return response.json(out)
 
 
 @app.route("/stats/<project:path>")
@@ -139,14 +467,328 @@ async def get_project_stats(request, project: str):
     if len(project.split("/")) != 2:
         abort(400, message="Invalid project")
     owner, repo = project.split("/")
-    stats = await get_stats(app, owner, repo)
+    with app.admission.admit(shed=True):
+        stats = await get_stats(app, owner, repo)
     if stats is None:
         abort(404, f"{owner}/{repo} does not have a version")
     out = ["year-week,count"]
-    out.extend([f"{k},{v}" for k, v in sorted(stats.items())])
+    out.extend(stats_csv(stats))
     return response.text("\n".join(out))
 
 
+@app.route("/stats", methods=["POST"])
+async def get_projects_stats(request):
+    """
+    POSTs a batch of projects and streams their statistics from server.
+
+    :param request: The request object, with a JSON list of "owner/repo" names
+        and an optional `format` argument (`json` or `csv`)
+    :type request: Request
+    :return: JSON mapping each project to its weekly counts (null if the
+        project is unknown), or CSV with a leading project column
+    """
+    fmt = request.args.get("format", "json")
+    if fmt not in ("json", "csv"):
+        abort(400, message=f"Invalid format {fmt}")
+    _, names = parse_projects(request, app.config.STATS_BATCH_MAX_PROJECTS)
+    app.admission.check()
+
+    async def stream_json(resp):
+        with app.admission.admit():
+            sep = "{"
+            async for owner, repo, stats in iter_stats(app, names):
+                key = json.dumps(f"{owner}/{repo}")
+                await resp.write(f"{sep}{key}:{json.dumps(stats)}")
+                sep = ","
+            await resp.write("}")
+
+    async def stream_csv(resp):
+        with app.admission.admit():
+            await resp.write("project,year-week,count")
+            async for owner, repo, stats in iter_stats(app, names):
+                rows = [f"\n{owner}/{repo},{row}" for row in stats_csv(stats or {})]
+                if rows:
+                    await resp.write("".join(rows))
+
+    if fmt == "csv":
+        return response.stream(record_stream(request, stream_csv))
+    return response.stream(
+        record_stream(request, stream_json), content_type="application/json"
+    )
+
+
+def stats_csv(stats):
+    """Format weekly counts as `year-week,count` rows"""
+    return [f"{k},{v}" for k, v in sorted(stats.items())]
+
+
+def parse_projects(request, limit):
+    """
+    Validate a JSON list of "owner/repo" names from the request body
+
+    :return: unique project names and their (owner, repo) pairs
+    """
+    projects = request.json
+    if not isinstance(projects, list) or not projects or len(projects) > limit:
+        abort(400, message="Expected a list of projects")
+    for project in projects:
+        if not isinstance(project, str) or len(project.split("/")) != 2:
+            abort(400, message=f"Invalid project {project}")
+    projects = list(dict.fromkeys(projects))
+    return projects, [tuple(project.split("/")) for project in projects]
+
+
+def rate_limit(request, projects):
+    """
+    Take tokens from the buckets of a client and of its projects
+
+    :return: seconds until the request would be allowed, 0 if it is
+    """
+    if app.buckets is None:
+        return 0
+    limits = app.config.RATE_LIMIT
+    client = client_ip(request)
+    wait = app.buckets.take(client, cost=len(projects), **limits["client"])
+    for project in projects:
+        key = f"{client} {project}"
+        wait = max(wait, app.buckets.take(key, **limits["project"]))
+    return wait
+
+
+def client_ip(request):
+    """
+    Return the address of the client as seen by the outermost trusted proxy,
+    which unlike the forwarded address cannot be forged
+    """
+    hops = app.config.TRUSTED_PROXIES
+    if hops:
+        forwarded = request.headers.get("X-Forwarded-For", "").split(",")
+        # requests which did not pass all proxies fall back on the peer
+        if len(forwarded) >= hops and forwarded[-hops].strip():
+            return forwarded[-hops].strip()
+    return request.ip
+
+
+def shed(retry_after):
+    """Reject a request which cannot be answered from the cache"""
+    if retry_after:
+        raise RateLimited(retry_after)
+    app.admission.reject()
+
+
+def batch_error(exception):
+    """Describe a project of a batch which cannot be served right now"""
+    return {
+        "message": str(exception),
+        "status": 429 if isinstance(exception, RateLimited) else 503,
+        "retry_after": math.ceil(exception.retry_after),
+    }
+
+
+def limited_response(body, retry_after):
+    """Answer a rate limited request"""
+    return response.json(
+        body, status=429, headers={"Retry-After": str(math.ceil(retry_after))}
+    )
+
+
+def request_deadline(request):
+    """Start the time budget of a request, from its header or the config"""
+    seconds = app.config.REQUEST_DEADLINE
+    try:
+        seconds = int(request.headers["X-Deadline-Ms"]) / 1000
+    except (KeyError, ValueError):
+        pass
+    return Deadline(seconds)
+
+
+def public_info(project_info):
+    """Strip internal keys from project information"""
+    return {k: v for k, v in project_info.items() if k not in PRIVATE_KEYS}
+
+
+@app.route("/ready")
+async def readiness(request):
+    """
+    GETs whether this worker is ready to serve traffic, which it is once its
+    cache is warmed up.
+
+    :param request: The request object
+    :type request: Request
+    """
+    if not app.ready:
+        return response.json(
+            {"ready": False},
+            status=503,
+            headers={"Retry-After": str(app.config.ADMISSION["retry_after"])},
+        )
+    return response.json({"ready": True})
+
+
+@app.route("/upstreams")
+async def upstreams_info(request):
+    """
+    GETs connection pool utilisation of upstream services.
+
+    :param request: The request object
+    :type request: Request
+    :return: JSON mapping each upstream to its pool statistics
+    """
+    return response.json(
+        {name: upstream.stats() for name, upstream in app.upstreams.items()}
+    )
+
+
+@app.route("/metrics")
+async def metrics_info(request):
+    """
+    GETs metrics of this worker in the Prometheus text format.
+
+    :param request: The request object
+    :type request: Request
+    """
+    return response.text(metrics.render(), content_type="text/plain; version=0.0.4")
+
+
+def check_admin(request):
+    """Reject requests without the admin token, or all if none is set"""
+    token = app.config.ADMIN_TOKEN
+    if not token:
+        abort(404)
+    given = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(given.encode(), f"Bearer {token}".encode()):
+        abort(401, "Invalid admin token")
+
+
+def profile_window(request, default=10):
+    """Parse the `seconds` argument of profiling requests"""
+    try:
+        seconds = float(request.args.get("seconds", default))
+    except ValueError:
+        abort(400, "seconds must be a number")
+    if not 0 < seconds <= app.config.PROFILE_MAX_SECONDS:
+        abort(400, f"seconds must be within (0, {app.config.PROFILE_MAX_SECONDS}]")
+    return seconds
+
+
+@app.route("/admin/profile")
+async def profile_worker(request):
+    """
+    GETs a sampling profile of the event loop of the answering worker.
+
+    Requires the admin token as a bearer token.
+
+    :param request: The request object with optional `seconds`, `interval`
+        (secs between samples) and `format` (`collapsed` or `speedscope`)
+        arguments
+    :type request: Request
+    """
+    check_admin(request)
+    seconds = profile_window(request)
+    fmt = request.args.get("format", "collapsed")
+    if fmt not in ("collapsed", "speedscope"):
+        abort(400, "format must be collapsed or speedscope")
+    try:
+        interval = min(max(float(request.args.get("interval", 0.01)), 0.001), 1)
+    except ValueError:
+        abort(400, "interval must be a number")
+    if app.profiling:
+        abort(409, "Worker is already profiled")
+    app.profiling = True
+    try:
+        profiler = await profiling.profile(seconds, interval)
+    finally:
+        app.profiling = False
+    headers = {"X-Process-Id": str(os.getpid())}
+    if fmt == "speedscope":
+        name = f"etserver worker {os.getpid()}"
+        return response.json(profiler.speedscope(name), headers=headers)
+    return response.text(profiler.collapsed(), headers=headers)
+
+
+@app.route("/admin/allocations")
+async def allocations_info(request):
+    """
+    GETs the largest allocations of the answering worker over a window.
+
+    Requires the admin token as a bearer token.
+
+    :param request: The request object with optional `seconds` and `limit`
+        (number of allocation sites) arguments
+    :type request: Request
+    """
+    check_admin(request)
+    seconds = profile_window(request)
+    try:
+        limit = int(request.args.get("limit", 25))
+    except ValueError:
+        abort(400, "limit must be an integer")
+    try:
+        top = await profiling.trace_allocations(seconds, limit)
+    except RuntimeError as e:
+        abort(409, str(e))
+    return response.json(
+        {"process": os.getpid(), "seconds": seconds, "allocations": top}
+    )
+
+
+# queue depths and loads, read when metrics are collected
+metrics.Gauge(
+    "et_inflight_requests",
+    "Requests being handled",
+    func=lambda: {(): app.admission.inflight},
+)
+metrics.Gauge(
+    "et_event_loop_lag_seconds",
+    "Delay of event loop callbacks",
+    func=lambda: {(): app.monitor.lag},
+)
+metrics.Gauge(
+    "et_scheduler_queued",
+    "Work waiting for a slot per lane",
+    ("lane",),
+    func=lambda: {name: lane.queued for name, lane in app.scheduler.lanes.items()},
+)
+metrics.Gauge(
+    "et_scheduler_running",
+    "Work running per lane",
+    ("lane",),
+    func=lambda: {name: lane.running for name, lane in app.scheduler.lanes.items()},
+)
+metrics.Gauge(
+    "et_upstream_queued",
+    "Calls waiting for the concurrency limit of upstream services",
+    ("upstream",),
+    func=lambda: {name: up.limiter.queued for name, up in app.upstreams.items()},
+)
+metrics.Gauge(
+    "et_upstream_inflight",
+    "Calls in flight to upstream services",
+    ("upstream",),
+    func=lambda: {name: up.limiter.inflight for name, up in app.upstreams.items()},
+)
+metrics.Gauge(
+    "et_background_tasks",
+    "Background tasks running",
+    func=lambda: {(): len(app.lifecycle.tasks)},
+)
+metrics.Gauge(
+    "et_mongo_pending_writes",
+    "Mongo writes not completed yet",
+    func=lambda: {(): len(app.mongo.pending)},
+)
+metrics.Gauge(
+    "et_log_queued",
+    "Log records waiting to be written",
+    func=lambda: {(): app.logging.queue.qsize()},
+)
+metrics.Gauge(
+    "et_log_dropped",
+    "Log records dropped since the log queue was full",
+    func=lambda: {(): app.logging.dropped},
+)
+
+
 @app.route("/")
 async def server_info(request):
     return response.json(
@@ -162,17 +804,353 @@ def get_parser():
     from argparse import ArgumentParser
 
     parser = ArgumentParser()
-    parser.add_argument("command", choices=("up",), help="action")
-    parser.add_argument("--host", default="0.0.0.0", help="hostname")
-    parser.add_argument("--port", default=8000, help="server port")
-    parser.add_argument("--workers", default=1, help="worker processes")
+    subparsers = parser.add_subparsers(dest="command", help="action")
+    subparsers.required = True
+    up = subparsers.add_parser("up", help="start the server")
+    up.add_argument("--host", default="0.0.0.0", help="hostname")
+    up.add_argument("--port", default=8000, type=int, help="server port")
+    up.add_argument("--workers", default=1, type=int, help="worker processes")
+    up.add_argument(
+        "--no-access-log",
+        dest="access_log",
+        action="store_false",
+        default=None,
+        help="do not log requests",
+    )
+    archive = subparsers.add_parser("archive", help="columnar request archive")
+    archive.add_argument(
+        "action",
+        choices=("export", "query"),
+        help="export closed weeks of requests, or count archived requests",
+    )
+    archive.add_argument("--project", help="restrict counts to owner/repo")
+    archive.add_argument(
+        "--versions", action="store_true", help="count requests per version"
+    )
+    archive.add_argument("--processes", type=int, help="parallel processes")
+    retention = subparsers.add_parser(
+        "retention", help="roll up and delete old raw requests"
+    )
+    retention.add_argument(
+        "--days", default=365, type=int, help="days of raw requests to keep"
+    )
+    retention.add_argument(
+        "--batch-size", default=1000, type=int, help="documents per delete"
+    )
+    retention.add_argument(
+        "--pause", default=0.1, type=float, help="seconds between deletes"
+    )
+    retention.add_argument(
+        "--verify-archive",
+        action="store_true",
+        help="only delete weeks present in the columnar archive",
+    )
+    bench = subparsers.add_parser(
+        "bench", help="load benchmark against stubbed upstream services"
+    )
+    bench.add_argument(
+        "--duration", default=10, type=float, help="seconds of measured traffic"
+    )
+    bench.add_argument(
+        "--warmup", default=2, type=float, help="seconds of traffic before measuring"
+    )
+    bench.add_argument("--concurrency", default=32, type=int, help="clients")
+    bench.add_argument(
+        "--mix",
+        help="weights of request kinds, e.g. hot=0.7,cold=0.1,stale=0.1,stats=0.1",
+    )
+    bench.add_argument(
+        "--latency", default=0.05, type=float, help="seconds taken by upstream stubs"
+    )
+    bench.add_argument(
+        "--error-rate", default=0.0, type=float, help="fraction of upstream errors"
+    )
+    bench.add_argument("--seed", default=0, type=int, help="seed of the traffic")
+    bench.add_argument("--output", help="JSON file to save results to")
+    microbench = subparsers.add_parser(
+        "microbench", help="time functions on the request path"
+    )
+    microbench.add_argument("names", nargs="*", help="benchmarks to run")
+    microbench.add_argument(
+        "--mongo",
+        action="store_true",
+        help="also time get_status against data seeded in mongo",
+    )
+    microbench.add_argument(
+        "--save", action="store_true", help="save results as the baseline"
+    )
+    microbench.add_argument(
+        "--compare", action="store_true", help="fail on regressions from the baseline"
+    )
+    microbench.add_argument(
+        "--baseline", default="benchmarks/micro.json", help="baseline file"
+    )
+    microbench.add_argument(
+        "--threshold",
+        default=0.2,
+        type=float,
+        help="relative slowdown flagged as a regression",
+    )
+    gendata = subparsers.add_parser(
+        "gen-data", help="synthetic requests for scale testing"
+    )
+    gendata.add_argument(
+        "--requests", default=1000000, type=int, help="number of requests"
+    )
+    gendata.add_argument("--start", help="first day of requests, as YYYY-MM-DD")
+    gendata.add_argument("--end", help="day after the last requests, as YYYY-MM-DD")
+    gendata.add_argument("--projects", default=1000, type=int, help="projects")
+    gendata.add_argument(
+        "--zipf", default=1.2, type=float, help="exponent of project popularity"
+    )
+    gendata.add_argument(
+        "--ci-share", default=0.3, type=float, help="fraction of requests from CI"
+    )
+    gendata.add_argument(
+        "--ip-reuse",
+        default=0.9,
+        type=float,
+        help="fraction of requests from IPs seen before",
+    )
+    gendata.add_argument("--seed", default=0, type=int, help="seed of the data")
+    gendata.add_argument("--processes", type=int, help="parallel processes")
+    gendata.add_argument(
+        "--to",
+        dest="target",
+        default="jsonl",
+        choices=("mongo", "archive", "jsonl"),
+        help="write to mongo, the columnar archive, or JSON lines files",
+    )
+    gendata.add_argument(
+        "--output",
+        help="database for mongo (et-synthetic), directory otherwise (synthetic)",
+    )
+    replay = subparsers.add_parser("replay", help="replay access logs")
+    replay.add_argument("logs", nargs="+", help="access logs, in any order")
+    replay.add_argument(
+        "--url", default="http://localhost:8000", help="base URL of the server"
+    )
+    replay.add_argument(
+        "--speedup", default=1.0, type=float, help="time compression factor"
+    )
+    replay.add_argument(
+        "--concurrency", default=100, type=int, help="requests in flight"
+    )
+    replay.add_argument("--limit", type=int, help="number of requests to replay")
+    replay.add_argument(
+        "--timeout", default=10, type=float, help="seconds before requests fail"
+    )
+    replay.add_argument(
+        "--no-forward-ip",
+        dest="forward_ip",
+        action="store_false",
+        help="do not send original client IPs as X-Forwarded-For",
+    )
+    replay.add_argument("--output", help="JSON file to save results to")
+    snapshot = subparsers.add_parser(
+        "snapshot", help="portable snapshot of the project cache"
+    )
+    snapshot.add_argument(
+        "action",
+        choices=("export", "import"),
+        help="write the project cache to a snapshot, or fill it from one",
+    )
+    snapshot.add_argument("path", help="snapshot file")
+    snapshot.add_argument(
+        "--force",
+        action="store_true",
+        help="replace cached entries newer than those of the snapshot",
+    )
     return parser
 
 
+def run_with_mongo(func, *args, **kwargs):
+    """Run a maintenance coroutine function against the database"""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    mongo = MongoClientHelper()
+    try:
+        return loop.run_until_complete(func(mongo, *args, **kwargs))
+    finally:
+        mongo.client.close()
+        loop.close()
+
+
+def run_archive(pargs):
+    from . import archive
+
+    if pargs.action == "export":
+        written = run_with_mongo(archive.export_requests)
+        print(f"Archived {len(written)} weeks to {archive.ARCHIVEDIR}")
+        return
+
+    counts = archive.weekly_counts(
+        project=pargs.project, by_version=pargs.versions, processes=pargs.processes
+    )
+    if pargs.versions:
+        print("project,year-week,version,count")
+        for project, weeks in counts.items():
+            for yearweek, versions in weeks.items():
+                for version, count in versions.items():
+                    print(f"{project},{yearweek},{version},{count}")
+    else:
+        print("project,year-week,count")
+        for project, weeks in counts.items():
+            for row in stats_csv(weeks):
+                print(f"{project},{row}")
+
+
+def run_retention(pargs):
+    from .retention import apply_retention
+
+    deleted = run_with_mongo(
+        apply_retention,
+        pargs.days,
+        batch_size=pargs.batch_size,
+        pause=pargs.pause,
+        verify_archive=pargs.verify_archive,
+    )
+    print(f"Deleted {deleted} requests older than {pargs.days} days")
+
+
+def run_bench(pargs):
+    from .benchmark import MIX, benchmark, parse_mix
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(
+            benchmark(
+                duration=pargs.duration,
+                warmup=pargs.warmup,
+                concurrency=pargs.concurrency,
+                mix=parse_mix(pargs.mix) if pargs.mix else MIX,
+                latency=pargs.latency,
+                error_rate=pargs.error_rate,
+                seed=pargs.seed,
+            )
+        )
+    finally:
+        loop.close()
+    out = json.dumps(results, indent=2)
+    if pargs.output:
+        with open(pargs.output, "w") as fp:
+            fp.write(out + "\n")
+    print(out)
+
+
+def run_microbench(pargs):
+    from . import microbench
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        results = loop.run_until_complete(
+            microbench.run_benchmarks(pargs.names, mongo=pargs.mongo)
+        )
+    finally:
+        loop.close()
+    baseline = microbench.load_baseline(pargs.baseline) if pargs.compare else {}
+    print("benchmark,usecs,baseline_usecs")
+    for name, value in results.items():
+        base = baseline.get(name)
+        base = "" if base is None else f"{base * 1e6:.3f}"
+        print(f"{name},{value * 1e6:.3f},{base}")
+    if pargs.save:
+        microbench.save_baseline(results, pargs.baseline)
+    if pargs.compare:
+        regressions = microbench.compare(results, baseline, pargs.threshold)
+        for name, base, value, ratio in regressions:
+            print(f"Regression: {name} took {ratio:.2f}x its baseline", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+def run_gendata(pargs):
+    import datetime
+    from .gendata import generate
+
+    def day(value):
+        return datetime.datetime.strptime(value, "%Y-%m-%d")
+
+    end = day(pargs.end) if pargs.end else day(f"{datetime.date.today()}")
+    start = day(pargs.start) if pargs.start else end - datetime.timedelta(days=365)
+    output = pargs.output
+    if output is None:
+        output = "et-synthetic" if pargs.target == "mongo" else "synthetic"
+    counts = generate(
+        pargs.requests,
+        start,
+        end,
+        target=pargs.target,
+        output=output,
+        seed=pargs.seed,
+        processes=pargs.processes,
+        projects=pargs.projects,
+        zipf=pargs.zipf,
+        ci_share=pargs.ci_share,
+        ip_reuse=pargs.ip_reuse,
+    )
+    print(f"Wrote {counts['requests']} requests and {counts['geo']} geolocations")
+
+
+def run_replay(pargs):
+    from .replay import run
+
+    results = run(
+        pargs.url.rstrip("/"),
+        pargs.logs,
+        speedup=pargs.speedup,
+        concurrency=pargs.concurrency,
+        limit=pargs.limit,
+        timeout=pargs.timeout,
+        forward_ip=pargs.forward_ip,
+    )
+    out = json.dumps(results, indent=2)
+    if pargs.output:
+        with open(pargs.output, "w") as fp:
+            fp.write(out + "\n")
+    print(out)
+
+
+def run_snapshot(pargs):
+    from .snapshot import SnapshotError, export_snapshot, import_snapshot
+
+    if pargs.action == "export":
+        counts = export_snapshot(pargs.path)
+        print(f"Exported {counts['projects']} projects and {counts['stats']} stats")
+        return
+    try:
+        counts = import_snapshot(pargs.path, force=pargs.force)
+    except SnapshotError as e:
+        sys.exit(str(e))
+    print(f"Imported {counts['projects']} projects and {counts['stats']} stats")
+
+
 def main(argv=None):
     parser = get_parser()
     pargs = parser.parse_args(argv)
-    app.run(**vars(pargs))
+    if pargs.command == "archive":
+        run_archive(pargs)
+    elif pargs.command == "retention":
+        run_retention(pargs)
+    elif pargs.command == "bench":
+        run_bench(pargs)
+    elif pargs.command == "microbench":
+        run_microbench(pargs)
+    elif pargs.command == "gen-data":
+        run_gendata(pargs)
+    elif pargs.command == "replay":
+        run_replay(pargs)
+    elif pargs.command == "snapshot":
+        run_snapshot(pargs)
+    else:
+        app.run(
+            host=pargs.host,
+            port=pargs.port,
+            workers=pargs.workers,
+            access_log=pargs.access_log,
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,249 @@
+"""Project cache shared between worker processes
+
+Project information lives in a fixed-size hash table inside a memory-mapped
+file, so every worker started by `et up --workers N` sees the same entries.
+Each slot carries a version number which is odd while the slot is written:
+readers never lock and simply retry when the version changed under them,
+and reuse their decoded copy for as long as the version is unchanged.
+Writers, and refresh leases, are serialized with a file lock.
+"""
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b"ETSHARE1"
+# magic, number of slots, slot size
+HEADER = struct.Struct("<8sII")
+# key hash, version, lease pid, lease expiry, last write, data length
+SLOT = struct.Struct("<QQiddI")
+# number of slots probed for a key before evicting the oldest one
+MAX_PROBES = 8
+
+
+class SharedCache:
+    """
+    Hash table of JSON documents keyed by strings in a memory-mapped file
+
+    Parameters
+    ----------
+    path : Path
+        backing file, shared by all processes using the cache
+    nslots : int
+        number of entries
+    slot_size : int
+        bytes per entry, documents which do not fit are not cached
+    """
+
+    def __init__(self, path, nslots=4096, slot_size=1024):
+        self.path = str(path)
+        self.nslots = nslots
+        self.slot_size = slot_size
+        self.size = HEADER.size + nslots * slot_size
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            header = HEADER.pack(MAGIC, nslots, slot_size)
+            if os.pread(self._fd, HEADER.size, 0) != header:
+                # new file, or one with another geometry
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, self.size)
+                os.pwrite(self._fd, header, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._map = mmap.mmap(self._fd, self.size)
+        # decoded entries of this process, by key
+        self._local = {}
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    def get(self, key, retries=100):
+        """
+        Return a copy of the entry stored under key, or None if missing
+
+        :param retries: number of reads attempted while the entry is written
+        """
+        khash = _hash(key)
+        for index in self._probe(khash):
+            offset = self._offset(index)
+            for _ in range(retries):
+                stored, version, _, _, _, length = SLOT.unpack_from(self._map, offset)
+                if not stored:
+                    return None
+                if stored != khash:
+                    break
+                if version % 2:
+                    # slot is being written
+                    continue
+                if not length:
+                    return None
+                local = self._local.get(key)
+                if local is not None and local[0] == version:
+                    return dict(local[1])
+                start = offset + SLOT.size
+                data = self._map[start : start + length]
+                if SLOT.unpack_from(self._map, offset)[:2] != (khash, version):
+                    continue
+                value = json.loads(data.decode())
+                self._local[key] = (version, value)
+                return dict(value)
+            else:
+                return None
+        return None
+
+    def put(self, key, value):
+        """
+        Store a JSON serializable entry under key
+
+        :return: whether the entry fit in its slot
+        """
+        data = json.dumps(value).encode()
+        if len(data) > self.slot_size - SLOT.size:
+            return False
+        with self._locked():
+            index = self._claim(_hash(key))
+            offset = self._offset(index)
+            khash, version, pid, expiry, _, _ = SLOT.unpack_from(self._map, offset)
+            # an odd version marks the slot as being written
+            SLOT.pack_into(
+                self._map, offset, khash, version + 1, pid, expiry, time.time(), 0
+            )
+            start = offset + SLOT.size
+            self._map[start : start + len(data)] = data
+            SLOT.pack_into(
+                self._map,
+                offset,
+                khash,
+                version + 2,
+                pid,
+                expiry,
+                time.time(),
+                len(data),
+            )
+        self._local[key] = (version + 2, value)
+        return True
+
+    def acquire_lease(self, key, ttl):
+        """
+        Try to become the only process refreshing an entry
+
+        Leases are kept in the slot of their entry, and never evict another
+        entry: when the table is full, the lease is granted without being
+        recorded.
+
+        :param ttl: seconds after which the lease expires if not released
+        :return: whether the lease was acquired
+        """
+        with self._locked():
+            index = self._claim(_hash(key), evict=False)
+            if index is None:
+                return True
+            offset = self._offset(index)
+            khash, version, pid, expiry, updated, length = SLOT.unpack_from(
+                self._map, offset
+            )
+            now = time.time()
+            if pid and pid != os.getpid() and expiry > now:
+                return False
+            SLOT.pack_into(
+                self._map,
+                offset,
+                khash,
+                version,
+                os.getpid(),
+                now + ttl,
+                updated,
+                length,
+            )
+        return True
+
+    def lease_active(self, key):
+        """Whether another process holds an unexpired lease on an entry"""
+        khash = _hash(key)
+        for index in self._probe(khash):
+            stored, _, pid, expiry, _, _ = SLOT.unpack_from(
+                self._map, self._offset(index)
+            )
+            if not stored:
+                return False
+            if stored == khash:
+                return bool(pid) and pid != os.getpid() and expiry > time.time()
+        return False
+
+    def release_lease(self, key):
+        """Release a lease held by this process"""
+        khash = _hash(key)
+        with self._locked():
+            for index in self._probe(khash):
+                offset = self._offset(index)
+                stored, version, pid, _, updated, length = SLOT.unpack_from(
+                    self._map, offset
+                )
+                if stored == khash:
+                    if pid == os.getpid():
+                        SLOT.pack_into(
+                            self._map, offset, khash, version, 0, 0, updated, length
+                        )
+                    return
+
+    def _offset(self, index):
+        return HEADER.size + index * self.slot_size
+
+    def _probe(self, khash):
+        home = khash % self.nslots
+        return [(home + i) % self.nslots for i in range(min(MAX_PROBES, self.nslots))]
+
+    def _claim(self, khash, evict=True):
+        """
+        Find the slot of a key, taking over an empty or the oldest one
+
+        :param evict: whether the oldest entry may be taken over
+        :return: index of the slot, None if no slot is free and not `evict`
+        """
+        candidates = self._probe(khash)
+        oldest = None
+        for index in candidates:
+            offset = self._offset(index)
+            stored, _, _, _, updated, _ = SLOT.unpack_from(self._map, offset)
+            if stored == khash:
+                return index
+            if stored == 0:
+                oldest = (index, -1.0)
+                break
+            if oldest is None or updated < oldest[1]:
+                oldest = (index, updated)
+        if oldest[1] >= 0 and not evict:
+            return None
+        index = oldest[0]
+        offset = self._offset(index)
+        version = SLOT.unpack_from(self._map, offset)[1]
+        # keep versions increasing so readers notice the new owner
+        SLOT.pack_into(self._map, offset, khash, version + 2, 0, 0, 0, 0)
+        return index
+
+    def _locked(self):
+        return _FileLock(self._fd)
+
+
+class _FileLock:
+    """Exclusive lock on the first byte of a file"""
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def __enter__(self):
+        fcntl.lockf(self.fd, fcntl.LOCK_EX, 1, 0)
+
+    def __exit__(self, *args):
+        fcntl.lockf(self.fd, fcntl.LOCK_UN, 1, 0)
+
+
+def _hash(key):
+    """Return a non-zero 64-bit hash of a string, zero marks empty slots"""
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    return struct.unpack("<Q", digest)[0] or 1
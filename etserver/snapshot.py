@@ -0,0 +1,123 @@
+"""Portable snapshots of the project cache
+
+A snapshot holds the cached information and persisted statistics of every
+project in a single gzip-compressed JSON document, preceded by a header
+with the SHA-256 checksum of the compressed document. Importing one fills
+the cache of a new node without any call to GitHub.
+"""
+import datetime
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from . import CACHEDIR, __version__
+from .utils import timefmt
+
+MAGIC = b"ETSNAP1"
+
+
+class SnapshotError(Exception):
+    """Raised when a snapshot is corrupt or of an unknown format"""
+
+
+def _read_json(path):
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return None
+
+
+def _write_json(path, doc):
+    # atomically, as the server may be reading the cache
+    tmp = path.with_suffix(".tmp")
+    tmp.write_text(json.dumps(doc))
+    os.replace(tmp, path)
+
+
+def collect(cachedir=CACHEDIR):
+    """Gather cached information and statistics of all projects"""
+    cachedir = Path(cachedir)
+    projects, stats = {}, {}
+    for path in cachedir.glob("*--*.json"):
+        doc = _read_json(path)
+        if doc is not None:
+            projects[path.stem.replace("--", "/", 1)] = doc
+    for path in (cachedir / "stats").glob("*--*.json"):
+        doc = _read_json(path)
+        if doc is not None:
+            stats[path.stem.replace("--", "/", 1)] = doc
+    return projects, stats
+
+
+def export_snapshot(path, cachedir=CACHEDIR):
+    """
+    Write a snapshot of the project cache
+
+    :return: numbers of exported projects and statistics
+    """
+    projects, stats = collect(cachedir)
+    doc = {
+        "created": datetime.datetime.utcnow().strftime(timefmt),
+        "server_version": __version__,
+        "projects": projects,
+        "stats": stats,
+    }
+    data = gzip.compress(json.dumps(doc, separators=(",", ":")).encode(), 6)
+    checksum = hashlib.sha256(data).hexdigest().encode()
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as fp:
+        fp.write(MAGIC + b" " + checksum + b"\n")
+        fp.write(data)
+    os.replace(tmp, path)
+    return {"projects": len(projects), "stats": len(stats)}
+
+
+def read_snapshot(path):
+    """
+    Read and verify a snapshot
+
+    :raises SnapshotError: if the snapshot is corrupt
+    """
+    with open(path, "rb") as fp:
+        header = fp.readline().split()
+        data = fp.read()
+    if len(header) != 2 or header[0] != MAGIC:
+        raise SnapshotError(f"{path} is not a snapshot")
+    if hashlib.sha256(data).hexdigest().encode() != header[1]:
+        raise SnapshotError(f"Checksum mismatch, {path} is corrupt")
+    return json.loads(gzip.decompress(data).decode())
+
+
+def import_snapshot(path, cachedir=CACHEDIR, force=False):
+    """
+    Fill the project cache from a snapshot
+
+    Entries newer than those of the snapshot are kept, unless forced.
+
+    :return: numbers of imported projects and statistics
+    """
+    doc = read_snapshot(path)
+    cachedir = Path(cachedir)
+    (cachedir / "stats").mkdir(parents=True, exist_ok=True)
+    counts = {"projects": 0, "stats": 0}
+    for kind, directory, updated in (
+        ("projects", cachedir, "last_update"),
+        ("stats", cachedir / "stats", "stats_update"),
+    ):
+        for name, entry in doc[kind].items():
+            owner, _, repo = name.partition("/")
+            if not owner or not repo or "/" in repo:
+                continue
+            target = directory / f"{owner}--{repo}.json"
+            current = None if force else _read_json(target)
+            # time strings sort chronologically
+            if current is not None and (current.get(updated) or "") >= (
+                entry.get(updated) or ""
+            ):
+                continue
+            _write_json(target, entry)
+            counts[kind] += 1
+    return counts
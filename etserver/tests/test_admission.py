@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ..admission import AdmissionController, Overloaded
+
+
+def test_admission():
+    monitor = SimpleNamespace(lag=0.0)
+    admission = AdmissionController(
+        max_inflight=2, max_lag=0.1, retry_after=3, monitor=monitor
+    )
+    with admission.admit(shed=True):
+        with admission.admit(shed=True):
+            assert admission.overloaded
+            # low priority requests are shed, others still admitted
+            with pytest.raises(Overloaded) as exc:
+                with admission.admit(shed=True):
+                    pass
+            assert exc.value.retry_after == 3
+            with admission.admit():
+                assert admission.inflight == 3
+    assert admission.inflight == 0
+    assert not admission.overloaded
+    assert admission.stats()["rejected"] == 1
+
+    # a lagging event loop, as measured by the monitor, sheds requests too
+    monitor.lag = 0.5
+    with pytest.raises(Overloaded):
+        admission.check()
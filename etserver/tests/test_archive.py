@@ -0,0 +1,46 @@
+import datetime
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ..archive import partition_path, read_partition, weekly_counts, write_partition
+from ..utils import timefmt, week_start
+
+
+def gen_doc(access_time, repo, version):
+    return {
+        "access_time": access_time.strftime(timefmt),
+        "request": {"owner": "nipy", "repository": repo, "version": version},
+    }
+
+
+def test_week_start():
+    assert week_start(datetime.datetime(2020, 1, 8, 13)) == datetime.datetime(
+        2020, 1, 5
+    )
+    assert week_start(datetime.datetime(2020, 1, 5)) == datetime.datetime(2020, 1, 5)
+
+
+def test_weekly_counts(tmp_path):
+    # the week of 2019-12-29 spans two years
+    start = datetime.datetime(2019, 12, 29)
+    docs = [
+        gen_doc(start + datetime.timedelta(hours=6 * i), "nipype", f"1.{i % 2}")
+        for i in range(28)
+    ]
+    docs.append(gen_doc(start, "pydra", "0.1"))
+    path = partition_path(start, tmp_path)
+    write_partition(path, docs)
+    assert len(read_partition(path)["access_time"]) == 29
+
+    counts = weekly_counts(paths=[path], processes=1)
+    # as with $week of mongo, days before the first Sunday of 2020 are week 0
+    assert counts["nipy/nipype"] == {"2019-52": 12, "2020-00": 16}
+    assert counts["nipy/pydra"] == {"2019-52": 1}
+
+    versions = weekly_counts(
+        project="nipy/nipype", by_version=True, paths=[path], processes=1
+    )
+    assert list(versions) == ["nipy/nipype"]
+    assert versions["nipy/nipype"]["2019-52"] == {"1.0": 6, "1.1": 6}
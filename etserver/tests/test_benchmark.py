@@ -0,0 +1,45 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from ..benchmark import MemoryMongo, parse_mix, summarize
+
+
+def test_summarize():
+    latencies = {"hot": [i / 1000 for i in range(1, 1001)], "cold": []}
+    statuses = {"hot": Counter({"200": 990, "503": 10}), "cold": Counter()}
+    summary = summarize(latencies, statuses, elapsed=2)
+    assert summary["hot"]["requests"] == 1000
+    assert summary["hot"]["errors"] == 10
+    assert summary["hot"]["rps"] == 500
+    assert summary["hot"]["p50_ms"] == 500
+    assert summary["hot"]["p99_ms"] == 990
+    assert summary["hot"]["p999_ms"] == 999
+    assert summary["cold"]["p50_ms"] is None
+    assert summary["total"]["requests"] == 1000
+
+
+def test_parse_mix():
+    assert parse_mix("hot=0.9,stats=0.1") == {"hot": 0.9, "stats": 0.1}
+    with pytest.raises(ValueError):
+        parse_mix("warm=1")
+
+
+def test_memory_mongo():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    mongo = MemoryMongo()
+
+    async def run():
+        await mongo.insert_project("1.2.3.4", "owner", "repo", {"version": "1.0"})
+        await mongo.insert_projects("1.2.3.4", [("owner", "repo", {"status": 200})])
+        stats = await mongo.get_status("owner", "repo")
+        assert sum(stats.values()) == 2
+        statuses = [s async for s in mongo.get_statuses({("owner", "repo"): None})]
+        assert statuses == [("owner", "repo", stats)]
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
@@ -0,0 +1,47 @@
+import asyncio
+import datetime
+
+from ..database import MongoClientHelper, stats_start
+from ..utils import timefmt
+
+
+def test_stats_start():
+    # the last recorded week is aggregated again from its Sunday
+    assert stats_start({"2020-04": 9, "2020-05": 1}) == "2020-02-02'T'00:00:00Z"
+    assert stats_start({"2021-10": 1}) == "2021-03-07'T'00:00:00Z"
+    assert stats_start({"2020-05": 1}, margin=1) == "2020-01-26'T'00:00:00Z"
+    # days before the first Sunday of a year
+    assert stats_start({"2020-00": 1}) == "2020-01-01'T'00:00:00Z"
+    assert stats_start({}) == "2019-01-01'T'00:00:00Z"
+
+
+def test_incremental_stats(monkeypatch):
+    monkeypatch.setenv("ETELEMETRY_DB", "et-test-stats")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    mongo = MongoClientHelper()
+
+    async def run():
+        await mongo.client.drop_database("et-test-stats")
+        start = datetime.datetime(2020, 1, 12)
+        docs = [
+            {
+                "access_time": (start + datetime.timedelta(hours=5 * i)).strftime(
+                    timefmt
+                ),
+                "request": {"owner": "nipy", "repository": "nipype"},
+            }
+            for i in range(150)
+        ]
+        await mongo.requests.insert_many(docs)
+        full = await mongo.get_status("nipy", "nipype")
+        # refreshing from the last recorded week keeps earlier weeks whole
+        seeded = {week: count for week, count in full.items() if week <= "2020-05"}
+        assert await mongo.get_status("nipy", "nipype", seeded) == full
+        await mongo.client.drop_database("et-test-stats")
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        mongo.client.close()
+        loop.close()
@@ -0,0 +1,45 @@
+import datetime
+import json
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from ..archive import list_partitions, weekly_counts
+from ..database import gen_request_info
+from ..gendata import generate, generate_week, plan_weeks
+
+
+def test_plan_weeks():
+    # 2020-01-01 is a Wednesday, and weeks start on Sundays
+    start, end = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 15)
+    weeks = plan_weeks(1000, start, end)
+    assert [count for _, _, _, count in weeks] == [286, 500, 214]
+    assert weeks[0][1] == 1577836800
+
+
+def test_generate_week():
+    args = (3, 1577836800, 1577836800 + 7 * 86400, 5000, 100)
+    columns = generate_week(*args, seed=1)
+    again = generate_week(*args, seed=1)
+    assert all(np.array_equal(columns[key], again[key]) for key in columns)
+    other = generate_week(*args, seed=2)
+    assert not np.array_equal(columns["project"], other["project"])
+    assert np.all(np.diff(columns["access_time"]) >= 0)
+    # the most popular project is requested the most
+    assert np.bincount(columns["project"]).argmax() == 0
+    assert 0.2 < columns["is_ci"].mean() < 0.4
+
+
+def test_generate(tmp_path):
+    start, end = datetime.datetime(2020, 1, 1), datetime.datetime(2020, 1, 15)
+    counts = generate(1000, start, end, "jsonl", tmp_path / "jsonl", processes=1)
+    assert counts == {"requests": 1000, "geo": 100}
+    with open(tmp_path / "jsonl" / "requests-0000.jsonl") as fp:
+        doc = json.loads(fp.readline())
+    assert set(doc) == {"access_time", "remote_addr", "request"}
+    assert set(doc["request"]) == set(gen_request_info("owner", "repo", {}))
+
+    generate(1000, start, end, "archive", tmp_path / "archive", processes=1)
+    counts = weekly_counts(paths=list_partitions(tmp_path / "archive"), processes=1)
+    assert sum(sum(weeks.values()) for weeks in counts.values()) == 1000
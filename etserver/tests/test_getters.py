@@ -0,0 +1,57 @@
+import asyncio
+from types import SimpleNamespace
+
+from .. import getters
+from ..scheduler import WorkScheduler
+from ..tracing import Trace
+from ..upstream import close_upstreams, create_upstreams
+
+
+async def no_cache(owner, repo):
+    return None, "no cache"
+
+
+async def no_write(owner, repo, project_info, update=True):
+    pass
+
+
+async def github(app, url, params=None, content_type="application/json"):
+    await asyncio.sleep(0.01)
+    if "releases" in url:
+        return 200, {"tag_name": "v1.0"}
+    return 200, {"bad_versions": ["0.9"]}
+
+
+def test_cold_miss_trace(monkeypatch):
+    monkeypatch.setattr(getters, "query_project_cache", no_cache)
+    monkeypatch.setattr(getters, "write_project_cache", no_write)
+    monkeypatch.setattr(getters, "fetch_response", github)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def run():
+        app = SimpleNamespace(
+            inflight={},
+            shared=None,
+            scheduler=WorkScheduler(),
+            upstreams=create_upstreams({}),
+            config=SimpleNamespace(REQUEST_DEADLINE=None, REFRESH_LEASE_TIME=30),
+        )
+        traces = [Trace("GET /projects/a/b"), Trace("GET /projects/a/b")]
+        try:
+            # both lookups share a single query, and both see its stages
+            infos = await asyncio.gather(
+                *[getters.fetch_project(app, "a", "b", trace=t) for t in traces]
+            )
+        finally:
+            await close_upstreams(app.upstreams)
+        assert [info["version"] for info in infos] == ["1.0", "1.0"]
+        for trace in traces:
+            trace.end()
+            names = [item.split(";")[0] for item in trace.server_timing().split(", ")]
+            assert names == ["project", "cache", "github", "et-file", "total"]
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
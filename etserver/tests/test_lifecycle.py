@@ -0,0 +1,29 @@
+import asyncio
+
+from ..lifecycle import Lifecycle
+
+
+def test_drain():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    lifecycle = Lifecycle()
+    done = []
+
+    async def work(delay):
+        await asyncio.sleep(delay)
+        done.append(delay)
+
+    async def run():
+        lifecycle.spawn(work(0.01))
+        slow = lifecycle.spawn(work(10))
+        assert await lifecycle.drain(timeout=0.1) == 1
+        assert done == [0.01]
+        assert slow.cancelled()
+        # no new work is accepted once draining
+        assert lifecycle.spawn(work(0)) is None
+        assert not lifecycle.tasks
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
@@ -0,0 +1,91 @@
+import json
+import logging
+import time
+
+from ..logs import JSONFormatter, QueueLogging, RateLimitFilter, SamplingFilter
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.lines = []
+
+    def emit(self, record):
+        self.lines.append(self.format(record))
+
+
+def test_queue_logging():
+    handlers = {}
+    for name in ("et.test.a", "et.test.b"):
+        handlers[name] = ListHandler()
+        handlers[name].setFormatter(JSONFormatter())
+        log = logging.getLogger(name)
+        log.setLevel(logging.INFO)
+        log.propagate = False
+        log.addHandler(handlers[name])
+
+    logging_ = QueueLogging(
+        list(handlers), rate_limits={"et.test.b": dict(rate=0.001, burst=2)}
+    )
+    logging_.start()
+    logging.getLogger("et.test.a").info("hello %s", "world", extra={"status": 200})
+    for i in range(5):
+        logging.getLogger("et.test.b").info("line %d", i)
+    logging_.stop()
+
+    # records are written by the handlers of their own logger
+    (line,) = handlers["et.test.a"].lines
+    doc = json.loads(line)
+    assert doc["message"] == "hello world"
+    assert doc["status"] == 200
+    assert doc["logger"] == "et.test.a"
+    assert len(handlers["et.test.b"].lines) == 2
+    assert logging.getLogger("et.test.a").handlers == [handlers["et.test.a"]]
+
+
+class SlowHandler(ListHandler):
+    def emit(self, record):
+        time.sleep(0.05)
+        super().emit(record)
+
+
+def test_queue_logging_full():
+    handler = SlowHandler()
+    handler.setFormatter(JSONFormatter())
+    log = logging.getLogger("et.test.c")
+    log.setLevel(logging.INFO)
+    log.propagate = False
+    log.addHandler(handler)
+
+    logging_ = QueueLogging(["et.test.c"], queue_size=1)
+    logging_.start()
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        log.exception("failed %s", "call")
+    for i in range(5):
+        log.info("line %d", i)
+    assert logging_.dropped
+    # stopping waits for room in the full queue
+    logging_.stop()
+
+    # tracebacks are formatted by the writer thread
+    doc = json.loads(handler.lines[0])
+    assert doc["message"] == "failed call"
+    assert "ValueError: boom" in doc["exc_info"]
+    assert len(handler.lines) == 6 - logging_.dropped
+
+
+def test_filters():
+    record = logging.makeLogRecord({"msg": "x"})
+    assert all(SamplingFilter(1.0).filter(record) for _ in range(100))
+    assert not any(SamplingFilter(0.0).filter(record) for _ in range(100))
+    overloaded = SamplingFilter(1.0, 0.0, lambda: True)
+    assert not overloaded.filter(record)
+
+    limit = RateLimitFilter(rate=0.001, burst=1)
+    assert limit.filter(record)
+    assert not limit.filter(record)
+    limit.tokens = 1
+    assert limit.filter(record)
+    assert record.suppressed == 1
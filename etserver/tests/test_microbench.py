@@ -0,0 +1,27 @@
+import asyncio
+
+from ..microbench import compare, load_baseline, measure, save_baseline
+
+
+def test_measure():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    calls = []
+
+    async def func():
+        calls.append(1)
+
+    try:
+        per_call = loop.run_until_complete(measure(func, min_time=0.01, repeat=2))
+    finally:
+        loop.close()
+    assert 0 < per_call < 0.01
+    assert len(calls) > 2
+
+
+def test_compare(tmp_path):
+    save_baseline({"fast": 1e-6, "slow": 1e-3}, tmp_path / "micro.json")
+    baseline = load_baseline(tmp_path / "micro.json")
+    results = {"fast": 1.1e-6, "slow": 2e-3, "new": 1.0}
+    assert compare(results, baseline, threshold=0.2) == [("slow", 1e-3, 2e-3, 2.0)]
+    assert compare(results, baseline, threshold=1.5) == []
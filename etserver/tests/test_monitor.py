@@ -0,0 +1,40 @@
+import asyncio
+import logging
+import time
+
+from ..metrics import LOOP_DELAY
+from ..monitor import LoopMonitor
+
+
+def block_loop():
+    time.sleep(0.3)
+
+
+def test_loop_monitor(caplog):
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    monitor = LoopMonitor(loop, interval=0.02, threshold=0.1)
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        block_loop()
+        await asyncio.sleep(0.1)
+        assert monitor.lag > 0
+        # a probe sent just before stopping waits for the join in `stop`
+        time.sleep(0.05)
+        monitor.stop()
+
+    before = sum(sum(counts[:-1]) for counts in LOOP_DELAY.values.values())
+    try:
+        with caplog.at_level(logging.WARNING):
+            loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert monitor.blocked == 1
+    assert sum(sum(counts[:-1]) for counts in LOOP_DELAY.values.values()) > before
+    blocked = [r for r in caplog.records if "blocked for more than" in r.message]
+    assert len(blocked) == 1
+    # the stack points at the blocking function
+    assert "block_loop" in blocked[0].stack
+    assert any("was blocked for" in r.message for r in caplog.records)
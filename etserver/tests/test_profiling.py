@@ -0,0 +1,60 @@
+import asyncio
+import time
+
+from ..profiling import profile, trace_allocations
+
+
+def busy():
+    end = time.monotonic() + 0.2
+    while time.monotonic() < end:
+        pass
+
+
+def test_profile():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def run():
+        task = asyncio.ensure_future(profile(0.3, interval=0.01))
+        await asyncio.sleep(0.01)
+        # blocks the event loop while it is sampled
+        busy()
+        return await task
+
+    try:
+        profiler = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert sum(profiler.samples.values()) > 10
+    assert "busy (" in profiler.collapsed()
+    doc = profiler.speedscope("test")
+    frames = doc["shared"]["frames"]
+    samples = zip(doc["profiles"][0]["samples"], doc["profiles"][0]["weights"])
+    busy_time = sum(
+        weight
+        for stack, weight in samples
+        if any(frames[i]["name"] == "busy" for i in stack)
+    )
+    assert 0.1 < busy_time < 0.3
+
+
+def test_trace_allocations():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    kept = []
+
+    async def allocate():
+        await asyncio.sleep(0.01)
+        kept.append(bytearray(1024 * 1024))
+
+    async def run():
+        task = asyncio.ensure_future(trace_allocations(0.1, limit=5))
+        await allocate()
+        return await task
+
+    try:
+        top = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert top[0]["size"] >= 1024 * 1024
+    assert any("test_profiling.py" in line for line in top[0]["traceback"])
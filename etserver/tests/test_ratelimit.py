@@ -0,0 +1,29 @@
+from ..ratelimit import TokenBuckets
+
+
+def test_token_buckets(tmp_path):
+    buckets = TokenBuckets(tmp_path / "buckets", nslots=16)
+    for _ in range(3):
+        assert buckets.take("1.2.3.4", rate=1, burst=3) == 0
+    wait = buckets.take("1.2.3.4", rate=1, burst=3)
+    assert 0 < wait <= 1
+    # other keys have their own bucket
+    assert buckets.take("5.6.7.8", rate=1, burst=3, cost=3) == 0
+
+    # workers share buckets through the backing file
+    other = TokenBuckets(tmp_path / "buckets", nslots=16)
+    assert other.take("5.6.7.8", rate=1, burst=3) > 0
+    other.close()
+
+    # the number of tracked keys is bounded
+    for i in range(100):
+        buckets.take(str(i), rate=1, burst=3)
+    assert buckets.take("99", rate=1, burst=3) == 0
+    buckets.close()
+
+
+def test_private_buckets():
+    buckets = TokenBuckets(nslots=4)
+    assert buckets.take("a", rate=10, burst=1) == 0
+    assert buckets.take("a", rate=10, burst=1) > 0
+    buckets.close()
@@ -0,0 +1,86 @@
+import asyncio
+import json
+
+from aiohttp import web
+
+from ..benchmark import free_port
+from ..replay import parse_record, read_logs, replay
+
+
+def access_record(time, request, host="1.2.3.4:5678"):
+    return json.dumps(
+        {
+            "time": time,
+            "level": "INFO",
+            "logger": "sanic.access",
+            "message": "",
+            "host": host,
+            "request": request,
+            "status": 200,
+            "byte": 10,
+        }
+    )
+
+
+def test_parse_record():
+    record = parse_record(
+        access_record("2020-03-02T10:12:00+0000", "GET http://x/projects/a/b?c=1")
+    )
+    assert record == (1583143920.0, "GET", "/projects/a/b?c=1", "1.2.3.4")
+    text = (
+        "[2020-03-02 10:12:00 +0000] - (sanic.access)[INFO][UNKNOWN]: "
+        "GET http://x/stats/a/b  200 42"
+    )
+    assert parse_record(text) == (1583143920.0, "GET", "/stats/a/b", None)
+    assert parse_record("[2020-03-02 10:12:00 +0000] [1] [INFO] Goin' Fast") is None
+
+
+def test_read_logs(tmp_path):
+    lines = [
+        access_record("2020-03-02T10:12:01+0000", "GET http://x/projects/a/c"),
+        access_record("2020-03-02T10:12:00+0000", "GET http://x/projects/a/b"),
+        access_record("2020-03-02T10:12:00+0000", "GET http://x/stats/a/b"),
+        access_record("2020-03-02T10:12:00+0000", "POST http://x/projects"),
+    ]
+    (tmp_path / "access.log").write_text("\n".join(lines) + "\n")
+    records, skipped = read_logs([tmp_path / "access.log"])
+    assert skipped == 1
+    # records of the same second are spread over it
+    assert [(t - records[0][0], p) for t, _, p, _ in records] == [
+        (0, "/projects/a/b"),
+        (0.5, "/stats/a/b"),
+        (1, "/projects/a/c"),
+    ]
+
+
+def test_replay():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    forwarded = []
+
+    async def handler(request):
+        forwarded.append(request.headers.get("X-Forwarded-For"))
+        return web.json_response({})
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/{tail:.*}", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        port = free_port()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        records = [(i * 0.5, "GET", f"/projects/a/{i}", "1.2.3.4") for i in range(5)]
+        try:
+            return await replay(f"http://127.0.0.1:{port}", records, speedup=10)
+        finally:
+            await runner.cleanup()
+
+    try:
+        results = loop.run_until_complete(run())
+    finally:
+        loop.close()
+    assert results["GET /projects/<project>"]["requests"] == 5
+    assert results["total"]["errors"] == 0
+    assert forwarded == ["1.2.3.4"] * 5
+    # two seconds of requests were compressed to a fifth of a second
+    assert results["total"]["rps"] > 10
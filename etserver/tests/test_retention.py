@@ -0,0 +1,46 @@
+import asyncio
+import datetime
+
+from ..database import MongoClientHelper
+from ..retention import apply_retention
+from ..utils import timefmt
+
+
+def test_retention_keeps_stats(monkeypatch):
+    monkeypatch.setenv("ETELEMETRY_DB", "et-test-retention")
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    mongo = MongoClientHelper()
+
+    async def run():
+        await mongo.client.drop_database("et-test-retention")
+        start = datetime.datetime(2019, 12, 20)
+        docs = []
+        for i in range(200):
+            access_time = start + datetime.timedelta(hours=7 * i)
+            docs.append(
+                {
+                    "access_time": access_time.strftime(timefmt),
+                    "request": {"owner": "nipy", "repository": "nipype"},
+                }
+            )
+        await mongo.requests.insert_many(docs)
+        before = await mongo.get_status("nipy", "nipype")
+        deleted = await apply_retention(
+            mongo, days=30, batch_size=7, pause=0, now=datetime.datetime(2020, 2, 15)
+        )
+        remaining = await mongo.requests.count_documents({})
+        assert deleted > 0
+        assert deleted + remaining == len(docs)
+        assert await mongo.get_status("nipy", "nipype") == before
+        # nothing left to do on a second run
+        assert await apply_retention(
+            mongo, days=30, pause=0, now=datetime.datetime(2020, 2, 15)
+        ) == 0
+        await mongo.client.drop_database("et-test-retention")
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        mongo.client.close()
+        loop.close()
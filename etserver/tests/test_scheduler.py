@@ -0,0 +1,37 @@
+import asyncio
+
+from ..scheduler import WorkScheduler
+
+
+def test_work_scheduler():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    scheduler = WorkScheduler(concurrency=2, lanes=dict(projects=2, batch=1))
+    order = []
+
+    async def work(lane, release):
+        async with scheduler.slot(lane):
+            order.append(lane)
+            await release.wait()
+
+    async def run():
+        release = asyncio.Event()
+        first = asyncio.ensure_future(work("batch", release))
+        await asyncio.sleep(0)
+        # batch work is held to its share
+        batch = asyncio.ensure_future(work("batch", asyncio.Event()))
+        projects = asyncio.ensure_future(work("projects", release))
+        await asyncio.sleep(0)
+        assert order == ["batch", "projects"]
+        assert scheduler.stats()["batch"]["queued"] == 1
+        release.set()
+        await asyncio.gather(first, projects)
+        assert order == ["batch", "projects", "batch"]
+        batch.cancel()
+        await asyncio.sleep(0)
+        assert scheduler.running == 0
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
@@ -1,4 +1,6 @@
-from ..serve import app
+from types import SimpleNamespace
+
+from ..serve import app, client_ip
 
 
 def test_server_info():
@@ -25,3 +27,97 @@ def test_tagged_version():
     request, response = app.test_client.get("/projects/mgxd/taggedrepo")
     assert response.status == 200
     assert response.json.get("version") == "0.1"
+
+
+def test_batch_projects():
+    request, response = app.test_client.post(
+        "/projects", json=["mgxd/taggedrepo", "mgxd/mytestrepo"]
+    )
+    assert response.status == 200
+    assert response.json["mgxd/taggedrepo"].get("version") == "0.1"
+    assert response.json["mgxd/mytestrepo"].get("version") == "Unknown"
+
+
+def test_bad_batch_projects():
+    request, response = app.test_client.post("/projects", json=["nipy"])
+    assert response.status == 400
+    request, response = app.test_client.post("/projects", json={})
+    assert response.status == 400
+
+
+def test_batch_stats():
+    app.test_client.get("/projects/mgxd/taggedrepo")
+    request, response = app.test_client.post(
+        "/stats", json=["mgxd/taggedrepo", "mgxd/unknownrepo"]
+    )
+    assert response.status == 200
+    assert response.json["mgxd/unknownrepo"] is None
+    assert sum(response.json["mgxd/taggedrepo"].values()) > 0
+    request, response = app.test_client.post(
+        "/stats?format=csv", json=["mgxd/taggedrepo"]
+    )
+    assert response.status == 200
+    assert response.text.startswith("project,year-week,count\nmgxd/taggedrepo,")
+
+
+def test_upstreams_info():
+    request, response = app.test_client.get("/upstreams")
+    assert response.status == 200
+    assert set(response.json) == {"github", "raw", "geo"}
+    for stats in response.json.values():
+        assert stats["active"] == 0
+
+
+def test_metrics():
+    app.test_client.get("/")
+    request, response = app.test_client.get("/metrics")
+    assert response.status == 200
+    assert 'et_request_duration_seconds_count{route="/",method="GET"' in response.text
+    assert "# TYPE et_project_cache_total counter" in response.text
+
+
+def test_admin_profile():
+    request, response = app.test_client.get("/admin/profile")
+    assert response.status == 404
+    app.config.ADMIN_TOKEN = "secret"
+    try:
+        request, response = app.test_client.get("/admin/profile")
+        assert response.status == 401
+        request, response = app.test_client.get(
+            "/admin/profile?seconds=0.1&format=speedscope",
+            headers={"Authorization": "Bearer secret"},
+        )
+        assert response.status == 200
+        assert response.json["profiles"][0]["type"] == "sampled"
+    finally:
+        app.config.ADMIN_TOKEN = None
+
+
+def test_ready():
+    async def warmed_up(app, loop):
+        if app.warming is not None:
+            await app.warming
+
+    # registered before the listener sending the request
+    app.register_listener(warmed_up, "after_server_start")
+    try:
+        request, response = app.test_client.get("/ready")
+    finally:
+        app.listeners["after_server_start"].remove(warmed_up)
+    assert response.status == 200
+    assert response.json == {"ready": True}
+
+
+def test_client_ip():
+    request = SimpleNamespace(
+        headers={"X-Forwarded-For": "6.6.6.6, 1.2.3.4"}, ip="10.0.0.1"
+    )
+    # forwarded addresses are only read behind trusted proxies
+    assert client_ip(request) == "10.0.0.1"
+    app.config.TRUSTED_PROXIES = 1
+    try:
+        assert client_ip(request) == "1.2.3.4"
+        app.config.TRUSTED_PROXIES = 3
+        assert client_ip(request) == "10.0.0.1"
+    finally:
+        app.config.TRUSTED_PROXIES = 0
@@ -0,0 +1,60 @@
+import multiprocessing as mp
+
+from ..shared import SharedCache
+
+
+def test_shared_cache(tmp_path):
+    cache = SharedCache(tmp_path / "shared.cache", nslots=16, slot_size=256)
+    assert cache.get("nipy/nipype") is None
+    assert cache.put("nipy/nipype", {"version": "1.4.2"})
+    assert cache.get("nipy/nipype") == {"version": "1.4.2"}
+    # entries which do not fit are not cached
+    assert not cache.put("nipy/pydra", {"notes": "x" * 512})
+    assert cache.get("nipy/pydra") is None
+
+    # other processes see the same entries
+    other = SharedCache(tmp_path / "shared.cache", nslots=16, slot_size=256)
+    assert other.get("nipy/nipype") == {"version": "1.4.2"}
+    other.put("nipy/nipype", {"version": "1.5.0"})
+    assert cache.get("nipy/nipype") == {"version": "1.5.0"}
+
+    # more keys than slots evicts the oldest entries
+    for i in range(32):
+        cache.put(f"nipy/repo{i}", {"version": str(i)})
+    assert cache.get("nipy/repo31") == {"version": "31"}
+
+
+def _acquire(path, queue):
+    cache = SharedCache(path, nslots=16, slot_size=256)
+    queue.put(cache.acquire_lease("nipy/nipype", 30))
+
+
+def test_refresh_lease(tmp_path):
+    path = tmp_path / "shared.cache"
+    cache = SharedCache(path, nslots=16, slot_size=256)
+    assert cache.acquire_lease("nipy/nipype", 30)
+
+    queue = mp.Queue()
+    proc = mp.Process(target=_acquire, args=(path, queue))
+    proc.start()
+    proc.join()
+    assert queue.get() is False
+
+    cache.release_lease("nipy/nipype")
+    proc = mp.Process(target=_acquire, args=(path, queue))
+    proc.start()
+    proc.join()
+    assert queue.get() is True
+    # the lease of the other process is seen until it expires
+    assert cache.lease_active("nipy/nipype")
+    assert not cache.lease_active("nipy/pydra")
+
+
+def test_lease_keeps_entries(tmp_path):
+    cache = SharedCache(tmp_path / "shared.cache", nslots=4, slot_size=256)
+    for i in range(4):
+        assert cache.put(f"nipy/repo{i}", {"version": str(i)})
+    # with no free slot, leases are granted without evicting entries
+    assert cache.acquire_lease("nipy/nipype", 30)
+    for i in range(4):
+        assert cache.get(f"nipy/repo{i}") == {"version": str(i)}
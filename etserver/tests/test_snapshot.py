@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from ..snapshot import SnapshotError, export_snapshot, import_snapshot
+
+
+def write(path, doc):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(doc))
+
+
+def test_snapshot(tmp_path):
+    source, target = tmp_path / "source", tmp_path / "target"
+    nipype = {"version": "1.4.2", "last_update": "2020-03-02'T'10:00:00Z"}
+    write(source / "nipy--nipype.json", nipype)
+    pydra = {"version": "0.5", "last_update": "2020-03-01'T'10:00:00Z"}
+    write(source / "nipy--pydra.json", pydra)
+    stats = {"stats": {"2020-09": 12}, "stats_update": "2020-03-02'T'10:00:00Z"}
+    write(source / "stats" / "nipy--nipype.json", stats)
+    snapshot = tmp_path / "etcache.snapshot"
+    assert export_snapshot(snapshot, source) == {"projects": 2, "stats": 1}
+
+    # newer entries of the target are kept
+    pydra = {"version": "0.6", "last_update": "2020-03-05'T'10:00:00Z"}
+    write(target / "nipy--pydra.json", pydra)
+    assert import_snapshot(snapshot, target) == {"projects": 1, "stats": 1}
+    assert json.loads((target / "nipy--nipype.json").read_text()) == nipype
+    assert json.loads((target / "nipy--pydra.json").read_text()) == pydra
+    assert json.loads((target / "stats" / "nipy--nipype.json").read_text()) == stats
+    assert import_snapshot(snapshot, target, force=True)["projects"] == 2
+
+    data = bytearray(snapshot.read_bytes())
+    data[-10] ^= 1
+    snapshot.write_bytes(bytes(data))
+    with pytest.raises(SnapshotError):
+        import_snapshot(snapshot, target)
@@ -0,0 +1,42 @@
+import json
+import logging
+
+from ..tracing import Trace, span, trace_logger
+
+
+class ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def test_trace():
+    trace = Trace("GET /projects/a/b", sampled=True)
+    with span(trace, "cache"):
+        pass
+    with span(trace, "github", project="a/b"):
+        pass
+    with span(None, "ignored"):
+        pass
+    trace.end()
+
+    names = [item.split(";")[0] for item in trace.server_timing().split(", ")]
+    assert names == ["cache", "github", "total"]
+
+    handler = ListHandler()
+    trace_logger.addHandler(handler)
+    trace_logger.setLevel(logging.INFO)
+    try:
+        trace.export()
+    finally:
+        trace_logger.removeHandler(handler)
+    (record,) = handler.records
+    doc = json.loads(record.getMessage())
+    spans = doc["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert [s["name"] for s in spans] == ["GET /projects/a/b", "cache", "github"]
+    assert all(s["traceId"] == trace.trace_id for s in spans)
+    assert spans[2]["parentSpanId"] == spans[0]["spanId"]
+    assert spans[2]["attributes"][0]["value"] == {"stringValue": "a/b"}
@@ -0,0 +1,94 @@
+import asyncio
+
+from ..upstream import AdaptiveLimiter, CircuitBreaker, Upstream
+
+
+def test_adaptive_limiter():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    limiter = AdaptiveLimiter(initial=2, minimum=1, maximum=4, latency_target=0.5)
+
+    async def run():
+        await limiter.acquire()
+        await limiter.acquire()
+        # the third call waits for a slot
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+        limiter.release(0.1)
+        await waiter
+        assert limiter.inflight == 2
+        assert limiter.limit > 2
+        limiter.release(0.1)
+        limiter.release(0.1)
+
+        # fast calls grow the limit up to its maximum
+        for _ in range(100):
+            await limiter.acquire()
+            limiter.release(0.1)
+        assert limiter.limit == 4
+
+        # a failure halves it
+        await limiter.acquire()
+        limiter.release(0.1, failed=True)
+        assert limiter.limit == 2
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.is_open
+    assert not breaker.allow()
+    assert 0 < breaker.retry_after <= 60
+
+    # half-open: a single probe is let through
+    breaker.reset_timeout = 0
+    assert not breaker.is_open
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow()
+
+
+def test_cancelled_probe():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    async def run():
+        upstream = Upstream(
+            "github",
+            concurrency={"initial": 1},
+            breaker={"failure_threshold": 1, "reset_timeout": 0},
+        )
+        try:
+            upstream.breaker.record(False)
+            # the probe queues behind a call holding the only slot
+            await upstream.limiter.acquire()
+            probe = asyncio.ensure_future(upstream.fetch("http://localhost/"))
+            await asyncio.sleep(0)
+            assert upstream.breaker.state == "half-open"
+            assert upstream.breaker.is_open
+            probe.cancel()
+            await asyncio.gather(probe, return_exceptions=True)
+            # the next call probes the upstream in its place
+            assert not upstream.breaker.is_open
+            assert upstream.breaker.allow()
+        finally:
+            await upstream.close()
+
+    try:
+        loop.run_until_complete(run())
+    finally:
+        loop.close()
@@ -0,0 +1,50 @@
+import asyncio
+import json
+import os
+
+from ..shared import SharedCache
+from ..warmup import popular_projects, recent_projects, warm_cache
+
+
+def cache_projects(cachedir):
+    (cachedir / "stats").mkdir()
+    for i, name in enumerate(("nipy--nipype", "nipy--pydra", "mgxd--etelemetry")):
+        path = cachedir / f"{name}.json"
+        path.write_text(json.dumps({"version": f"1.{i}", "status": 200}))
+        os.utime(path, (1000 + i, 1000 + i))
+    stats = {
+        "nipy--nipype": {"2020-01": 50, "2020-02": 5},
+        "nipy--pydra": {"2020-02": 10},
+    }
+    for name, weeks in stats.items():
+        (cachedir / "stats" / f"{name}.json").write_text(json.dumps({"stats": weeks}))
+    # not a project
+    (cachedir / "shared.cache").write_bytes(b"")
+
+
+def test_select_projects(tmp_path):
+    cache_projects(tmp_path)
+    assert recent_projects(tmp_path, limit=2) == ["mgxd/etelemetry", "nipy/pydra"]
+    assert popular_projects(tmp_path, limit=2, weeks=1) == ["nipy/pydra", "nipy/nipype"]
+    assert popular_projects(tmp_path, limit=1) == ["nipy/nipype"]
+
+
+def test_warm_cache(tmp_path):
+    cache_projects(tmp_path)
+    shared = SharedCache(tmp_path / "shared.cache", nslots=16, slot_size=256)
+    shared.put("nipy/pydra", {"version": "2.0"})
+    # projects still holding statistics are left to their first lookup
+    legacy = {"version": "1.2", "status": 200, "stats": {"2020-01": 1}}
+    (tmp_path / "mgxd--etelemetry.json").write_text(json.dumps(legacy))
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        loaded = loop.run_until_complete(warm_cache(shared, cachedir=tmp_path))
+    finally:
+        loop.close()
+    assert loaded == 1
+    assert shared.get("nipy/nipype") == {"version": "1.0", "status": 200}
+    # entries already shared are kept
+    assert shared.get("nipy/pydra") == {"version": "2.0"}
+    assert shared.get("mgxd/etelemetry") is None
+    shared.close()
@@ -0,0 +1,156 @@
+"""Timing of the stages of requests
+
+Each request records spans around its stages, which are summed up in a
+`Server-Timing` response header. A sample of the traces is written in the
+OTLP JSON format, one `ExportTraceServiceRequest` per line, through the
+`etserver.traces` logger.
+"""
+import json
+import logging
+import os
+import random
+import time
+
+from . import __version__
+
+trace_logger = logging.getLogger("etserver.traces")
+
+
+class Trace:
+    """
+    Spans of a request, all children of a root span
+
+    :param name: name of the root span
+    :param sampled: whether the trace is exported
+    """
+
+    def __init__(self, name, sampled=False):
+        self.trace_id = os.urandom(16).hex()
+        self.sampled = sampled
+        self.root = Span(self, name)
+        self.spans = []
+
+    def span(self, name, **attributes):
+        """Return a context manager timing a stage of the request"""
+        return Span(self, name, attributes)
+
+    def end(self):
+        self.root.end = _now()
+
+    def merge(self, other):
+        """Add copies of the finished spans of another trace, of shared work"""
+        for span in other.spans:
+            if span.end is not None:
+                copy = Span(self, span.name, span.attributes)
+                copy.start, copy.end = span.start, span.end
+                self.spans.append(copy)
+
+    def server_timing(self):
+        """Format the durations of stages as a `Server-Timing` header"""
+        durations = {}
+        for span in self.spans:
+            if span.end is not None:
+                durations[span.name] = durations.get(span.name, 0) + span.duration
+        durations["total"] = self.root.duration
+        return ", ".join(
+            f"{name};dur={dur / 1e6:.2f}" for name, dur in durations.items()
+        )
+
+    def export(self):
+        """Write the trace if it is sampled"""
+        if not self.sampled:
+            return
+        spans = [self.root.to_otlp()]
+        spans.extend(
+            span.to_otlp(self.root.span_id) for span in self.spans if span.end
+        )
+        doc = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            _attribute("service.name", "etelemetry-server"),
+                            _attribute("service.version", __version__),
+                            _attribute("process.pid", os.getpid()),
+                        ]
+                    },
+                    "scopeSpans": [{"scope": {"name": "etserver"}, "spans": spans}],
+                }
+            ]
+        }
+        trace_logger.info(json.dumps(doc))
+
+
+class Span:
+    """Timed stage of a request"""
+
+    def __init__(self, trace, name, attributes=None):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes or {}
+        self.span_id = os.urandom(8).hex()
+        self.start = _now()
+        self.end = None
+
+    @property
+    def duration(self):
+        return (self.end or _now()) - self.start
+
+    def __enter__(self):
+        self.start = _now()
+        self.trace.spans.append(self)
+        return self
+
+    def __exit__(self, *args):
+        self.end = _now()
+
+    def to_otlp(self, parent=None):
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            # server for the root span, internal otherwise
+            "kind": 1 if parent else 2,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [_attribute(k, v) for k, v in self.attributes.items()],
+        }
+        if parent:
+            span["parentSpanId"] = parent
+        return span
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NO_SPAN = _NoSpan()
+
+
+def start_trace(name, sampling=0.0):
+    """Start the trace of a request, sampled with a probability"""
+    return Trace(name, sampled=random.random() < sampling)
+
+
+def span(trace, name, **attributes):
+    """Time a stage of a request, if it is traced"""
+    if trace is None:
+        return NO_SPAN
+    return trace.span(name, **attributes)
+
+
+def _now():
+    """Return the current time in nanoseconds since the epoch"""
+    return int(time.time() * 1e9)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
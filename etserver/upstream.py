@@ -0,0 +1,338 @@
+"""Connection pools, concurrency limits and circuit breakers of upstreams"""
+import asyncio
+import time
+from collections import deque
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from . import GITHUB_RELEASE_URL, GITHUB_TAG_URL, GITHUB_ET_FILE, IPSTACK_URL
+from .metrics import UPSTREAM_WAIT
+
+# URLs served by each upstream
+UPSTREAM_URLS = {
+    "github": (GITHUB_RELEASE_URL, GITHUB_TAG_URL),
+    "raw": (GITHUB_ET_FILE,),
+    "geo": (IPSTACK_URL,),
+}
+UPSTREAM_HOSTS = {
+    urlsplit(url).netloc: name for name, urls in UPSTREAM_URLS.items() for url in urls
+}
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when calls to an upstream are cut off by its circuit breaker"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"{name} is unavailable")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Stop calling an upstream after repeated failures
+
+    The breaker opens after `failure_threshold` consecutive failures. Once
+    `reset_timeout` seconds have passed, up to `half_open_calls` probes are
+    let through: a success closes the breaker, a failure opens it again.
+    Probes cancelled before their outcome is known give back their slot.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, half_open_calls=1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def is_open(self):
+        """Whether calls are currently refused"""
+        if self.state == "open":
+            return self.retry_after > 0
+        return self.state == "half-open" and self._probes >= self.half_open_calls
+
+    @property
+    def retry_after(self):
+        """Seconds until the breaker lets a probe through"""
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self):
+        """Check whether a call may proceed, counting half-open probes"""
+        if self.state == "open" and self.retry_after <= 0:
+            self.state = "half-open"
+            self._probes = 0
+        if self.state == "closed":
+            return True
+        if self.state == "half-open" and self._probes < self.half_open_calls:
+            self._probes += 1
+            return True
+        return False
+
+    def record(self, success):
+        """Record the outcome of an allowed call"""
+        if success:
+            self.state = "closed"
+            self.failures = 0
+            return
+        self.failures += 1
+        if self.state == "half-open" or self.failures >= self.failure_threshold:
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """Give back the slot of an allowed call which ended without outcome"""
+        if self.state == "half-open" and self._probes > 0:
+            self._probes -= 1
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit adapted to the observed latency of an upstream
+
+    The limit grows additively while calls complete within the latency
+    target, and is cut multiplicatively, at most once per target interval,
+    when calls fail or are slower (AIMD).
+
+    Parameters
+    ----------
+    initial, minimum, maximum : int
+        starting value and bounds of the concurrency limit
+    latency_target : float
+        seconds above which a call counts as congested
+    backoff : float
+        factor applied to the limit on congestion
+    """
+
+    def __init__(
+        self, initial=20, minimum=1, maximum=100, latency_target=1.0, backoff=0.5
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.latency_target = latency_target
+        self.backoff = backoff
+        self.inflight = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self._waiters = deque()
+        self._last_decrease = 0.0
+
+    @property
+    def queued(self):
+        """Number of calls waiting to be admitted"""
+        return len(self._waiters)
+
+    async def acquire(self):
+        """Wait until a call is admitted under the current limit"""
+        if not self._waiters and self.inflight < int(self.limit):
+            self.inflight += 1
+            return
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        waiter = loop.create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # admitted while being cancelled, pass the slot on
+                self.inflight -= 1
+                self._wake()
+            raise
+        finally:
+            self.waits += 1
+            self.wait_time += loop.time() - start
+
+    def release(self, latency, failed=False):
+        """
+        Complete an admitted call and adapt the limit
+
+        :param latency: seconds taken by the call
+        :param failed: whether the upstream failed to answer properly
+        """
+        self.inflight -= 1
+        now = asyncio.get_event_loop().time()
+        if failed or latency > self.latency_target:
+            if now - self._last_decrease > self.latency_target:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self.inflight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.inflight += 1
+                waiter.set_result(None)
+
+
+class Upstream:
+    """
+    HTTP client of a single upstream service with its own connection pool
+
+    Parameters
+    ----------
+    name : str
+        upstream identifier
+    limit : int
+        maximum number of open connections
+    limit_per_host : int
+        maximum number of open connections to a single host
+    dns_ttl : int
+        seconds to cache DNS lookups
+    keepalive_timeout : float
+        seconds to keep idle connections open
+    connect_timeout, read_timeout : float
+        seconds to wait for a connection, and between reads of a response
+    total_timeout : float
+        seconds a whole call may take, including waiting for a connection
+    concurrency : dict
+        `AdaptiveLimiter` keyword arguments
+    breaker : dict
+        `CircuitBreaker` keyword arguments
+    """
+
+    def __init__(
+        self,
+        name,
+        limit=100,
+        limit_per_host=0,
+        dns_ttl=300,
+        keepalive_timeout=30,
+        connect_timeout=3,
+        read_timeout=10,
+        total_timeout=15,
+        concurrency=None,
+        breaker=None,
+    ):
+        self.name = name
+        self.limit = limit
+        self.total_timeout = total_timeout
+        self.limiter = AdaptiveLimiter(**(concurrency or {}))
+        self.breaker = CircuitBreaker(**(breaker or {}))
+        self.active = 0
+        self.waiting = 0
+        self.waits = 0
+        self.wait_time = 0.0
+
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_queued_start.append(self._on_queued_start)
+        trace.on_connection_queued_end.append(self._on_queued_end)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=limit,
+                limit_per_host=limit_per_host,
+                ttl_dns_cache=dns_ttl,
+                keepalive_timeout=keepalive_timeout,
+            ),
+            timeout=aiohttp.ClientTimeout(
+                total=total_timeout,
+                sock_connect=connect_timeout,
+                sock_read=read_timeout,
+            ),
+            trace_configs=[trace],
+        )
+
+    async def fetch(self, url, params=None, content_type="application/json"):
+        """
+        GET a JSON (or text) response
+
+        :return: status code and decoded body
+        :raises UpstreamUnavailable: if the circuit breaker is open
+        """
+        if not self.breaker.allow():
+            raise UpstreamUnavailable(self.name, self.breaker.retry_after)
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        try:
+            # queueing for a slot counts against the call timeout too
+            await asyncio.wait_for(self.limiter.acquire(), self.total_timeout)
+        except asyncio.TimeoutError:
+            self.breaker.record(False)
+            raise
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        finally:
+            UPSTREAM_WAIT.observe(loop.time() - start, self.name)
+        start = loop.time()
+        failed = True
+        self.active += 1
+        try:
+            async with self.session.get(url, params=params) as response:
+                try:
+                    resp = await response.json(content_type=content_type)
+                except ValueError:
+                    resp = await response.text()
+                failed = response.status >= 500 or response.status == 429
+                return response.status, resp
+        except asyncio.CancelledError:
+            # the caller went away, which says nothing about the upstream
+            failed = None
+            raise
+        finally:
+            self.active -= 1
+            self.limiter.release(loop.time() - start, bool(failed))
+            if failed is None:
+                self.breaker.release()
+            else:
+                self.breaker.record(not failed)
+
+    def stats(self):
+        """Return pool utilisation and connection wait times"""
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "waits": self.waits,
+            "wait_time": round(self.wait_time, 6),
+            "concurrency": int(self.limiter.limit),
+            "inflight": self.limiter.inflight,
+            "queued": self.limiter.queued,
+            "queue_waits": self.limiter.waits,
+            "queue_wait_time": round(self.limiter.wait_time, 6),
+            "breaker": self.breaker.state,
+        }
+
+    async def close(self):
+        await self.session.close()
+
+    async def _on_queued_start(self, session, ctx, params):
+        self.waiting += 1
+        ctx.queued = asyncio.get_event_loop().time()
+
+    async def _on_queued_end(self, session, ctx, params):
+        self.waiting -= 1
+        self.waits += 1
+        self.wait_time += asyncio.get_event_loop().time() - ctx.queued
+
+
+def create_upstreams(config):
+    """
+    Create the upstreams of all services
+
+    :param config: mapping of upstream names to `Upstream` keyword arguments
+    :return: mapping of upstream names to upstreams
+    """
+    return {name: Upstream(name, **config.get(name, {})) for name in UPSTREAM_URLS}
+
+
+def get_upstream(upstreams, url):
+    """Return the upstream serving a URL"""
+    return upstreams[UPSTREAM_HOSTS[urlsplit(url).netloc]]
+
+
+async def close_upstreams(upstreams):
+    for upstream in upstreams.values():
+        await upstream.close()
+
+
+def is_available(upstreams, url):
+    """Check whether calls to the upstream serving a URL are let through"""
+    return not get_upstream(upstreams, url).breaker.is_open
@@ -1,11 +1,17 @@
 """Utility functions"""
+import asyncio
 import datetime
 import json
+import os
+import tempfile
+import time
 import aiofiles
 
 from . import CACHEDIR, logger
 
 timefmt = "%Y-%m-%d'T'%H:%M:%SZ"
+STATSDIR = CACHEDIR / "stats"
+STATSDIR.mkdir(exist_ok=True)
 
 
 async def get_current_time():
@@ -29,6 +35,16 @@ async def utc_timediff(t1, t2):
     return abs(timedelt.total_seconds())
 
 
+def week_start(date):
+    """
+    Return midnight of the Sunday starting the week of a UTC datetime
+
+    Weeks start on Sundays, as with the `$week` operator of mongo.
+    """
+    day = datetime.datetime(date.year, date.month, date.day)
+    return day - datetime.timedelta(days=(day.weekday() + 1) % 7)
+
+
 async def query_project_cache(owner, repo, stale_time=21600):
     """
     Search for project cache - if found and valid, return it.
@@ -43,14 +59,26 @@ async def query_project_cache(owner, repo, stale_time=21600):
     async with aiofiles.open(str(cache)) as fp:
         project_info = json.loads(await fp.read())
 
+    state = await cache_state(project_info, stale_time)
+    if state == "cached":
+        logger.info(f"Reusing {owner}/{repo} cached version.")
+    return project_info, state
+
+
+async def cache_state(project_info, stale_time=21600):
+    """
+    Check whether cached project information is still valid
+
+    :param stale_time: limit until cached results are stale (secs)
+    :return: "cached" or "stale"
+    """
     lastmod = project_info.get("last_update")
     if (
         lastmod is None
         or await utc_timediff(lastmod, await get_current_time()) > stale_time
     ):
-        return project_info, "stale"
-    logger.info(f"Reusing {owner}/{repo} cached version.")
-    return project_info, "cached"
+        return "stale"
+    return "cached"
 
 
 async def write_project_cache(owner, repo, project_info, update=True):
@@ -62,3 +90,88 @@ async def write_project_cache(owner, repo, project_info, update=True):
         project_info["last_update"] = await get_current_time()
     async with aiofiles.open(str(cache), "w") as fp:
         await fp.write(json.dumps(project_info))
+
+
+async def query_stats_cache(owner, repo):
+    """
+    Search for persisted project statistics
+
+    :return: dict with `stats` and `stats_update` fields, or None if missing
+    """
+    cache = STATSDIR / "{}--{}.json".format(owner, repo)
+    if not cache.exists():
+        return None
+    async with aiofiles.open(str(cache)) as fp:
+        return json.loads(await fp.read())
+
+
+async def write_stats_cache(owner, repo, stats_info):
+    """
+    Write project statistics to their own cached file
+    """
+    cache = STATSDIR / "{}--{}.json".format(owner, repo)
+    # workers may write the same project at once, each through its own file
+    fd, tmp = tempfile.mkstemp(".tmp", cache.stem + ".", str(STATSDIR))
+    os.close(fd)
+    async with aiofiles.open(tmp, "w") as fp:
+        await fp.write(json.dumps(stats_info))
+    os.replace(tmp, str(cache))
+
+
+async def coalesce(pending, key, func, timeout=None):
+    """
+    Share a single in-flight call of `func` between concurrent callers
+
+    :param pending: mapping of keys to in-flight tasks
+    :param key: identifier of the call
+    :param func: coroutine function without arguments
+    :param timeout: seconds to wait for the result, the call itself goes on
+        in the background if it takes longer
+    :raises asyncio.TimeoutError: if the timeout expired
+    """
+    task = pending.get(key)
+    if task is None:
+        task = asyncio.ensure_future(func())
+        pending[key] = task
+        task.add_done_callback(lambda _: pending.pop(key, None))
+    # shield the shared call from cancellation of a single caller
+    if timeout is None:
+        return await asyncio.shield(task)
+    return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+
+def spawn(app, coro, lane=None):
+    """
+    Run a coroutine in the background, until the server shuts down
+
+    :param lane: scheduler lane to run the coroutine in, if any
+    """
+    if lane is not None:
+        coro = _run_in_lane(app, lane, coro)
+    return app.lifecycle.spawn(coro)
+
+
+async def _run_in_lane(app, lane, coro):
+    async with app.scheduler.slot(lane):
+        return await coro
+
+
+class Deadline:
+    """
+    Time budget of a request
+
+    :param seconds: budget from now on, None for no limit
+    """
+
+    def __init__(self, seconds=None):
+        self.expires = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        """Return the seconds left, None if there is no limit"""
+        if self.expires is None:
+            return None
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return self.expires is not None and time.monotonic() >= self.expires
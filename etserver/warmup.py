@@ -0,0 +1,101 @@
+"""Warmup of the shared project cache at startup
+
+Project information cached on disk is loaded into the cache shared by
+workers before they are reported ready, so freshly deployed workers answer
+popular projects from memory right away. Files are listed and read in a
+thread, leaving the event loop free.
+"""
+import asyncio
+import json
+from pathlib import Path
+
+from . import CACHEDIR, logger
+from .getters import LEGACY_STATS, share_project
+
+ORDERS = ("recent", "popular")
+
+
+def cached_projects(cachedir=CACHEDIR):
+    """Return paths of cached projects by "owner/repo" name"""
+    return {
+        path.stem.replace("--", "/", 1): path
+        for path in Path(cachedir).glob("*--*.json")
+    }
+
+
+def recent_projects(cachedir=CACHEDIR, limit=1000):
+    """Return the projects whose cache was last written most recently"""
+    paths = cached_projects(cachedir)
+    mtimes = {}
+    for name, path in paths.items():
+        try:
+            mtimes[name] = path.stat().st_mtime
+        except OSError:
+            continue
+    return sorted(mtimes, key=mtimes.get, reverse=True)[:limit]
+
+
+def popular_projects(cachedir=CACHEDIR, limit=1000, weeks=4):
+    """
+    Return the projects with the most requests over their last weeks of
+    persisted statistics
+    """
+    paths = cached_projects(cachedir)
+    counts = {}
+    for name in paths:
+        path = Path(cachedir) / "stats" / "{}.json".format(name.replace("/", "--"))
+        try:
+            stats = json.loads(path.read_text()).get("stats") or {}
+        except (OSError, ValueError):
+            stats = {}
+        counts[name] = sum(stats[week] for week in sorted(stats)[-weeks:])
+    return sorted(counts, key=counts.get, reverse=True)[:limit]
+
+
+def load_projects(names, cachedir=CACHEDIR):
+    """Read cached information of projects, skipping unreadable files"""
+    projects = {}
+    for name in names:
+        path = Path(cachedir) / "{}.json".format(name.replace("/", "--"))
+        try:
+            projects[name] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+    return projects
+
+
+def select_projects(cachedir=CACHEDIR, limit=1000, order="recent"):
+    """Select and read cached projects to warm up with"""
+    if order not in ORDERS:
+        raise ValueError(f"Unknown warmup order {order}")
+    select = recent_projects if order == "recent" else popular_projects
+    return load_projects(select(cachedir, limit), cachedir)
+
+
+async def warm_cache(shared, projects=1000, order="recent", cachedir=CACHEDIR):
+    """
+    Load cached projects into the shared cache
+
+    Projects already shared, by another worker or a previous run, are kept.
+    Projects still holding their statistics are left to their first lookup,
+    which moves the statistics to their own cache.
+
+    :param projects: maximum number of projects loaded
+    :param order: load the most `recent` or `popular` projects
+    :return: number of projects loaded
+    """
+    loop = asyncio.get_event_loop()
+    found = await loop.run_in_executor(
+        None, select_projects, cachedir, projects, order
+    )
+    loaded = 0
+    for i, (name, project_info) in enumerate(found.items()):
+        if any(key in project_info for key in LEGACY_STATS):
+            continue
+        if shared.get(name) is None and share_project(shared, name, project_info):
+            loaded += 1
+        if i % 100 == 99:
+            # let requests through between batches
+            await asyncio.sleep(0)
+    logger.info(f"Warmed up the shared cache with {loaded} projects")
+    return loaded